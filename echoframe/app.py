@@ -17,10 +17,17 @@ from flask import Flask, render_template, render_template_string, request, redir
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
 from auto_login import setup_auto_login
 from persistent_storage import storage # Use the persistent storage helper
+from user_paths import snake_code_dir, replay_dir as user_replay_dir # Per-user paths (sharded layout)
+from snake_code_store import code_store # Content-addressed student code, one manifest per echo level
+from snake_history import history # Version entry per quest submission and preview run
+from migrate_storage import import_intro_markers # One-time import of the old .seen marker files
 from snake_starters import SNAKE_STARTER_CODE
+import grading_sandbox # Isolated worker processes for grading quest submissions
+from compile_cache import compile_cache # Shared code-object cache for grading and /snake_bytecode
 
 # Add import for student-driven snake implementation
 import student_driven_snake
+from snake_replay import files_sha256
 
 # --- Snake Echo Arc File Management ---
 def ensure_proper_formatting(filename, content):
@@ -93,14 +100,6 @@ def create_or_update_user_snake_files(username, echo_level):
     if echo_level != valid_echo_level:
         print(f"Warning: Echo level {echo_level} out of range, using echo level {valid_echo_level} instead.")
 
-    # Create the user's base directory
-    user_base_dir = os.path.join('user_data', 'snake_code', username)
-    os.makedirs(user_base_dir, exist_ok=True)
-
-    # Create a specific directory for this echo level
-    echo_dir = os.path.join(user_base_dir, f'snake_echo_{valid_echo_level+1}')
-    os.makedirs(echo_dir, exist_ok=True)
-
     # Get starter code for the current echo level
     try:
         starter_files = SNAKE_STARTER_CODE[valid_echo_level]
@@ -113,38 +112,29 @@ def create_or_update_user_snake_files(username, echo_level):
             print("Error: SNAKE_STARTER_CODE is empty. Cannot create files.")
             return {}
 
+    existing_files = code_store.read(username, valid_echo_level)
     editor_files = {}
+    updates = {}
 
     # For each file in the starter code, create or update the user's file
     for filename, content in starter_files.items():
         # Ensure proper formatting, especially for food.py
         formatted_content = ensure_proper_formatting(filename, content)
-
-        file_path = os.path.join(echo_dir, filename)
+        existing_content = existing_files.get(filename)
 
         # Only create the file if it doesn't exist yet
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as f:
-                f.write(formatted_content)
-            print(f"Created new file {file_path} for echo level {valid_echo_level}")
-        else:
-            # Check if existing file needs formatting fix
-            with open(file_path, 'r') as f:
-                existing_content = f.read()
-
-            if filename == 'food.py' and existing_content.count('\n') < 5:
-                # Fix existing malformatted food.py file
-                with open(file_path, 'w') as f:
-                    f.write(formatted_content)
-                print(f"Fixed formatting in existing {file_path}")
-
-        # Read the current content (either new or existing)
-        with open(file_path, 'r') as f:
-            current_content = f.read()
-
-        # Add to the dictionary of files to show in the editor
-        editor_files[filename] = current_content
-
+        if existing_content is None:
+            updates[filename] = formatted_content
+            print(f"Created new file {filename} for echo level {valid_echo_level}")
+        elif filename == 'food.py' and existing_content.count('\n') < 5:
+            # Fix existing malformatted food.py file
+            updates[filename] = formatted_content
+            print(f"Fixed formatting in existing {filename} for echo level {valid_echo_level}")
+
+        # Add the current content (either new or existing) to the files shown in the editor
+        editor_files[filename] = updates.get(filename, existing_content)
+
+    code_store.write(username, valid_echo_level, updates) # No-op when nothing changed
     return editor_files
 
 def get_user_snake_files(username, echo_level=None):
@@ -162,38 +152,22 @@ def get_user_snake_files(username, echo_level=None):
     if not username:
         return {}
 
-    user_base_dir = os.path.join('user_data', 'snake_code', username)
+    user_base_dir = snake_code_dir(username)
     if not os.path.isdir(user_base_dir):
         return {}
 
     user_files = {}
 
-    # If echo_level is specified, only look in that echo's directory
+    # If echo_level is specified, only return that echo's files
     if echo_level is not None and 0 <= echo_level <= 9:
-        echo_dir = os.path.join(user_base_dir, f'snake_echo_{echo_level+1}')
-        if os.path.isdir(echo_dir):
-            for filename in os.listdir(echo_dir):
-                if filename.endswith('.py'):
-                    try:
-                        with open(os.path.join(echo_dir, filename), 'r') as f:
-                            user_files[filename] = f.read()
-                    except Exception as e:
-                        print(f"Error reading user file {filename}: {e}")
-        return user_files
-
-    # Otherwise, look through all echo directories
+        return {filename: content for filename, content in code_store.read(username, echo_level).items()
+                if filename.endswith('.py')}
+
+    # Otherwise, look through all echo levels
     for i in range(10):  # 0-9 echo levels
-        echo_dir = os.path.join(user_base_dir, f'snake_echo_{i+1}')
-        if os.path.isdir(echo_dir):
-            for filename in os.listdir(echo_dir):
-                if filename.endswith('.py'):
-                    try:
-                        # Include echo level in the key to differentiate files
-                        key = f"echo_{i+1}/{filename}"
-                        with open(os.path.join(echo_dir, filename), 'r') as f:
-                            user_files[key] = f.read()
-                    except Exception as e:
-                        print(f"Error reading user file {echo_dir}/{filename}: {e}")
+        for filename, content in code_store.read(username, i).items():
+            if filename.endswith('.py'):
+                user_files[f"echo_{i+1}/{filename}"] = content # Include echo level in the key to differentiate files
 
     # Also include any files in the root of the user's directory for backward compatibility
     for filename in os.listdir(user_base_dir):
@@ -242,21 +216,17 @@ def get_echo_level_files(username, echo_level):
         9: {'constants.py', 'snake.py', 'snake_class.py', 'food.py'},  # Echo 10: Game Over & Restart
     }
 
-    # Specific directory for this echo level
-    echo_dir = os.path.join('user_data', 'snake_code', username, f'snake_echo_{valid_echo_level+1}')
-
-    # Check if the directory exists
-    if not os.path.isdir(echo_dir):
-        # If directory doesn't exist, create it and its files from starter code
+    # The user's stored files for this echo level
+    user_files = code_store.read(username, valid_echo_level)
+    if not user_files:
+        # Nothing stored yet: start from the starter code
         return create_or_update_user_snake_files(username, valid_echo_level)
 
     # Get files for the specified echo level
     filtered_files = {}
-    # Ensure echo_dir exists for writing updated files
-    os.makedirs(echo_dir, exist_ok=True) # Ensure echo_dir is created before trying to write files
+    updates = {} # Starter files to store (written once below, skipped if unchanged)
 
     for filename in echo_files.get(valid_echo_level, {}): # These are the filenames expected for the current echo level
-        file_path = os.path.join(echo_dir, filename)
         content_to_use = None
         source_description = "" # For logging/debugging
 
@@ -269,12 +239,11 @@ def get_echo_level_files(username, echo_level):
             # This guards against misconfigurations in 'echo_files'
             if filename not in SNAKE_STARTER_CODE[valid_echo_level]:
                 print(f"Warning: File '{filename}' is expected per 'echo_files' for echo_level {valid_echo_level}, but it's not defined in SNAKE_STARTER_CODE[{valid_echo_level}]. Trying to load from user's directory or skipping.")
-                if os.path.exists(file_path):
-                    with open(file_path, 'r') as f:
-                        content_to_use = f.read()
+                if filename in user_files:
+                    content_to_use = user_files[filename]
                     source_description = "existing user file (starter definition missing)"
                 else:
-                    print(f"Warning: File '{filename}' also not found in user directory {file_path}. Skipping this file.")
+                    print(f"Warning: File '{filename}' also not found in the user's echo {valid_echo_level + 1} files. Skipping this file.")
                     continue # Skip this file entirely
             else:
                 # Filename exists in SNAKE_STARTER_CODE for this level
@@ -282,29 +251,26 @@ def get_echo_level_files(username, echo_level):
                 formatted_starter_content = ensure_proper_formatting(filename, starter_content)
 
                 if filename == "constants.py":
-                    # For constants.py, always use the starter content and overwrite
+                    # For constants.py, always use the starter content (stored only when it differs)
                     content_to_use = formatted_starter_content
-                    with open(file_path, 'w') as f:
-                        f.write(content_to_use)
+                    updates[filename] = content_to_use
                     source_description = "starter code (constants.py - always refresh)"
                 else:
                     # For other files, prioritize user's existing file
-                    if os.path.exists(file_path):
-                        with open(file_path, 'r') as f:
-                            content_to_use = f.read()
+                    if filename in user_files:
+                        content_to_use = user_files[filename]
                         source_description = "existing user file"
                         # Optional: Could compare with starter_content and decide to refresh if starter is "newer"
                         # For now, simple "if exists, use" for student-editable files.
                     else:
-                        # File doesn't exist in user's dir, so use starter content and write it
+                        # File doesn't exist in the user's files, so use starter content and store it
                         content_to_use = formatted_starter_content
-                        with open(file_path, 'w') as f:
-                            f.write(content_to_use)
+                        updates[filename] = content_to_use
                         source_description = "starter code (user file did not exist)"
 
             if content_to_use is not None:
                 filtered_files[filename] = content_to_use
-                # print(f"File '{file_path}': using {source_description}.")
+                # print(f"File '{filename}': using {source_description}.")
 
         except IndexError as e:
             # This typically means valid_echo_level is out of range for SNAKE_STARTER_CODE overall
@@ -318,6 +284,7 @@ def get_echo_level_files(username, echo_level):
             print(f"An unexpected error occurred while processing file '{filename}' for echo_level {valid_echo_level}: {str(e)}")
             traceback.print_exc() # Print full traceback for unexpected errors
 
+    code_store.write(username, valid_echo_level, updates) # No disk writes when the stored files already match
     return filtered_files
 
 def get_user_snake_echo_level(username):
@@ -406,7 +373,8 @@ except ImportError as e:
 
 # --- Flask App and SocketIO Initialization ---
 app = Flask(__name__)
-setup_auto_login(app)
+import_intro_markers(storage) # Nothing to do once user_data/intro_markers/ is gone
+user_index = setup_auto_login(app) # In-memory user list for the auto-login check
 app.secret_key = "echoframe-core-sigil" # Ensure you have a strong secret key
 # Use a very stable configuration with long timeouts
 socketio = SocketIO(
@@ -422,37 +390,25 @@ socketio = SocketIO(
 )
 
 # --- Helper Functions for Snake Intro Tracking ---
-# (Keep existing snake_intro_seen, mark_snake_intro_seen)
+# The flag lives in the user record (user_data['snake_intro_seen']), served from the storage cache.
+# Older installs kept a user_data/intro_markers/<user>.seen file instead; those are imported at startup.
 def snake_intro_seen(username):
     # Check if username is valid
     if not username or not isinstance(username, str):
         print(f"Warning: Invalid username '{username}' passed to snake_intro_seen.")
         return False
-    marker_dir = os.path.join('user_data', 'intro_markers'); os.makedirs(marker_dir, exist_ok=True)
-    # Sanitize username for filename
-    safe_username = "".join(c for c in username if c.isalnum() or c in "._- ")
-    if not safe_username: # Handle cases where username becomes empty after sanitization
-         print(f"Warning: Username '{username}' resulted in empty safe filename.")
-         return False
-    marker_file = os.path.join(marker_dir, f"{safe_username}.seen");
-    return os.path.exists(marker_file)
+    return bool(storage.get_user_value(username, 'snake_intro_seen', False))
 
 def mark_snake_intro_seen(username):
     # Check if username is valid
     if not username or not isinstance(username, str):
         print(f"Warning: Invalid username '{username}' passed to mark_snake_intro_seen.")
         return
-    marker_dir = os.path.join('user_data', 'intro_markers'); os.makedirs(marker_dir, exist_ok=True)
-    # Sanitize username for filename
-    safe_username = "".join(c for c in username if c.isalnum() or c in "._- ")
-    if not safe_username: # Handle cases where username becomes empty after sanitization
-        print(f"Warning: Username '{username}' resulted in empty safe filename. Cannot mark intro seen.")
+    if snake_intro_seen(username): # Already set, no save needed
         return
-    marker_file = os.path.join(marker_dir, f"{safe_username}.seen")
-    try:
-        with open(marker_file, 'w') as f: f.write("seen")
-    except IOError as e:
-        print(f"Error: Could not write intro marker file for {username}: {e}")
+    user_data = load_pet_data(username)
+    user_data['snake_intro_seen'] = True
+    save_pet_data(username, user_data)
 
 
 # --- Load Quests ---
@@ -604,6 +560,8 @@ slith_phrases = [
 ]
 # Time interval for showing Slith phrases
 SLITH_INTERVAL = timedelta(minutes=30)
+# Record snake preview replays (see snake_replay.py) for every session; clients can also opt in per preview
+RECORD_SNAKE_REPLAYS = False
 
 # --- Pet Data Loading/Saving Helpers (Defined in App Context) ---
 # These interact with the persistent_storage module
@@ -840,10 +798,7 @@ def snake_intro():
     # Redirect if user is not logged in
     if "snaker_name" not in session: return redirect(url_for("identify"))
     username = session["snaker_name"]
-    mark_snake_intro_seen(username) # Mark the intro as seen (creates marker file)
-    user_data = load_pet_data(username) # Load user data
-    user_data["snake_intro_seen"] = True # Update flag in stored data too
-    save_pet_data(username, user_data) # Save the change
+    mark_snake_intro_seen(username) # Mark the intro as seen (flag in the user record)
     session["snake_intro_seen"] = True # Update session flag
     session.modified = True # Mark session as modified
     # Render the snake intro template
@@ -867,15 +822,8 @@ def snake_bytecode():
     if echo_level == -1:
         echo_level = 0
     files = get_user_snake_files(username, echo_level)
-    compiled = {}
-    for name, code in files.items():
-        try:
-            code_obj = compile(code, name, "exec")
-            import dis
-            bc = dis.Bytecode(code_obj)
-            compiled[name] = "\n".join(f"{instr.opname} {instr.argrepr}" for instr in bc)
-        except Exception as e:
-            compiled[name] = f"Compilation error: {e}"
+    # Listings come from the shared compile cache, so unchanged files skip parsing and disassembly
+    compiled = {name: compile_cache.disassemble(code, name) for name, code in files.items()}
     return render_template(
         "snake_bytecode.html",
         files=files,
@@ -971,47 +919,28 @@ def quest(qid):
                 print("Error serializing files_json:", e)
                 files_json = {}
 
-            # Save the user's code to their directory
-            user_dir = os.path.join('user_data', 'snake_code', username)
-            os.makedirs(user_dir, exist_ok=True)
-            for filename, code in files_json.items():
-                try:
-                    with open(os.path.join(user_dir, filename), 'w') as f:
-                        f.write(code)
-                    print(f"Saved user's code to {os.path.join(user_dir, filename)}")
-                except Exception as e:
-                    print(f"Error saving user code: {e}")
+            # Save the user's code under this quest's echo level (unchanged files aren't rewritten)
+            echo_idx = max(0, min(idx, len(SNAKE_STARTER_CODE) - 1))
+            try:
+                if code_store.write(username, echo_idx, files_json):
+                    print(f"Saved user's code for echo level {echo_idx}")
+            except Exception as e:
+                print(f"Error saving user code: {e}")
 
             # Execute the snake code (multiple files)
-            result_str, dbg, err = run_snake(files_json, quest_data.get("check_var"))
-            debug_output = dbg; error = err # Store output and error
-            expected_value_str = quest_data.get("expected") # Get expected result
-
-            # Check success based on expected value type
-            if error is None:
-                if expected_value_str == "exists": # Check if methods/vars exist
-                    check_vars = quest_data.get("check_var", "").split(',')
-                    results = result_str.split(',') if result_str else []
-                    all_exist = len(check_vars) == len(results) and all(r == "True" for r in results)
-                    success = all_exist
-                    if not success:
-                        error = f"Required method(s) not found/callable."
-                elif "," in quest_data.get("check_var", ""):
-                    check_vars = quest_data.get("check_var", "").split(',')
-                    expected_vals = expected_value_str.split(',') if expected_value_str else []
-                    results = result_str.split(',') if result_str else []
-                    all_match = False
-                    if len(check_vars) == len(expected_vals) and len(check_vars) == len(results):
-                        all_match = all(results[i] == expected_vals[i] for i in range(len(check_vars)))
-                        if not all_match:
-                            error = "Incorrect value(s)."
-                    else:
-                        error = "Mismatch in number of checked variables/expected/results."
-                    success = all_match
-                else: # Check single value
-                    success = (expected_value_str is not None and result_str == expected_value_str)
-                    if not success:
-                        error = f"Incorrect output. Expected '{expected_value_str}', got '{result_str}'."
+            result_str, dbg, err, err_line = run_snake(files_json, quest_data.get("check_var"))
+            debug_output = dbg; error_line = err_line # Store output, error line
+            # Check success based on expected value type (shared with the batch regrader)
+            success, error = grading_sandbox.evaluate_snake_result(result_str, err, quest_data.get("check_var"),
+                                                                   quest_data.get("expected"))
+            # Then play the game under the quest's scripted scenarios, if it has any
+            if success and quest_data.get("behavior"):
+                success, error = run_snake_behavior(files_json, quest_data)
+            try:
+                history.record(username, files_json, qid=qid, echo_level=echo_idx, source='quest',
+                               result='pass' if success else 'fail', error=error)
+            except Exception as e:
+                print(f"Error recording submission history: {e}")
         else: # Handle Beginner Quest code execution
             print(f"[ROUTE] quest({qid}) - beginner mode, running run_single")
             code = request.form.get("code", "") # Get code from form
@@ -1114,163 +1043,24 @@ def quest(qid):
 
 
 # --- Execution Helpers ---
+# Student code runs in the grading sandbox's worker processes, never in the server process.
 def run_single(code: str, check_var: str = None):
     print(f"[HELPER] run_single() called, check_var: {check_var}")
-    old_stdout = sys.stdout # Store original stdout
-    redirected_output = StringIO() # Create buffer to capture print output
-    sys.stdout = redirected_output # Redirect stdout to buffer
-    env = {} # Execution environment
-    err = None # Error message
-    err_line = None # Line number of error
-    result = None # Result of check_var
-
-    try:
-        if code is None: raise ValueError("Received None code.") # Handle None input
-        print("[HELPER] run_single() compiling and executing code")
-        # Compile and execute the code in the environment
-        compiled_code = compile(code, "<string>", "exec")
-        exec(compiled_code, env)
-    except Exception as e:
-        # Capture error message and traceback
-        err = f"{type(e).__name__}: {e}"
-        tb = traceback.extract_tb(e.__traceback__)
-        # Find the line number where the error occurred in the executed code
-        err_line = next((fr.lineno for fr in reversed(tb) if fr.filename == "<string>"), None)
-    finally:
-        print("[HELPER] run_single() restoring stdout")
-        sys.stdout = old_stdout # Restore original stdout
-
-    debug_output = redirected_output.getvalue() # Get captured print output
-    env["__output__"] = debug_output.strip() # Store stripped output in env
-
-    # Get the result based on check_var
-    if check_var == "__output__":
-        result = env["__output__"] # Check the captured print output
-    elif check_var:
-        result = env.get(check_var) # Check a specific variable in the env
-
-    # Convert result to string for comparison
-    result_str = str(result) if result is not None else None
+    result_str, debug_output, err, err_line = grading_sandbox.get_sandbox().submit_single(code, check_var).result()
     print(f"[HELPER] run_single() returning result: {result_str}, error: {err}, error_line: {err_line}")
     return result_str, debug_output, err, err_line
 
 def run_snake(files: dict, check_var_str: str = None):
     print(f"[HELPER] run_snake() called, check_var_str: {check_var_str}")
-    old_stdout = sys.stdout # Store original stdout
-    redirected_output = StringIO() # Buffer for print output
-    sys.stdout = redirected_output # Redirect stdout
-
-    # Set pygame to headless mode to prevent window from opening
-    os.environ['SDL_VIDEODRIVER'] = 'dummy'
-
-    # Create the execution environment with some common modules pre-imported
-    env = {
-        'pygame': __import__('pygame'),
-        'random': __import__('random'),
-        'sys': __import__('sys')
-    }
-    err = None # Error message
-    results = [] # Store results for multiple checks if requested
-
-    # Define a reasonable execution order for snake game files
-    execution_order = ['constants.py', 'snake_class.py', 'food.py', 'snake.py']
-    files_to_execute = []
-
-    # Add files in the defined order if they exist in the input dictionary
-    for fname in execution_order:
-        if fname in files:
-            files_to_execute.append((fname, files[fname]))
-
-    # Add any remaining files not in the defined order (e.g., utils.py)
-    for fname, src in files.items():
-        if fname not in dict(files_to_execute):
-             files_to_execute.append((fname, src))
-
-    # Execute files sequentially in the same shared environment 'env'
-    for fname, src in files_to_execute:
-        if src is None: # Skip if file content is None
-             print(f"Warning: Skipping execution of {fname} due to None content.")
-             continue
-        try:
-            print(f"[HELPER] run_snake() executing file: {fname}")
-            # Compile and execute the code
-            compiled_code = compile(src, fname, 'exec')
-            exec(compiled_code, env)
-            print(f"[HELPER] run_snake() executed {fname} successfully")
-        except SyntaxError as se:
-            # Handle syntax errors specifically
-            err = f"SyntaxError in {fname}: {se}"
-            break # Stop execution on first error
-        except Exception as e:
-            # Handle other runtime errors
-            err = f"Error in {fname}: {type(e).__name__}: {e}"
-            tb = traceback.extract_tb(e.__traceback__)
-            # Find the line number within the specific file's execution context
-            lineno = next((fr.lineno for fr in reversed(tb) if fr.filename == fname), None)
-            if lineno:
-                err += f" (line {lineno})" # Add line number to error message
-            break # Stop execution on first error
-
-    # --- Result Checking Logic (Handles multiple checks and method existence) ---
-    if err is None and check_var_str: # Only check if no execution error occurred
-        check_vars = check_var_str.split(',') # Split if multiple checks requested
-        for check_var in check_vars:
-            check_var = check_var.strip() # Remove leading/trailing whitespace
-            current_result = None
-            if check_var.startswith("method:"):
-                # Check for method existence and callability (e.g., "method:snake.update")
-                method_path = check_var[len("method:"):]
-                parts = method_path.split('.')
-                obj = env.get(parts[0]) # Get the base object (e.g., 'snake' instance)
-                method_exists = False
-                if obj is not None and len(parts) > 1:
-                    try:
-                        target_obj = obj # Start with the base object
-                        method_name = parts[-1] # The actual method name
-                        # Traverse intermediate attributes if any (e.g., obj.sub_obj.method)
-                        for part in parts[1:-1]:
-                            target_obj = getattr(target_obj, part, None)
-                            if target_obj is None: # Check if intermediate part exists
-                                break # Stop traversal if part not found
-                        # Check if the final attribute exists and is callable
-                        if target_obj is not None:
-                            method = getattr(target_obj, method_name, None)
-                            if method is not None and callable(method):
-                                method_exists = True # Method exists and is callable
-                    except AttributeError:
-                        method_exists = False # Attribute not found during traversal
-                current_result = str(method_exists) # Result is "True" or "False" string
-
-            elif '.' in check_var:
-                # Handle nested attribute access (e.g., 'snake.direction')
-                try:
-                    parts = check_var.split('.')
-                    obj = env.get(parts[0]) # Get the base object
-                    # Traverse attributes
-                    for part in parts[1:]:
-                        if obj is not None:
-                            obj = getattr(obj, part, None) # Safely get attribute
-                        else:
-                            break # Stop if intermediate object is None
-                    current_result = str(obj) if obj is not None else "None" # Convert result to string
-                except Exception: # Catch potential errors during attribute access
-                    current_result = "Error"
-            else:
-                # Get simple variable from the environment
-                value = env.get(check_var)
-                current_result = str(value) if value is not None else "None" # Convert to string
-
-            results.append(current_result) # Add the result for this check to the list
-
-    # --- Final Cleanup and Return ---
-    sys.stdout = old_stdout # Restore original standard output
-    debug_output = redirected_output.getvalue() # Get any captured print output
-
-    # Join results with commas if multiple checks were performed
-    final_result_str = ",".join(results) if results else None
-
+    final_result_str, debug_output, err, err_line = grading_sandbox.get_sandbox().submit_snake(files, check_var_str).result()
     print(f"[HELPER] run_snake() returning: {final_result_str}, error: {err}")
-    return final_result_str, debug_output, err
+    return final_result_str, debug_output, err, err_line
+
+def run_snake_behavior(files: dict, quest_data: dict):
+    print(f"[HELPER] run_snake_behavior() called for quest: {quest_data.get('title')}")
+    success, error = grading_sandbox.grade_snake_behavior(grading_sandbox.get_sandbox(), files, quest_data)
+    print(f"[HELPER] run_snake_behavior() returning: {success}, error: {error}")
+    return success, error
 
 
 # --- Manifesto & Reset ---
@@ -1315,16 +1105,7 @@ def reset():
     print("[ROUTE] reset() called")
     username = session.get("snaker_name", "") # Get username from session
     if username:
-        storage.delete_user_data(username) # Delete the user's data file
-        # Manually delete the snake intro marker file if it exists
-        safe_username = "".join(c for c in username if c.isalnum() or c in "._- ")
-        if safe_username: # Proceed only if safe username is not empty
-            marker_file = os.path.join('user_data', 'intro_markers', f"{safe_username}.seen")
-            if os.path.exists(marker_file):
-                try:
-                    os.remove(marker_file) # Attempt to remove marker file
-                except OSError as e:
-                    print(f"Warning: Could not remove marker file {marker_file}: {e}")
+        storage.delete_user_data(username) # Delete the user's data file (snake_intro_seen goes with it)
     session.clear() # Clear the Flask session data
     return redirect(url_for("identify")) # Redirect to the identification page
 
@@ -1483,6 +1264,7 @@ def handle_connect():
         disconnect()
     else:
         join_room(request.sid)
+        student_driven_snake.register_session(request.sid, session['snaker_name'], request.referrer)
         print(f"Client connected: {request.sid}, User: {session['snaker_name']}")
 
 # Handle WebSocket client disconnection
@@ -1496,6 +1278,7 @@ def handle_disconnect(*args):
         del active_simulations[sid]
     if sid in client_inputs:
         del client_inputs[sid]
+    student_driven_snake.drop_session(sid)
 
 # Handle request from client to start the snake game preview
 @socketio.on('start_snake_preview')
@@ -1518,35 +1301,38 @@ def handle_start_preview(data):
         echo_level = get_user_snake_echo_level(username)
         if echo_level == -1:
             echo_level = 0
-    echo_dir = os.path.join('user_data', 'snake_code', username, f'snake_echo_{echo_level+1}')
-    os.makedirs(echo_dir, exist_ok=True)
-    user_files = {}
-    if os.path.exists(echo_dir):
-        for filename in os.listdir(echo_dir):
-            if filename.endswith('.py'):
-                try:
-                    with open(os.path.join(echo_dir, filename), 'r') as f:
-                        user_files[filename] = f.read()
-                except Exception as e:
-                    print(f"[Snake Preview] Error reading user file {echo_dir}/{filename}: {e}")
-    files_to_use = user_files if user_files else editor_files
+    user_files = {filename: content for filename, content in code_store.read(username, echo_level).items()
+                  if filename.endswith('.py')}
+    files_to_use = dict(user_files if user_files else editor_files)
     if not files_to_use:
         starter_files = create_or_update_user_snake_files(username, echo_level)
         if starter_files:
-            files_to_use = starter_files
-    for filename, content in editor_files.items():
-        try:
-            file_path = os.path.join(echo_dir, filename)
-            with open(file_path, 'w') as f:
-                f.write(content)
-            files_to_use[filename] = content
-        except Exception as e:
-            print(f"[Snake Preview] Error saving editor content to file {echo_dir}/{filename}: {e}")
+            files_to_use = dict(starter_files)
+    editor_files = {filename: content for filename, content in editor_files.items() if isinstance(content, str)}
+    try:
+        code_store.write(username, echo_level, editor_files) # Skipped when the editor matches what's stored
+    except Exception as e:
+        print(f"[Snake Preview] Error saving editor content for echo level {echo_level}: {e}")
+    files_to_use.update(editor_files)
+    try:
+        history.record(username, files_to_use, qid=int(qid) if qid is not None else None, echo_level=echo_level)
+    except Exception as e:
+        print(f"[Snake Preview] Error recording history: {e}")
     if sid in student_driven_snake.active_simulations:
         student_driven_snake.stop_student_snake(sid)
         eventlet.sleep(0.1)
+    student_driven_snake.update_session(sid, qid=int(qid) if qid is not None else None, echo_level=echo_level + 1,
+                                        files_hash=files_sha256(files_to_use).hex())
     print(f"[Snake Preview] Starting student_driven_snake with {len(files_to_use)} files for SID: {sid}")
-    socketio.start_background_task(student_driven_snake.run_student_snake, socketio, sid, files_to_use, echo_level)
+    try:
+        frame_protocol = int(data.get('protocol', 0)) # Clients that understand 'game_frame' deltas send protocol >= 1
+    except (TypeError, ValueError):
+        frame_protocol = 0
+    replay_dir = None
+    if RECORD_SNAKE_REPLAYS or data.get('record_replay'):
+        replay_dir = user_replay_dir(username)
+    socketio.start_background_task(student_driven_snake.run_student_snake, socketio, sid, files_to_use, echo_level,
+                                   frame_protocol, replay_dir)
     socketio.emit('preview_started', {
         'message': 'Preview simulation started.',
         'instructions': 'Use arrow keys or WASD to control the snake. Click the game area if controls are not working.',
@@ -1568,27 +1354,42 @@ def stop_preview():
 def handle_change_direction(data): # sid is from request.sid
     sid = request.sid
     direction = data.get('direction')
+    client_time = data.get('t') # Client timestamp (ms) of the key press, echoed back for latency display
+    if not isinstance(client_time, (int, float)) or isinstance(client_time, bool):
+        client_time = None
 
     if direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
-        # Directly update the authoritative client_inputs in student_driven_snake.py
-        student_driven_snake.client_inputs[sid] = direction
-        print(f"[app.py handle_change_direction SID: {sid}] student_driven_snake.client_inputs updated to: {direction}")
-
-        if not student_driven_snake.active_simulations.get(sid):
-            print(f"[{sid}] INFO from app.py: Direction input '{direction}' processed. student_driven_snake.active_simulations for SID {sid} is currently False or SID not found. client_inputs was still updated.")
-        # else:
-        #     print(f"[{sid}] INFO from app.py: Direction input '{direction}' processed for an active simulation.")
-        # No longer calling student_driven_snake.handle_direction_input from here.
+        # Queued in student_driven_snake; the preview scheduler delivers one input per tick
+        student_driven_snake.handle_direction_input(sid, direction, client_time)
     else:
         print(f"[app.py handle_change_direction SID: {sid}] Received invalid direction: {direction}")
 
+# The page reports keydown-to-draw and arrival-to-draw times for frames that showed an input
+@socketio.on('preview_latency')
+def handle_preview_latency(data):
+    if isinstance(data, dict):
+        student_driven_snake.get_latency_tracker().record_client(request.sid, data)
+
+# Latency overlay in the preview asks for this session's per-stage percentiles
+@socketio.on('get_preview_latency')
+def handle_get_preview_latency():
+    sid = request.sid
+    socketio.emit('preview_latency_stats', student_driven_snake.get_latency_tracker().get_stats(sid), room=sid)
+
 # Handler for get_current_state event to refresh game state on window resize
 @socketio.on('get_current_state')
 def handle_get_current_state():
     sid = request.sid
+    if student_driven_snake.request_keyframe(sid):
+        return # Frame protocol clients get the full state as the next keyframe
     if sid in student_driven_snake.active_simulations:
         student_driven_snake.force_state_update(socketio, sid, None)
 
+# Handle a client asking for a keyframe after it lost track of the delta frames
+@socketio.on('request_keyframe')
+def handle_request_keyframe():
+    student_driven_snake.request_keyframe(request.sid)
+
 # Handle ping_keepalive messages from the client to keep the connection alive
 @socketio.on('ping_keepalive')
 def handle_ping_keepalive(data):
@@ -1623,6 +1424,79 @@ def debug_session():
     # Use default=str to handle non-serializable types like datetime
     return f"<pre>{json.dumps(data, indent=2, default=str)}</pre>"
 
+# Route to inspect the snake preview worker pool counters
+@app.route("/debug_snake_pool")
+def debug_snake_pool():
+    print("[ROUTE] debug_snake_pool() called")
+    return jsonify(student_driven_snake.get_preview_pool().get_stats())
+
+# Route to inspect the grading sandbox counters
+@app.route("/debug_grading_sandbox")
+def debug_grading_sandbox():
+    print("[ROUTE] debug_grading_sandbox() called")
+    return jsonify(grading_sandbox.get_sandbox().get_stats())
+
+# Route to inspect the compile cache hit/miss counters
+@app.route("/debug_compile_cache")
+def debug_compile_cache():
+    print("[ROUTE] debug_compile_cache() called")
+    return jsonify(compile_cache.get_stats())
+
+# Route to inspect the preview frame scheduler's tick jitter, overruns and shedding
+@app.route("/debug_frame_scheduler")
+def debug_frame_scheduler():
+    print("[ROUTE] debug_frame_scheduler() called")
+    return jsonify(student_driven_snake.get_frame_scheduler().get_stats())
+
+# Route to inspect per-preview CPU time, peak memory and resource limit hits
+@app.route("/debug_preview_usage")
+def debug_preview_usage():
+    print("[ROUTE] debug_preview_usage() called")
+    return jsonify(student_driven_snake.get_usage_accounting().get_stats())
+
+# Route to inspect input-to-frame latency per pipeline stage (?sid=<socket sid> for one session)
+@app.route("/debug_preview_latency")
+def debug_preview_latency():
+    print("[ROUTE] debug_preview_latency() called")
+    return jsonify(student_driven_snake.get_latency_tracker().get_stats(request.args.get('sid')))
+
+# Route to inspect the user record cache (hit ratio, dirty records, flush latency)
+@app.route("/debug_user_cache")
+def debug_user_cache():
+    print("[ROUTE] debug_user_cache() called")
+    return jsonify(storage.get_stats())
+
+# Route to list the user's snake code versions, newest first (?page=N&per_page=M)
+@app.route("/snake_history")
+def snake_history():
+    print("[ROUTE] snake_history() called")
+    if "snaker_name" not in session: return jsonify({'error': 'Authentication required.'}), 401
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    return jsonify(history.page(session["snaker_name"], page, per_page))
+
+# Route to fetch the files of one version for restoring them into the editor
+@app.route("/snake_history/<int:version>")
+def snake_history_version(version):
+    print(f"[ROUTE] snake_history_version({version}) called")
+    if "snaker_name" not in session: return jsonify({'error': 'Authentication required.'}), 401
+    entry, files = history.restore(session["snaker_name"], version)
+    if entry is None:
+        return jsonify({'error': f'Version {version} not found.'}), 404
+    return jsonify({'version': entry['v'], 't': entry['t'], 'qid': entry['qid'], 'files': files})
+
+# Route to inspect the snake code store (manifest/blob cache hits, writes skipped vs written)
+@app.route("/debug_code_store")
+def debug_code_store():
+    print("[ROUTE] debug_code_store() called")
+    return jsonify(code_store.get_stats())
+
+# Route to inspect the auto-login user index (size, rebuild count and time)
+@app.route("/debug_user_index")
+def debug_user_index():
+    print("[ROUTE] debug_user_index() called")
+    return jsonify(user_index.get_stats())
+
 # Route to serve student snake instructions
 @app.route("/snake_instructions")
 def snake_instructions():
@@ -1646,6 +1520,9 @@ def snake_test():
 # --- Main Execution ---
 if __name__ == "__main__":
     print("Starting Flask-SocketIO server...")
+    # Pre-fork the snake preview workers so the first previews don't pay pygame's startup cost
+    student_driven_snake.get_preview_pool().start()
+    grading_sandbox.get_sandbox().start()
     try:
         # Try different ports if the default port is in use
         ports_to_try = [5001, 5002, 5003, 5004, 5005]
@@ -1,45 +1,120 @@
-import os
-import json
+import time
+import threading
 from flask import session, redirect, url_for, request
+from persistent_storage import safe_username
 
-def setup_auto_login(app, storage_dir='user_data'):
+USER_INDEX_CHECK_INTERVAL = 1.0 # Seconds between checks of the storage listing for users added by other processes
+
+class UserIndex:
+    """
+    Usernames in storage, kept in memory so auto-login doesn't scan user_data on every request
+
+    Saves and deletes through PersistentStorage update the index directly (add_listener);
+    users created or removed by other processes (slith_pet.py, copying files in) are picked
+    up by rebuilding when the backend's listing_version() changes, checked at most every
+    USER_INDEX_CHECK_INTERVAL seconds.
+    """
+    def __init__(self, storage, check_interval=USER_INDEX_CHECK_INTERVAL):
+        self.storage = storage
+        self.check_interval = check_interval
+        self._users = set()
+        self._lock = threading.Lock()
+        self._listing_version = None
+        self._checked_at = None
+        self.counters = {'lookups': 0, 'rebuilds': 0, 'rebuild_ms_total': 0.0, 'rebuild_ms_last': None,
+                         'rebuild_ms_max': 0.0, 'hook_updates': 0}
+        storage.add_listener(self._on_storage_event)
+
+    def _on_storage_event(self, event, username):
+        with self._lock:
+            if event == 'save':
+                self._users.add(safe_username(username))
+            elif event == 'delete':
+                self._users.discard(safe_username(username))
+            self.counters['hook_updates'] += 1
+
+    def rebuild(self):
+        """Re-read the user list from the backend"""
+        start = time.monotonic()
+        backend = self.storage.backend
+        version = backend.listing_version()
+        users = set(backend.users())
+        with self._lock:
+            self._users = users | {safe_username(u) for u in self.storage.unflushed_users()} # Saved, not on disk yet
+            self._listing_version = version
+        elapsed_ms = (time.monotonic() - start) * 1000
+        self.counters['rebuilds'] += 1
+        self.counters['rebuild_ms_total'] += elapsed_ms
+        self.counters['rebuild_ms_last'] = round(elapsed_ms, 3)
+        self.counters['rebuild_ms_max'] = max(self.counters['rebuild_ms_max'], round(elapsed_ms, 3))
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            if self._listing_version is None or self.storage.backend.listing_version() != self._listing_version:
+                self.rebuild()
+        except Exception as e:
+            print(f"Error refreshing user index: {str(e)}")
+
+    def single_user(self):
+        """The only stored user, or None if there are none or several"""
+        self._refresh()
+        self.counters['lookups'] += 1
+        with self._lock:
+            if len(self._users) != 1:
+                return None
+            return next(iter(self._users))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.counters, users=len(self._users))
+        stats['rebuild_ms_total'] = round(stats['rebuild_ms_total'], 3)
+        return stats
+
+def setup_auto_login(app, storage=None):
     """
-    Set up automatic login by checking for existing user data files
-    
-    Add this to your app.py to enable auto-login for returning users
+    Set up automatic login by checking for existing user data
+
+    Add this to your app.py to enable auto-login for returning users.
+    Returns the UserIndex the check uses (for its stats).
     """
-    
+    if storage is None:
+        from persistent_storage import storage
+    user_index = UserIndex(storage)
+
     @app.before_request
     def check_for_user():
         """Check if we need to automatically log the user in"""
         # Skip this check if the user is already logged in or if we're on the identify page
         if 'snaker_name' in session or request.endpoint == 'identify' or request.endpoint == 'static':
             return None
-            
-        # Look for user data files
-        if os.path.exists(storage_dir):
-            user_files = [f for f in os.listdir(storage_dir) if f.endswith('.json')]
-            
-            # If we have exactly one user file, auto-login that user
-            if len(user_files) == 1:
-                try:
-                    username = os.path.splitext(user_files[0])[0]
-                    with open(os.path.join(storage_dir, user_files[0]), 'r') as f:
-                        user_data = json.load(f)
-                    
-                    # Set up the session
-                    session['snaker_name'] = username
-                    session['xp'] = user_data.get('xp', 0)
-                    session['completed'] = user_data.get('completed', [])
-                    session['snake_intro_seen'] = user_data.get('snake_intro_seen', False)
-                    
-                    # Log the auto-login
-                    print(f"Auto-login for user: {username}")
-                except Exception as e:
-                    print(f"Error during auto-login: {str(e)}")
-        
+
+        # If we have exactly one user, auto-login that user
+        username = user_index.single_user()
+        if username is not None:
+            try:
+                user_data = storage.load_user_data(username)
+                if not isinstance(user_data, dict):
+                    raise ValueError(f"no readable user data for {username}")
+
+                # Set up the session
+                session['snaker_name'] = username
+                session['xp'] = user_data.get('xp', 0)
+                session['completed'] = user_data.get('completed', [])
+                session['snake_intro_seen'] = user_data.get('snake_intro_seen', False)
+
+                # Log the auto-login
+                print(f"Auto-login for user: {username}")
+            except Exception as e:
+                print(f"Error during auto-login: {str(e)}")
+
         # If no user is logged in at this point, redirect to the identify page
         if 'snaker_name' not in session:
             return redirect(url_for('identify'))
-        
-        return None
\ No newline at end of file
+
+        return None
+
+    return user_index
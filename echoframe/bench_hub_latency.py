@@ -0,0 +1,123 @@
+"""
+bench_hub_latency.py - Measure how much concurrent snake previews delay the eventlet hub.
+
+Starts N previews through run_student_snake (the same code path the socket handler uses)
+while a probe green thread sleeps 10 ms in a loop and records how late it wakes up. A late
+wake-up is time during which the hub could not serve HTTP requests or socket events.
+
+Usage (from the echoframe directory):
+    python bench_hub_latency.py                 # 1, 10 and 50 previews with cooperative waits
+    python bench_hub_latency.py --blocking      # Same, with blocking Connection.poll() when stopping workers
+    python bench_hub_latency.py --sessions 1 5  # Custom session counts
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import statistics
+import time
+
+import student_driven_snake
+
+PROBE_INTERVAL = 0.01  # Seconds the probe sleeps between wake-ups
+
+# Minimal student program: report state and ask for a direction every frame
+BENCH_PROGRAM = """
+snake = [[5, 5]]
+food = [9, 9]
+score = 0
+for _ in range(400):
+    direction = get_user_direction()
+    x, y = snake[0]
+    dx, dy = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}[direction]
+    snake = [[(x + dx) % 30, (y + dy) % 20]]
+"""
+
+
+class CountingSocketIO:
+    """Stands in for Flask-SocketIO; counts emitted frames instead of sending them."""
+
+    def __init__(self):
+        self.frames = 0
+        self.errors = []
+
+    def emit(self, event, data, room=None):
+        if event == 'preview_error':
+            self.errors.append(data.get('error'))
+        elif event in ('game_state_update', 'game_frame'):
+            self.frames += 1
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_case(sessions):
+    """Run `sessions` previews to completion and return the probe's lateness stats (ms)."""
+    socketio = CountingSocketIO()
+    lags = []
+    done = []
+
+    def probe():
+        while not done:
+            start = time.monotonic()
+            eventlet.sleep(PROBE_INTERVAL)
+            lags.append((time.monotonic() - start - PROBE_INTERVAL) * 1000)
+
+    def preview(i):
+        student_driven_snake.run_student_snake(socketio, f"bench-{i}", {'main.py': BENCH_PROGRAM}, 1)
+
+    probe_thread = eventlet.spawn(probe)
+    started = time.monotonic()
+    pool = eventlet.GreenPool(sessions)
+    for i in range(sessions):
+        pool.spawn(preview, i)
+    pool.waitall()
+    elapsed = time.monotonic() - started
+    done.append(True)
+    probe_thread.wait()
+    scheduler = student_driven_snake.get_frame_scheduler().get_stats()
+    return {
+        'sessions': sessions,
+        'seconds': round(elapsed, 2),
+        'frames': socketio.frames,
+        'errors': len(socketio.errors),
+        'lag_p50_ms': round(statistics.median(lags), 2) if lags else None,
+        'lag_p99_ms': round(_percentile(lags, 99), 2) if lags else None,
+        'lag_max_ms': round(max(lags), 2) if lags else None,
+        'scheduler': scheduler,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hub latency under concurrent snake previews")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--blocking', action='store_true',
+                        help="Use blocking Connection.poll() in the worker stop path (frames go through the scheduler)")
+    args = parser.parse_args()
+
+    if args.blocking:
+        student_driven_snake.wait_readable = lambda conn, timeout=None: conn.poll(timeout)
+    student_driven_snake.PREVIEW_USAGE_LOG = None # Keep bench sessions out of the real usage log
+    # Size the pool for the largest case so the numbers measure the supervisor, not cold spawns
+    student_driven_snake.PREVIEW_POOL_SIZE = max(args.sessions)
+    student_driven_snake.get_preview_pool().start()
+
+    mode = 'blocking poll' if args.blocking else 'cooperative'
+    print(f"[BENCH] Supervisor mode: {mode}")
+    print(f"{'sessions':>8} {'seconds':>8} {'frames':>7} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    try:
+        for sessions in args.sessions:
+            r = run_case(sessions)
+            print(f"{r['sessions']:>8} {r['seconds']:>8} {r['frames']:>7} {r['errors']:>6} "
+                  f"{r['lag_p50_ms']:>8} {r['lag_p99_ms']:>8} {r['lag_max_ms']:>8}")
+            sched = r['scheduler']
+            print(f"{'':>8} scheduler: jitter p99 {sched['jitter_ms_p99']} ms, overruns {sched['overruns']}, "
+                  f"slowed {sched['slowed']}, shed {sched['shed']} (cumulative)")
+    finally:
+        student_driven_snake.get_preview_pool().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+bench_storage.py - Compare the JSON-file and SQLite user storage backends under concurrent load.
+
+For each backend a temporary directory is filled with --users records shaped like a real
+user (completed quests, XP, a Slith pet), then --readers and --writers processes hammer
+random users for --seconds: readers load a record, writers load it, change a few fields and
+save it (what a quest POST or slith_pet.py does). Separate processes are used because that
+is where the backends differ: the app and slith_pet.py write the same records.
+
+A read that finds a half-written record (JSON decode error or a missing file) counts as torn;
+there should be none. JSON writes pay one fsync per save here (persistent_storage.JSON_FSYNC);
+the app's cache flushes batch them.
+
+Usage (from the echoframe directory):
+    python bench_storage.py                          # 4 readers, 2 writers, 3 s, 500 users
+    python bench_storage.py --readers 8 --writers 4 --seconds 5
+    python bench_storage.py --backends sqlite
+"""
+import argparse
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+
+from persistent_storage import make_backend
+
+
+def sample_record(i):
+    """A user record about the size of a real one."""
+    return {
+        'completed': list(range(i % 25)),
+        'xp': i * 10,
+        'active_items': ['terminal_green'],
+        'snake_intro_seen': True,
+        'slith_pet': {
+            'stage': 2, 'unlocked': True,
+            'vitals': {'food': 80, 'water': 70, 'entertainment': 60, 'love': 90, 'patience': 50},
+            'snaker_bits': 1200,
+            'inventory': {'food': {'byte_burger': 3}, 'accessories': {'neon_collar': 1}},
+            'high_scores': {'node_defender': 1500, 'terminal_typer': 80, 'neon_jetpack': 300, 'signal_tracer': 12},
+            'last_interaction_times': {'feed': 1700000000.0, 'play': 1700000100.0},
+        },
+    }
+
+
+def _worker(kind, storage_dir, users, role, seconds, seed, results):
+    backend = make_backend(kind, storage_dir)
+    rng = random.Random(seed)
+    ops = torn = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        username = f"user{rng.randrange(users)}"
+        try:
+            data = backend.read(username)
+        except (ValueError, OSError):
+            data = None
+        if data is None:
+            torn += 1
+            continue
+        if role == 'writer':
+            data['xp'] = data.get('xp', 0) + 1
+            data['slith_pet']['vitals']['food'] = rng.randrange(100)
+            backend.write(username, data)
+        ops += 1
+    results.put((role, ops, torn))
+
+
+def run_backend(kind, users, readers, writers, seconds):
+    """Fill a fresh directory, run the readers and writers, and return ops/s and torn reads."""
+    storage_dir = tempfile.mkdtemp(prefix=f"bench_storage_{kind}_")
+    try:
+        backend = make_backend(kind, storage_dir)
+        started = time.monotonic()
+        for i in range(users):
+            backend.write(f"user{i}", sample_record(i))
+        fill_seconds = time.monotonic() - started
+        if hasattr(backend, 'close'):
+            backend.close()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_worker, args=(kind, storage_dir, users, role, seconds, n, results))
+                 for n, role in enumerate(['reader'] * readers + ['writer'] * writers)]
+        for proc in procs:
+            proc.start()
+        totals = {'reader': [0, 0], 'writer': [0, 0]}
+        for _ in procs:
+            role, ops, torn = results.get()
+            totals[role][0] += ops
+            totals[role][1] += torn
+        for proc in procs:
+            proc.join()
+        return {
+            'fill_per_s': round(users / fill_seconds),
+            'reads_per_s': round(totals['reader'][0] / seconds),
+            'writes_per_s': round(totals['writer'][0] / seconds),
+            'torn_reads': totals['reader'][1] + totals['writer'][1],
+        }
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User storage backend throughput under concurrent readers and writers")
+    parser.add_argument('--backends', nargs='+', default=['json', 'sqlite'], choices=['json', 'sqlite'])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--readers', type=int, default=4, help="Reader processes")
+    parser.add_argument('--writers', type=int, default=2, help="Writer processes (read-modify-write)")
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{args.users} users, {args.readers} readers, {args.writers} writers, {args.seconds:g}s per backend")
+    print(f"{'backend':<8} {'fill/s':>8} {'reads/s':>9} {'writes/s':>9} {'torn reads':>11}")
+    for kind in args.backends:
+        stats = run_backend(kind, args.users, args.readers, args.writers, args.seconds)
+        print(f"{kind:<8} {stats['fill_per_s']:>8} {stats['reads_per_s']:>9} {stats['writes_per_s']:>9} {stats['torn_reads']:>11}")
+
+
+if __name__ == "__main__":
+    main()
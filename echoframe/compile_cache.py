@@ -0,0 +1,139 @@
+"""
+compile_cache.py - Process-wide cache of compiled student code.
+
+Quest submissions and the /snake_bytecode page used to call compile() on every file for
+every request, even when a student resubmitted the exact same code. The cache keys code
+objects by (filename, sha256 of the source, Python version), keeps the disassembly text
+next to them, and evicts least-recently-used entries once the entry or memory cap is hit.
+Syntax errors are cached too, so a broken file isn't reparsed on every refresh.
+"""
+import dis
+import sys
+import hashlib
+import marshal
+import threading
+from collections import OrderedDict
+
+# Default cache limits
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024  # Approximate memory cap (marshaled code + disassembly text)
+
+PYTHON_TAG = sys.implementation.cache_tag or f"py{sys.version_info[0]}{sys.version_info[1]}"
+
+
+def source_hash(source):
+    """sha256 hex digest of a source string."""
+    return hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class _CacheEntry:
+    __slots__ = ('code', 'marshaled', 'error', 'disassembly', 'size')
+
+    def __init__(self, code, error):
+        self.code = code
+        self.error = error
+        self.marshaled = marshal.dumps(code) if code is not None else None
+        self.disassembly = None
+        # Code objects take roughly twice their marshaled size in memory
+        self.size = 2 * len(self.marshaled) if self.marshaled is not None else 256
+
+
+class CompileCache:
+    """
+    LRU cache of code objects.
+
+    Args:
+        max_entries: Maximum number of cached (filename, source) pairs
+        max_bytes: Approximate memory cap across all entries
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'disassembly_hits': 0, 'disassembly_misses': 0}
+
+    def _key(self, source, filename):
+        return (filename, source_hash(source), PYTHON_TAG)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self.counters['evictions'] += 1
+
+    def _entry(self, source, filename):
+        key = self._key(source, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return key, entry
+            self.counters['misses'] += 1
+        # Compile outside the lock; a concurrent miss on the same key just compiles twice.
+        try:
+            entry = _CacheEntry(compile(source, filename, 'exec'), None)
+        except Exception as e: # SyntaxError, and RecursionError/MemoryError on deeply nested input
+            entry = _CacheEntry(None, e)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                self._evict()
+        return key, entry
+
+    def compile(self, source, filename):
+        """Return the code object for `source`, raising the (cached) SyntaxError if it doesn't compile."""
+        _, entry = self._entry(source, filename)
+        if entry.error is not None:
+            raise entry.error.with_traceback(None)
+        return entry.code
+
+    def marshaled(self, source, filename):
+        """Return marshal bytes of the code object (to ship to another process), or None if it doesn't compile."""
+        return self._entry(source, filename)[1].marshaled
+
+    def disassemble(self, source, filename):
+        """Return the 'OPNAME argrepr' listing for `source`, building it at most once per entry."""
+        key, entry = self._entry(source, filename)
+        if entry.error is not None:
+            return f"Compilation error: {entry.error}"
+        with self._lock:
+            if entry.disassembly is not None:
+                self.counters['disassembly_hits'] += 1
+                return entry.disassembly
+            self.counters['disassembly_misses'] += 1
+        text = "\n".join(f"{instr.opname} {instr.argrepr}" for instr in dis.Bytecode(entry.code))
+        with self._lock:
+            if entry.disassembly is None:
+                entry.disassembly = text
+                entry.size += len(text)
+                if self._entries.get(key) is entry:
+                    self._bytes += len(text)
+                    self._evict()
+        return text
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            lookups = stats['hits'] + stats['misses']
+            stats.update({
+                'entries': len(self._entries),
+                'approx_bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hit_ratio': round(stats['hits'] / lookups, 3) if lookups else None,
+            })
+            return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+# Create a global instance to use throughout the app
+compile_cache = CompileCache()
@@ -0,0 +1,526 @@
+"""
+grading_sandbox.py - Runs quest submissions in a pool of isolated worker processes.
+
+run_single and run_snake used to exec() student code inside the Flask/eventlet process
+and swap the global sys.stdout while doing it, so one infinite loop stalled the whole
+hub and two concurrent graders could capture each other's prints. Here every submission
+runs in a sandbox worker process that captures its own stdout and is held to a CPU and
+wall-clock budget. Results come back as concurrent.futures.Future objects resolving to
+(result_str, debug_output, err, err_line).
+"""
+import os
+import sys
+import time
+import marshal
+import queue
+import signal
+import threading
+import traceback
+import multiprocessing
+from io import StringIO
+from concurrent.futures import Future
+
+from snake_worker_pool import detach_from_parent_hub
+from green_ipc import wait_readable, join_process
+from compile_cache import compile_cache
+from process_limits import set_cpu_budget
+from student_imports import StudentFiles
+from headless_pygame import HeadlessPygame
+from snake_behavior import BehaviorCheck, BehaviorDivergence, ScenarioComplete, scenarios_for
+
+try:
+    import resource # POSIX only; CPU limits are skipped where it is unavailable (Windows)
+except ImportError:
+    resource = None
+
+# Default sandbox settings
+GRADING_POOL_SIZE = os.cpu_count() or 2
+GRADING_WALL_TIMEOUT = 5.0  # Seconds before a submission's worker is killed
+GRADING_CPU_LIMIT = 3       # CPU seconds a submission may use (RLIMIT_CPU, POSIX only)
+GRADING_MAX_JOBS_PER_WORKER = 50
+GRADING_PYGAME = 'headless'   # 'headless' (headless_pygame shim, virtual clock) or 'real' (SDL dummy driver)
+GRADING_QUIT_AFTER_FRAMES = 1  # Frames before the shim posts QUIT; value checks see the game as it starts
+POLL_INTERVAL = 0.005
+
+
+class SandboxTimeout(BaseException):
+    """Raised inside a worker when a submission exceeds its CPU budget.
+
+    Derives from BaseException so student code catching Exception cannot swallow it.
+    """
+    pass
+
+
+# --- Execution (runs inside the sandbox worker) ---
+def execute_single(code, check_var=None, code_blob=None):
+    """Execute a beginner quest snippet and return (result_str, debug_output, err, err_line).
+
+    code_blob is the marshaled code object from the parent's compile cache, if it compiled there.
+    """
+    print(f"[SANDBOX] execute_single() called, check_var: {check_var}")
+    old_stdout = sys.stdout # Store original stdout
+    redirected_output = StringIO() # Create buffer to capture print output
+    env = {} # Execution environment
+    err = None # Error message
+    err_line = None # Line number of error
+    result = None # Result of check_var
+
+    sys.stdout = redirected_output # Redirect stdout to buffer
+    try:
+        if code is None: raise ValueError("Received None code.") # Handle None input
+        # Compile (unless the parent already did) and execute the code in the environment
+        compiled_code = marshal.loads(code_blob) if code_blob else compile(code, "<string>", "exec")
+        exec(compiled_code, env)
+    except SandboxTimeout:
+        err = f"TimeoutError: Code used more than {GRADING_CPU_LIMIT} seconds of CPU time."
+    except Exception as e:
+        # Capture error message and traceback
+        err = f"{type(e).__name__}: {e}"
+        tb = traceback.extract_tb(e.__traceback__)
+        # Find the line number where the error occurred in the executed code
+        err_line = next((fr.lineno for fr in reversed(tb) if fr.filename == "<string>"), None)
+    finally:
+        sys.stdout = old_stdout # Restore original stdout
+
+    debug_output = redirected_output.getvalue() # Get captured print output
+    env["__output__"] = debug_output.strip() # Store stripped output in env
+
+    # Get the result based on check_var
+    if check_var == "__output__":
+        result = env["__output__"] # Check the captured print output
+    elif check_var:
+        result = env.get(check_var) # Check a specific variable in the env
+
+    # Convert result to string for comparison
+    result_str = str(result) if result is not None else None
+    print(f"[SANDBOX] execute_single() returning result: {result_str}, error: {err}, error_line: {err_line}")
+    return result_str, debug_output, err, err_line
+
+def _snake_execution_order(files):
+    """[(filename, source)] in the order snake quest files run in their shared namespace."""
+    # Define a reasonable execution order for snake game files
+    execution_order = ['constants.py', 'snake_class.py', 'food.py', 'snake.py']
+    files_to_execute = []
+
+    # Add files in the defined order if they exist in the input dictionary
+    for fname in execution_order:
+        if fname in files:
+            files_to_execute.append((fname, files[fname]))
+
+    # Add any remaining files not in the defined order (e.g., utils.py)
+    for fname, src in files.items():
+        if fname not in dict(files_to_execute):
+             files_to_execute.append((fname, src))
+    return files_to_execute
+
+def execute_snake(files, check_var_str=None, code_blobs=None):
+    """Execute a snake quest's files in one shared namespace and return (result_str, debug_output, err, err_line).
+
+    code_blobs maps filenames to marshaled code objects from the parent's compile cache.
+    """
+    code_blobs = code_blobs or {}
+    print(f"[SANDBOX] execute_snake() called, check_var_str: {check_var_str}")
+    # Set pygame to headless mode to prevent window from opening
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    shim = None
+    if GRADING_PYGAME == 'headless':
+        shim = HeadlessPygame(quit_after_frames=GRADING_QUIT_AFTER_FRAMES).install()
+
+    # Create the execution environment with some common modules pre-imported
+    env = {
+        'pygame': shim.module if shim is not None else __import__('pygame'),
+        'random': __import__('random'),
+        'sys': __import__('sys')
+    }
+    err = None # Error message
+    err_line = None # Line number of the error in the failing file
+    results = [] # Store results for multiple checks if requested
+
+    files_to_execute = _snake_execution_order(files)
+
+    old_stdout = sys.stdout # Store original stdout
+    redirected_output = StringIO() # Buffer for print output
+    sys.stdout = redirected_output # Redirect stdout
+    # Lets `from constants import *` in one file import the submission's own constants.py
+    student_files = StudentFiles(files, code_blobs).install()
+    try:
+        # Execute files sequentially in the same shared environment 'env'
+        for fname, src in files_to_execute:
+            if src is None: # Skip if file content is None
+                 continue
+            try:
+                # Execute the code (compiled by the parent's cache when a blob was shipped)
+                student_files.exec_file(fname, env)
+            except SystemExit:
+                break # sys.exit() after the game loop ends the program normally
+            except SandboxTimeout:
+                err = f"TimeoutError in {fname}: Code used more than {GRADING_CPU_LIMIT} seconds of CPU time."
+                break
+            except SyntaxError as se:
+                # Handle syntax errors specifically
+                err = f"SyntaxError in {fname}: {se}"
+                err_line = se.lineno
+                break # Stop execution on first error
+            except Exception as e:
+                # Handle other runtime errors
+                err = f"Error in {fname}: {type(e).__name__}: {e}"
+                tb = traceback.extract_tb(e.__traceback__)
+                # Find the line number within the specific file's execution context
+                lineno = next((fr.lineno for fr in reversed(tb) if fr.filename == fname), None)
+                if lineno:
+                    err += f" (line {lineno})" # Add line number to error message
+                    err_line = lineno
+                break # Stop execution on first error
+    finally:
+        sys.stdout = old_stdout # Restore original standard output
+        student_files.uninstall()
+        if shim is not None:
+            shim.uninstall()
+
+    # --- Result Checking Logic (Handles multiple checks and method existence) ---
+    if err is None and check_var_str: # Only check if no execution error occurred
+        check_vars = check_var_str.split(',') # Split if multiple checks requested
+        for check_var in check_vars:
+            check_var = check_var.strip() # Remove leading/trailing whitespace
+            current_result = None
+            if check_var.startswith("method:"):
+                # Check for method existence and callability (e.g., "method:snake.update")
+                method_path = check_var[len("method:"):]
+                parts = method_path.split('.')
+                obj = env.get(parts[0]) # Get the base object (e.g., 'snake' instance)
+                method_exists = False
+                if obj is not None and len(parts) > 1:
+                    try:
+                        target_obj = obj # Start with the base object
+                        method_name = parts[-1] # The actual method name
+                        # Traverse intermediate attributes if any (e.g., obj.sub_obj.method)
+                        for part in parts[1:-1]:
+                            target_obj = getattr(target_obj, part, None)
+                            if target_obj is None: # Check if intermediate part exists
+                                break # Stop traversal if part not found
+                        # Check if the final attribute exists and is callable
+                        if target_obj is not None:
+                            method = getattr(target_obj, method_name, None)
+                            if method is not None and callable(method):
+                                method_exists = True # Method exists and is callable
+                    except AttributeError:
+                        method_exists = False # Attribute not found during traversal
+                current_result = str(method_exists) # Result is "True" or "False" string
+
+            elif '.' in check_var:
+                # Handle nested attribute access (e.g., 'snake.direction')
+                try:
+                    parts = check_var.split('.')
+                    obj = env.get(parts[0]) # Get the base object
+                    # Traverse attributes
+                    for part in parts[1:]:
+                        if obj is not None:
+                            obj = getattr(obj, part, None) # Safely get attribute
+                        else:
+                            break # Stop if intermediate object is None
+                    current_result = str(obj) if obj is not None else "None" # Convert result to string
+                except Exception: # Catch potential errors during attribute access
+                    current_result = "Error"
+            else:
+                # Get simple variable from the environment
+                value = env.get(check_var)
+                current_result = str(value) if value is not None else "None" # Convert to string
+
+            results.append(current_result) # Add the result for this check to the list
+
+    debug_output = redirected_output.getvalue() # Get any captured print output
+
+    # Join results with commas if multiple checks were performed
+    final_result_str = ",".join(results) if results else None
+
+    print(f"[SANDBOX] execute_snake() returning: {final_result_str}, error: {err}")
+    return final_result_str, debug_output, err, err_line
+
+def evaluate_snake_result(result_str, err, check_var_str, expected_value_str):
+    """
+    Decide whether a snake submission passed its quest check.
+
+    Args:
+        result_str: Result string from execute_snake (comma-separated for multiple checks)
+        err: Execution error from execute_snake, or None
+        check_var_str: The quest's check_var
+        expected_value_str: The quest's expected value ("exists" for method checks)
+
+    Returns:
+        (success, error) where error explains a failure (or passes the execution error through)
+    """
+    if err is not None:
+        return False, err
+    check_var_str = check_var_str or ""
+    if expected_value_str == "exists": # Check if methods/vars exist
+        check_vars = check_var_str.split(',')
+        results = result_str.split(',') if result_str else []
+        success = len(check_vars) == len(results) and all(r == "True" for r in results)
+        return success, None if success else "Required method(s) not found/callable."
+    if "," in check_var_str:
+        check_vars = check_var_str.split(',')
+        expected_vals = expected_value_str.split(',') if expected_value_str else []
+        results = result_str.split(',') if result_str else []
+        if len(check_vars) != len(expected_vals) or len(check_vars) != len(results):
+            return False, "Mismatch in number of checked variables/expected/results."
+        success = all(results[i] == expected_vals[i] for i in range(len(check_vars)))
+        return success, None if success else "Incorrect value(s)."
+    # Check single value
+    success = expected_value_str is not None and result_str == expected_value_str
+    return success, None if success else f"Incorrect output. Expected '{expected_value_str}', got '{result_str}'."
+
+def execute_snake_behavior(files, scenario, code_blobs=None):
+    """Run a snake quest's game for one behavior scenario (see snake_behavior.py).
+
+    Returns:
+        (result_str, debug_output, err, err_line): result_str is the number of ticks checked,
+        err describes the first divergence or execution error
+    """
+    print(f"[SANDBOX] execute_snake_behavior() called, scenario: {scenario['name']}")
+    main_file = 'snake.py' if 'snake.py' in files else 'main.py'
+    if not isinstance(files.get(main_file), str):
+        return None, "", f"Behavior check '{scenario['name']}' failed: {main_file} not found.", None
+    # Same shared namespace as execute_snake, with the game loop's file last
+    files_to_execute = [(f, src) for f, src in _snake_execution_order(files) if f != main_file and src is not None]
+    files_to_execute.append((main_file, files[main_file]))
+    shim = HeadlessPygame().install()
+    env = {'pygame': shim.module, 'random': __import__('random'), 'sys': __import__('sys'), '__name__': '__main__'}
+    check = BehaviorCheck(scenario, env, shim)
+    err = None
+    err_line = None
+    fname = main_file
+    old_stdout = sys.stdout
+    redirected_output = StringIO()
+    sys.stdout = redirected_output
+    student_files = StudentFiles(files, code_blobs).install()
+    try:
+        check.start()
+        for fname, _src in files_to_execute:
+            student_files.exec_file(fname, env)
+        err = f"Behavior check '{scenario['name']}' failed: the game ended after {check.ticks_checked} of {scenario['ticks']} ticks."
+    except ScenarioComplete:
+        pass
+    except BehaviorDivergence as e:
+        err = str(e)
+    except SystemExit:
+        err = f"Behavior check '{scenario['name']}' failed: the game exited after {check.ticks_checked} of {scenario['ticks']} ticks."
+    except SandboxTimeout:
+        err = f"TimeoutError in {fname}: Code used more than {GRADING_CPU_LIMIT} seconds of CPU time."
+    except SyntaxError as se:
+        err = f"SyntaxError in {fname}: {se}"
+        err_line = se.lineno
+    except Exception as e:
+        err = f"Error in {fname}: {type(e).__name__}: {e}"
+        tb = traceback.extract_tb(e.__traceback__)
+        err_line = next((fr.lineno for fr in reversed(tb) if fr.filename == fname), None)
+    finally:
+        sys.stdout = old_stdout
+        student_files.uninstall()
+        shim.uninstall()
+    print(f"[SANDBOX] execute_snake_behavior() checked {check.ticks_checked} ticks, error: {err}")
+    return str(check.ticks_checked), redirected_output.getvalue(), err, err_line
+
+JOB_HANDLERS = {
+    'single': execute_single,
+    'snake': execute_snake,
+    'snake_behavior': execute_snake_behavior,
+}
+
+
+# --- Worker process ---
+def _raise_sandbox_timeout(signum, frame):
+    raise SandboxTimeout()
+
+def sandbox_worker_loop(conn, cpu_limit, max_jobs):
+    """Top-level worker entry point (kept top-level so it also works with the spawn start method)."""
+    detach_from_parent_hub()
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    try:
+        import pygame # Warm up: snake submissions expect pygame in their namespace
+    except ImportError:
+        pass
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _raise_sandbox_timeout)
+
+    for _ in range(max_jobs):
+        try:
+            kind, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if kind == 'shutdown':
+            break
+        set_cpu_budget(cpu_limit)
+        try:
+            result = JOB_HANDLERS[kind](*args)
+        except BaseException as e: # Never let a job take the worker loop down without an answer
+            result = (None, "", f"{type(e).__name__}: {e}", None)
+        finally:
+            set_cpu_budget(None)
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            break
+
+
+class _SandboxWorker:
+    """One sandbox process and the parent end of its pipe."""
+
+    def __init__(self, cpu_limit, max_jobs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=sandbox_worker_loop,
+                                               args=(child_conn, cpu_limit, max_jobs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.max_jobs = max_jobs
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        join_process(self.process, 1)
+        self.conn.close()
+
+
+class GradingSandbox:
+    """
+    Pool of sandbox workers grading submissions in parallel.
+
+    Args:
+        size: Number of worker processes (defaults to the CPU count)
+        wall_timeout: Seconds a submission may run before its worker is killed
+        cpu_limit: CPU seconds a submission may use (POSIX only)
+        max_jobs_per_worker: Jobs a worker runs before it is replaced with a fresh one
+    """
+
+    def __init__(self, size=None, wall_timeout=GRADING_WALL_TIMEOUT, cpu_limit=GRADING_CPU_LIMIT,
+                 max_jobs_per_worker=GRADING_MAX_JOBS_PER_WORKER):
+        self.size = max(1, int(size or GRADING_POOL_SIZE))
+        self.wall_timeout = wall_timeout
+        self.cpu_limit = cpu_limit
+        self.max_jobs_per_worker = max(1, int(max_jobs_per_worker))
+        self._jobs = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.counters = {'submitted': 0, 'completed': 0, 'timeouts': 0, 'crashes': 0, 'respawns': 0}
+
+    def start(self):
+        """Start one dispatcher (and its worker process) per pool slot."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.size):
+                threading.Thread(target=self._dispatch_loop, name=f"grading-dispatch-{i}", daemon=True).start()
+
+    def _new_worker(self):
+        return _SandboxWorker(self.cpu_limit, self.max_jobs_per_worker)
+
+    def _dispatch_loop(self):
+        worker = self._new_worker()
+        while True:
+            future, kind, args = self._jobs.get()
+            if future is None:
+                worker.kill()
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            if not worker.process.is_alive() or worker.jobs >= worker.max_jobs:
+                worker.kill()
+                worker = self._new_worker()
+                self.counters['respawns'] += 1
+            worker.jobs += 1
+            result, healthy = self._run_on_worker(worker, kind, args)
+            if not healthy:
+                worker.kill()
+                worker = self._new_worker()
+                self.counters['respawns'] += 1
+            self.counters['completed'] += 1
+            future.set_result(result)
+
+    def _run_on_worker(self, worker, kind, args):
+        """Send a job and wait for its answer. Returns (result, worker_still_usable)."""
+        try:
+            worker.conn.send((kind, args))
+        except (EOFError, OSError) as e:
+            self.counters['crashes'] += 1
+            return (None, "", f"SandboxError: Could not reach grading worker ({e}).", None), False
+        deadline = time.monotonic() + self.wall_timeout
+        while True:
+            try:
+                # Parks only this dispatcher's green thread on the pipe; the hub keeps serving requests
+                if wait_readable(worker.conn, max(0.0, deadline - time.monotonic())):
+                    return worker.conn.recv(), True
+            except (EOFError, OSError):
+                time.sleep(POLL_INTERVAL) # Pipe hit EOF: give the dying worker a moment to be reaped
+            if not worker.process.is_alive():
+                self.counters['crashes'] += 1
+                return (None, "", "SandboxError: Grading worker exited unexpectedly.", None), False
+            if time.monotonic() >= deadline:
+                self.counters['timeouts'] += 1
+                err = f"TimeoutError: Code did not finish within {self.wall_timeout:g} seconds. Check for infinite loops."
+                return (None, "", err, None), False
+
+    def submit(self, kind, *args):
+        """Queue a job ('single' or 'snake') and return a Future for its result tuple."""
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown grading job kind: {kind}")
+        self.start()
+        future = Future()
+        self.counters['submitted'] += 1
+        self._jobs.put((future, kind, args))
+        return future
+
+    def submit_single(self, code, check_var=None):
+        # Compile through the shared cache so resubmissions skip parsing; workers just unmarshal.
+        code_blob = compile_cache.marshaled(code, "<string>") if isinstance(code, str) else None
+        return self.submit('single', code, check_var, code_blob)
+
+    def submit_snake(self, files, check_var_str=None):
+        code_blobs = {fname: compile_cache.marshaled(src, fname)
+                      for fname, src in files.items() if isinstance(src, str)}
+        return self.submit('snake', files, check_var_str, code_blobs)
+
+    def submit_snake_behavior(self, files, scenario):
+        code_blobs = {fname: compile_cache.marshaled(src, fname)
+                      for fname, src in files.items() if isinstance(src, str)}
+        return self.submit('snake_behavior', files, scenario, code_blobs)
+
+    def get_stats(self):
+        stats = dict(self.counters)
+        stats.update({'size': self.size, 'queued': self._jobs.qsize(),
+                      'wall_timeout': self.wall_timeout, 'cpu_limit': self.cpu_limit})
+        return stats
+
+    def shutdown(self):
+        """Stop every dispatcher and its worker once queued jobs have been handed out."""
+        if self._started:
+            for _ in range(self.size):
+                self._jobs.put((None, None, None))
+
+
+def grade_snake_behavior(sandbox, files, quest):
+    """
+    Run every behavior scenario of a snake quest in parallel on the sandbox.
+
+    Returns:
+        (success, error): error is the first failing scenario's message (by scenario order)
+    """
+    futures = [sandbox.submit_snake_behavior(files, scenario) for scenario in scenarios_for(quest)]
+    error = None
+    for i, future in enumerate(futures):
+        _ticks, _debug, err, _err_line = future.result()
+        if err is not None:
+            error = err
+            for pending in futures[i + 1:]:
+                pending.cancel() # Not started yet: skip it, the submission already failed
+            break
+    return error is None, error
+
+_sandbox = None
+
+def get_sandbox():
+    """Return the process-wide grading sandbox, creating it on first use."""
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = GradingSandbox()
+    return _sandbox
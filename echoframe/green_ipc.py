@@ -0,0 +1,64 @@
+"""
+green_ipc.py - Cooperative waits on multiprocessing pipes and process sentinels.
+
+Connection.poll(timeout) and Process.join(timeout) block the calling OS thread. Under
+eventlet that thread is the hub, so a supervisor waiting on a student process freezes every
+other request and socket until the timeout expires. These helpers park only the calling
+green thread on the file descriptor (via the hub) and fall back to the plain blocking calls
+when eventlet isn't monkey patched (scripts, CLI tools, tests).
+"""
+try:
+    from eventlet import hubs, patcher
+except ImportError:  # Running without eventlet
+    hubs = patcher = None
+
+
+class _WaitTimedOut(Exception):
+    pass
+
+
+def is_green():
+    """True if threads are eventlet green threads (app.py monkey patched the stdlib)."""
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+def _wait_fd(fd, timeout):
+    try:
+        hubs.trampoline(fd, read=True, timeout=timeout, timeout_exc=_WaitTimedOut)
+    except _WaitTimedOut:
+        return False
+    return True
+
+
+def wait_readable(conn, timeout=None):
+    """
+    Wait until a Connection has a message (or hit EOF) without blocking the hub.
+
+    Args:
+        conn: multiprocessing Connection
+        timeout: Seconds to wait, or None to wait forever
+
+    Returns:
+        True if recv() will not block, False on timeout
+    """
+    if not is_green():
+        return conn.poll(timeout)
+    if conn.poll(0):
+        return True
+    if timeout is not None and timeout <= 0:
+        return False
+    return _wait_fd(conn.fileno(), timeout)
+
+
+def join_process(process, timeout=None):
+    """
+    Process.join() that yields to other green threads while the child is still running.
+
+    Returns:
+        True if the process has exited
+    """
+    if is_green() and process.is_alive():
+        _wait_fd(process.sentinel, timeout)  # The sentinel becomes readable when the child exits
+        timeout = 0
+    process.join(timeout)
+    return not process.is_alive()
@@ -0,0 +1,534 @@
+"""
+headless_pygame.py - Pure-Python stand-in for the parts of pygame student snake code uses.
+
+Grading and previews only read the game state out of the student's variables, yet real
+pygame (even with SDL's dummy driver) rasterizes every draw call, renders fonts and sleeps
+in Clock.tick(). HeadlessPygame builds a `pygame` module with the same names where:
+
+- display/draw/font/image/transform calls do no pixel work (draw functions still return
+  the bounding Rect, fonts still report text sizes)
+- time is virtual: Clock.tick(fps) advances a counter by 1000/fps ms (or a fixed tick_ms)
+  and only sleeps when `realtime` is set, so a 10 FPS game loop runs as fast as the CPU allows
+- events are scriptable: queue events for a given frame (a frame ends at display.flip() or
+  display.update()), or post a QUIT after N frames so `while running:` loops end by themselves;
+  on_frame(frame) is called at the end of every frame for callers that inspect the game
+- Rect, Surface, Color, event.Event, key.get_pressed() and the usual constants
+  (pygame 2 values) behave like pygame's
+
+    shim = HeadlessPygame(quit_after_frames=300)
+    shim.install()      # `import pygame` / `from pygame.locals import *` now get the shim
+    ...
+    shim.uninstall()    # Back to whatever was in sys.modules before
+"""
+import sys
+import time as _time
+import types
+from collections import defaultdict, deque
+
+# Event types and key codes (same values as pygame 2)
+NOEVENT = 0
+QUIT = 256
+ACTIVEEVENT = 32768
+KEYDOWN = 768
+KEYUP = 769
+MOUSEMOTION = 1024
+MOUSEBUTTONDOWN = 1025
+MOUSEBUTTONUP = 1026
+VIDEORESIZE = 32769
+USEREVENT = 32866
+
+KEYS = {
+    'K_BACKSPACE': 8, 'K_TAB': 9, 'K_RETURN': 13, 'K_ESCAPE': 27, 'K_SPACE': 32,
+    'K_0': 48, 'K_1': 49, 'K_2': 50, 'K_3': 51, 'K_4': 52, 'K_5': 53, 'K_6': 54, 'K_7': 55, 'K_8': 56, 'K_9': 57,
+    'K_RIGHT': 1073741903, 'K_LEFT': 1073741904, 'K_DOWN': 1073741905, 'K_UP': 1073741906,
+    'K_LSHIFT': 1073742049, 'K_RSHIFT': 1073742053, 'K_LCTRL': 1073742048, 'K_RCTRL': 1073742052,
+}
+KEYS.update({f'K_{c}': ord(c) for c in 'abcdefghijklmnopqrstuvwxyz'})
+_KEY_NAMES = {code: name[2:].lower() for name, code in KEYS.items()}
+
+DISPLAY_FLAGS = {'FULLSCREEN': -2147483648, 'RESIZABLE': 16, 'NOFRAME': 32, 'DOUBLEBUF': 1073741824,
+                 'HWSURFACE': 1, 'SRCALPHA': 65536}
+
+DEFAULT_SURFACE_SIZE = (640, 480)
+
+
+class error(RuntimeError):
+    """pygame.error"""
+
+
+class Color(tuple):
+    """pygame.Color from (r, g, b[, a]) or a few common names."""
+    _NAMES = {'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 255, 0),
+              'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'gray': (190, 190, 190), 'grey': (190, 190, 190)}
+
+    def __new__(cls, r=0, g=0, b=0, a=255):
+        if isinstance(r, str):
+            r, g, b = cls._NAMES.get(r.lower(), (0, 0, 0))
+        elif isinstance(r, (tuple, list)):
+            r, g, b, a = (tuple(r) + (255,))[:4] if len(r) == 3 else tuple(r)[:4]
+        return super().__new__(cls, (int(r), int(g), int(b), int(a)))
+
+    r = property(lambda self: self[0])
+    g = property(lambda self: self[1])
+    b = property(lambda self: self[2])
+    a = property(lambda self: self[3])
+
+
+class Rect:
+    """pygame.Rect: integer x/y/w/h plus the derived edges, corners and centers."""
+    __slots__ = ('x', 'y', 'w', 'h')
+
+    def __init__(self, *args):
+        if len(args) == 1:
+            args = args[0]
+            if isinstance(args, Rect):
+                args = (args.x, args.y, args.w, args.h)
+        if len(args) == 2:
+            (x, y), (w, h) = args
+        else:
+            x, y, w, h = args
+        self.x, self.y, self.w, self.h = int(x), int(y), int(w), int(h)
+
+    left = property(lambda self: self.x, lambda self, v: setattr(self, 'x', int(v)))
+    top = property(lambda self: self.y, lambda self, v: setattr(self, 'y', int(v)))
+    width = property(lambda self: self.w, lambda self, v: setattr(self, 'w', int(v)))
+    height = property(lambda self: self.h, lambda self, v: setattr(self, 'h', int(v)))
+    right = property(lambda self: self.x + self.w, lambda self, v: setattr(self, 'x', int(v) - self.w))
+    bottom = property(lambda self: self.y + self.h, lambda self, v: setattr(self, 'y', int(v) - self.h))
+    centerx = property(lambda self: self.x + self.w // 2, lambda self, v: setattr(self, 'x', int(v) - self.w // 2))
+    centery = property(lambda self: self.y + self.h // 2, lambda self, v: setattr(self, 'y', int(v) - self.h // 2))
+
+    def _pair(getter_x, getter_y):
+        def get(self):
+            return (getter_x.fget(self), getter_y.fget(self))
+
+        def set(self, value):
+            getter_x.fset(self, value[0])
+            getter_y.fset(self, value[1])
+        return property(get, set)
+
+    topleft = _pair(left, top)
+    topright = _pair(right, top)
+    bottomleft = _pair(left, bottom)
+    bottomright = _pair(right, bottom)
+    center = _pair(centerx, centery)
+    size = _pair(width, height)
+    del _pair
+
+    def copy(self):
+        return Rect(self.x, self.y, self.w, self.h)
+
+    def move(self, dx, dy):
+        return Rect(self.x + dx, self.y + dy, self.w, self.h)
+
+    def move_ip(self, dx, dy):
+        self.x += int(dx)
+        self.y += int(dy)
+
+    def inflate(self, dx, dy):
+        return Rect(self.x - dx // 2, self.y - dy // 2, self.w + dx, self.h + dy)
+
+    def inflate_ip(self, dx, dy):
+        self.x, self.y, self.w, self.h = self.inflate(dx, dy)
+
+    def colliderect(self, other):
+        other = Rect(other)
+        return self.x < other.right and other.x < self.right and self.y < other.bottom and other.y < self.bottom
+
+    def collidepoint(self, *point):
+        px, py = point[0] if len(point) == 1 else point
+        return self.x <= px < self.right and self.y <= py < self.bottom
+
+    def collidelist(self, rects):
+        return next((i for i, rect in enumerate(rects) if self.colliderect(rect)), -1)
+
+    def contains(self, other):
+        other = Rect(other)
+        return self.x <= other.x and self.y <= other.y and other.right <= self.right and other.bottom <= self.bottom
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.w, self.h))
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.w, self.h)[index]
+
+    def __eq__(self, other):
+        try:
+            return tuple(self) == tuple(Rect(other))
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<rect({self.x}, {self.y}, {self.w}, {self.h})>"
+
+
+def _as_rect(rect):
+    return rect.copy() if isinstance(rect, Rect) else Rect(rect)
+
+
+class Surface:
+    """pygame.Surface that only remembers its size."""
+
+    def __init__(self, size=DEFAULT_SURFACE_SIZE, flags=0, depth=0, *args):
+        self._size = (int(size[0]), int(size[1]))
+
+    def get_size(self):
+        return self._size
+
+    def get_width(self):
+        return self._size[0]
+
+    def get_height(self):
+        return self._size[1]
+
+    def get_rect(self, **kwargs):
+        rect = Rect(0, 0, *self._size)
+        for name, value in kwargs.items():
+            setattr(rect, name, value)
+        return rect
+
+    def fill(self, color, rect=None, special_flags=0):
+        return _as_rect(rect) if rect is not None else self.get_rect()
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        width, height = source.get_size() if isinstance(source, Surface) else (0, 0)
+        x, y = (dest.x, dest.y) if isinstance(dest, Rect) else dest[:2]
+        return Rect(x, y, width, height)
+
+    def copy(self):
+        return Surface(self._size)
+
+    def convert(self, *args):
+        return self
+
+    convert_alpha = convert
+
+    def set_alpha(self, *args):
+        pass
+
+    def set_colorkey(self, *args):
+        pass
+
+    def get_at(self, pos):
+        return Color(0, 0, 0)
+
+
+class Event:
+    """pygame.event.Event"""
+
+    def __init__(self, type, dict=None, **kwargs):
+        self.type = type
+        self.__dict__.update(dict or {}, **kwargs)
+
+    @property
+    def dict(self):
+        return {k: v for k, v in self.__dict__.items() if k != 'type'}
+
+    def __repr__(self):
+        return f"<Event({self.type} {self.dict})>"
+
+
+class _Clock:
+    """pygame.time.Clock on the shim's virtual clock."""
+
+    def __init__(self, shim):
+        self._shim = shim
+        self._last_ms = 0
+        self._fps = 0.0
+
+    def tick(self, framerate=0):
+        shim = self._shim
+        elapsed = shim.tick_ms if shim.tick_ms is not None else (1000.0 / framerate if framerate else 0.0)
+        shim.advance(elapsed)
+        self._last_ms = int(elapsed)
+        self._fps = 1000.0 / elapsed if elapsed else 0.0
+        return self._last_ms
+
+    tick_busy_loop = tick
+
+    def get_time(self):
+        return self._last_ms
+
+    get_rawtime = get_time
+
+    def get_fps(self):
+        return self._fps
+
+
+class _Font:
+    """pygame.font.Font: measures text, renders blank surfaces."""
+
+    def __init__(self, name=None, size=12, *args, **kwargs):
+        self._size = int(size)
+
+    def size(self, text):
+        return (len(str(text)) * max(1, self._size // 2), self._size)
+
+    def render(self, text, antialias=True, color=None, background=None):
+        return Surface(self.size(text))
+
+    def get_height(self):
+        return self._size
+
+    get_linesize = get_height
+
+    def set_bold(self, value):
+        pass
+
+    set_italic = set_underline = set_bold
+
+
+class _Sound:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def play(self, *args, **kwargs):
+        pass
+
+    stop = set_volume = play
+
+    def get_length(self):
+        return 0.0
+
+
+class HeadlessPygame:
+    """
+    One shim instance: its virtual clock, frame counter and event queue, and the module tree.
+
+    Args:
+        tick_ms: Milliseconds every Clock.tick() advances (None: 1000/fps, as pygame would wait)
+        realtime: Fraction of the virtual time to really sleep (0 = never sleep, 1.0 = real time)
+        quit_after_frames: Post a QUIT event once this many frames have been shown (None: never)
+    """
+
+    def __init__(self, tick_ms=None, realtime=0.0, quit_after_frames=None):
+        self.tick_ms = tick_ms
+        self.realtime = realtime
+        self.quit_after_frames = quit_after_frames
+        self.on_frame = None # Called with the frame number after every display.flip()/update()
+        self._saved_modules = None
+        self.reset()
+        self.module = self._build_module()
+
+    # --- State ---
+    def reset(self):
+        """Start a new run: virtual time 0, frame 0, no queued or scripted events, no keys held."""
+        self.ticks_ms = 0.0
+        self.frame = 0
+        self.queue = deque()
+        self.scripted = defaultdict(list) # frame -> [Event]
+        self.pressed = set()
+        self.initialized = False
+        self.surface = None
+        self.caption = ''
+
+    def advance(self, ms):
+        """Move the virtual clock forward (sleeping `realtime` of it)."""
+        self.ticks_ms += ms
+        if self.realtime and ms > 0:
+            _time.sleep(ms * self.realtime / 1000.0)
+
+    def schedule(self, frame, *events):
+        """Queue events for delivery once `frame` frames have been shown (0 = right away)."""
+        for event in events:
+            event = event if isinstance(event, Event) else Event(event)
+            if frame <= self.frame:
+                self.post(event)
+            else:
+                self.scripted[frame].append(event)
+
+    def press_key(self, key, frame=0):
+        """Script a KEYDOWN (and the key held in key.get_pressed()) for `frame`."""
+        self.schedule(frame, Event(KEYDOWN, key=key, mod=0, unicode='', scancode=0))
+
+    def post(self, event):
+        if event.type == KEYDOWN:
+            self.pressed.add(getattr(event, 'key', None))
+        elif event.type == KEYUP:
+            self.pressed.discard(getattr(event, 'key', None))
+        self.queue.append(event)
+        return True
+
+    def end_frame(self):
+        """display.flip()/update(): count the frame and release events scripted for it."""
+        self.frame += 1
+        if self.on_frame is not None:
+            self.on_frame(self.frame)
+        for event in self.scripted.pop(self.frame, ()):
+            self.post(event)
+        if self.quit_after_frames is not None and self.frame == self.quit_after_frames:
+            self.post(Event(QUIT))
+
+    def _take_events(self, eventtype=None):
+        if eventtype is None:
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+        types_wanted = set(eventtype) if isinstance(eventtype, (list, tuple, set)) else {eventtype}
+        events = [e for e in self.queue if e.type in types_wanted]
+        self.queue = deque(e for e in self.queue if e.type not in types_wanted)
+        return events
+
+    # --- Module tree ---
+    def _build_module(self):
+        shim = self
+        pg = types.ModuleType('pygame')
+        pg.__file__ = __file__
+        pg.__path__ = [] # A package, so `import pygame.locals` works
+        pg.HEADLESS = True
+        pg.error = error
+        pg.Rect = Rect
+        pg.Surface = Surface
+        pg.Color = Color
+        pg.version = types.SimpleNamespace(ver='2.6.1-headless', vernum=(2, 6, 1))
+
+        def init():
+            shim.initialized = True
+            return (6, 0)
+
+        def quit():
+            shim.initialized = False
+
+        pg.init = init
+        pg.quit = quit
+        pg.get_init = lambda: shim.initialized
+
+        display = types.ModuleType('pygame.display')
+
+        def set_mode(size=(0, 0), flags=0, depth=0, display_index=0, vsync=0):
+            shim.surface = Surface(size if size and size[0] and size[1] else DEFAULT_SURFACE_SIZE)
+            return shim.surface
+
+        def set_caption(title, icontitle=None):
+            shim.caption = title
+
+        display.set_mode = set_mode
+        display.set_caption = set_caption
+        display.get_caption = lambda: (shim.caption, shim.caption)
+        display.get_surface = lambda: shim.surface
+        display.flip = lambda: shim.end_frame()
+        display.update = lambda *args: shim.end_frame()
+        display.init = display.quit = lambda: None
+        display.get_init = lambda: True
+        display.set_icon = lambda surface: None
+        display.Info = lambda: types.SimpleNamespace(current_w=DEFAULT_SURFACE_SIZE[0], current_h=DEFAULT_SURFACE_SIZE[1])
+
+        draw = types.ModuleType('pygame.draw')
+
+        def _bounds(points, width=0):
+            xs = [int(p[0]) for p in points] or [0]
+            ys = [int(p[1]) for p in points] or [0]
+            return Rect(min(xs), min(ys), max(xs) - min(xs) + max(1, width), max(ys) - min(ys) + max(1, width))
+
+        draw.rect = lambda surface, color, rect, width=0, *args, **kwargs: _as_rect(rect)
+        draw.ellipse = lambda surface, color, rect, width=0: _as_rect(rect)
+        draw.arc = lambda surface, color, rect, start, stop, width=1: _as_rect(rect)
+        draw.circle = lambda surface, color, center, radius, width=0, *args: \
+            Rect(int(center[0] - radius), int(center[1] - radius), int(radius * 2), int(radius * 2))
+        draw.line = lambda surface, color, start, end, width=1: _bounds([start, end], width)
+        draw.aaline = lambda surface, color, start, end, blend=1: _bounds([start, end])
+        draw.lines = lambda surface, color, closed, points, width=1: _bounds(points, width)
+        draw.aalines = lambda surface, color, closed, points, blend=1: _bounds(points)
+        draw.polygon = lambda surface, color, points, width=0: _bounds(points, width)
+
+        font = types.ModuleType('pygame.font')
+        font.Font = _Font
+        font.SysFont = lambda name, size, bold=False, italic=False: _Font(name, size)
+        font.init = font.quit = lambda: None
+        font.get_init = lambda: True
+        font.get_default_font = lambda: 'freesansbold.ttf'
+
+        event = types.ModuleType('pygame.event')
+        event.Event = Event
+        event.EventType = Event
+        event.get = lambda eventtype=None, pump=True: shim._take_events(eventtype)
+        event.poll = lambda: shim.queue.popleft() if shim.queue else Event(NOEVENT)
+        event.wait = lambda timeout=0: shim.queue.popleft() if shim.queue else Event(NOEVENT)
+        event.peek = lambda eventtype=None, pump=True: bool(shim.queue) if eventtype is None else \
+            any(e.type == eventtype for e in shim.queue)
+        event.post = shim.post
+        event.pump = lambda: None
+        event.clear = lambda eventtype=None, pump=True: shim._take_events(eventtype) and None
+        event.set_blocked = event.set_allowed = lambda *args: None
+        event.event_name = lambda type: {QUIT: 'Quit', KEYDOWN: 'KeyDown', KEYUP: 'KeyUp'}.get(type, 'Unknown')
+
+        time_module = types.ModuleType('pygame.time')
+        time_module.Clock = lambda: _Clock(shim)
+        time_module.get_ticks = lambda: int(shim.ticks_ms)
+
+        def wait(milliseconds):
+            shim.advance(milliseconds)
+            return int(milliseconds)
+
+        time_module.wait = time_module.delay = wait
+        time_module.set_timer = lambda *args, **kwargs: None
+
+        key = types.ModuleType('pygame.key')
+
+        class _Pressed:
+            def __getitem__(self, code):
+                return code in shim.pressed
+
+        key.get_pressed = lambda: _Pressed()
+        key.name = lambda code, use_compat=True: _KEY_NAMES.get(code, '')
+        key.set_repeat = lambda *args: None
+        key.get_mods = lambda: 0
+
+        mixer = types.ModuleType('pygame.mixer')
+        mixer.init = mixer.quit = mixer.pre_init = lambda *args, **kwargs: None
+        mixer.get_init = lambda: None
+        mixer.Sound = _Sound
+        mixer.music = types.SimpleNamespace(load=lambda *a, **k: None, play=lambda *a, **k: None,
+                                            stop=lambda *a, **k: None, set_volume=lambda *a, **k: None)
+
+        image = types.ModuleType('pygame.image')
+        image.load = lambda *args, **kwargs: Surface((32, 32))
+        image.save = lambda *args, **kwargs: None
+
+        transform = types.ModuleType('pygame.transform')
+        transform.scale = lambda surface, size, *args: Surface(size)
+        transform.rotate = lambda surface, angle: surface.copy()
+        transform.flip = lambda surface, flip_x, flip_y: surface.copy()
+
+        locals_module = types.ModuleType('pygame.locals')
+        constants = dict(KEYS, **DISPLAY_FLAGS, NOEVENT=NOEVENT, QUIT=QUIT, ACTIVEEVENT=ACTIVEEVENT,
+                         KEYDOWN=KEYDOWN, KEYUP=KEYUP, MOUSEMOTION=MOUSEMOTION, MOUSEBUTTONDOWN=MOUSEBUTTONDOWN,
+                         MOUSEBUTTONUP=MOUSEBUTTONUP, VIDEORESIZE=VIDEORESIZE, USEREVENT=USEREVENT)
+        for module in (pg, locals_module):
+            module.__dict__.update(constants)
+        locals_module.Rect = Rect
+        locals_module.Color = Color
+
+        self.submodules = {'display': display, 'draw': draw, 'font': font, 'event': event, 'time': time_module,
+                           'key': key, 'mixer': mixer, 'image': image, 'transform': transform,
+                           'locals': locals_module}
+        for name, submodule in self.submodules.items():
+            setattr(pg, name, submodule)
+        return pg
+
+    # --- Installation ---
+    def install(self):
+        """Make `import pygame` (and its submodules) resolve to this shim."""
+        if self._saved_modules is None:
+            names = ['pygame'] + [f'pygame.{name}' for name in self.submodules]
+            self._saved_modules = {name: sys.modules.get(name) for name in names}
+        sys.modules['pygame'] = self.module
+        for name, submodule in self.submodules.items():
+            sys.modules[f'pygame.{name}'] = submodule
+        return self
+
+    def uninstall(self):
+        """Restore the modules install() replaced."""
+        if self._saved_modules is None:
+            return
+        for name, module in self._saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        self._saved_modules = None
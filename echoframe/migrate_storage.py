@@ -0,0 +1,255 @@
+"""
+migrate_storage.py - Copy user records from the JSON files into the SQLite backend, move flat
+per-user files into the sharded layout, or import the old snake intro marker files.
+
+Reads every user_data/<user>.json and stores it in user_data/users.sqlite3 (see
+persistent_storage.SqliteBackend). The JSON files are left in place, so switching
+STORAGE_BACKEND back to 'json' undoes the move. Users that already have a row are skipped
+unless --overwrite is given, so the migration can be re-run after new JSON saves. Run it with
+the server stopped (or re-run it right before switching) so no save lands in the JSON files
+after their user was copied.
+
+Usage (from the echoframe directory):
+    python migrate_storage.py                       # user_data/*.json -> user_data/users.sqlite3
+    python migrate_storage.py --overwrite           # Replace rows that already exist
+    python migrate_storage.py --dir other_data --db other_data/users.sqlite3
+
+Then set STORAGE_BACKEND = 'sqlite' in persistent_storage.py and restart the server.
+
+--shard moves user_data/<user>.json, intro_markers/<user>.seen, snake_code/<user>/ and
+replays/<user>/ into their <aa>/<bb>/ shard directories (see user_paths.py) with renames, so
+it can run while the server is up: lookups take the sharded path once it exists and the flat
+one until then. A save
+that resolved the flat path just before its user was moved recreates the flat entry; the
+migrator repeats its pass until nothing flat is left and keeps the newer copy of a file that
+exists in both places, so re-running it is always safe.
+
+    python migrate_storage.py --shard               # Also: --dir other_data
+
+--intro-markers sets snake_intro_seen in the record of every user with an
+intro_markers/<user>.seen file and then deletes the markers (the app does this at startup,
+so a second run finds nothing). Markers of users without a record are just removed.
+"""
+import argparse
+import json
+import os
+import time
+
+from persistent_storage import SQLITE_DB_NAME, JsonFileBackend, PersistentStorage, SqliteBackend
+from user_paths import INTRO_MARKERS, REPLAYS, SNAKE_CODE, USER_DATA_DIR, is_shard_name, iter_entries, safe_username, sharded_path
+
+SHARD_PASSES = 5 # Passes over the flat entries before giving up on ones that keep reappearing
+
+
+def migrate_json_to_sqlite(storage_dir, db_path=None, overwrite=False):
+    """
+    Copy every JSON user record in storage_dir into the SQLite database.
+
+    Returns:
+        dict with migrated, skipped (already in the database), invalid (unreadable or not a dict) counts
+        and the invalid usernames
+    """
+    source = JsonFileBackend(storage_dir)
+    target = SqliteBackend(db_path or os.path.join(storage_dir, SQLITE_DB_NAME))
+    counts = {'migrated': 0, 'skipped': 0, 'invalid': 0, 'invalid_users': []}
+    try:
+        for username in source.users():
+            if not overwrite and target.version(username) is not None:
+                counts['skipped'] += 1
+                continue
+            try:
+                data = source.read(username)
+            except (OSError, ValueError) as e:
+                data = e
+            if not isinstance(data, dict):
+                print(f"[MIGRATE] Skipping {source.filename(username)}: {data if isinstance(data, Exception) else 'not a JSON object'}")
+                counts['invalid'] += 1
+                counts['invalid_users'].append(username)
+                continue
+            target.write(username, data)
+            counts['migrated'] += 1
+    finally:
+        target.close()
+    return counts
+
+
+def _move_file(src, dest):
+    """Rename src to dest; when dest already exists keep whichever was modified last."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.exists(dest) and os.stat(dest).st_mtime_ns >= os.stat(src).st_mtime_ns:
+        os.remove(src)
+    else:
+        os.replace(src, dest)
+
+
+def _move_dir(src, dest):
+    """Rename directory src to dest, merging it into dest entry by entry if dest exists."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if not os.path.exists(dest):
+        try:
+            os.rename(src, dest)
+            return
+        except OSError:
+            if not os.path.exists(dest): # Anything but "someone just created dest"
+                raise
+    for name in os.listdir(src):
+        child = os.path.join(src, name)
+        if os.path.isdir(child):
+            _move_dir(child, os.path.join(dest, name))
+        else:
+            _move_file(child, os.path.join(dest, name))
+    os.rmdir(src)
+
+
+def _is_user_dir(path):
+    """
+    A flat snake_code directory named like a shard ("ab") belongs to a user if it holds
+    anything besides shard directories (a user directory holds snake_echo_N/ and .py files).
+    """
+    names = os.listdir(path)
+    return bool(names) and not all(is_shard_name(n) and os.path.isdir(os.path.join(path, n)) for n in names)
+
+
+def _flat_entries(root, want_dirs, suffix=None):
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if want_dirs:
+            if os.path.isdir(path) and (not is_shard_name(name) or _is_user_dir(path)):
+                entries.append(name)
+        elif os.path.isfile(path) and name.endswith(suffix):
+            entries.append(name)
+    return entries
+
+
+def shard_user_data(root='user_data'):
+    """
+    Move every flat per-user entry under root into the sharded layout.
+
+    Returns:
+        dict with moved counts per tree (json, intro_markers, snake_code, replays), passes made,
+        errors and the entries still flat (normally none)
+    """
+    trees = [
+        ('json', root, False, '.json'),
+        (INTRO_MARKERS, os.path.join(root, INTRO_MARKERS), False, '.seen'),
+        (SNAKE_CODE, os.path.join(root, SNAKE_CODE), True, None),
+        (REPLAYS, os.path.join(root, REPLAYS), True, None),
+    ]
+    counts = {'json': 0, INTRO_MARKERS: 0, SNAKE_CODE: 0, REPLAYS: 0, 'passes': 0, 'errors': 0, 'left': []}
+    for _ in range(SHARD_PASSES):
+        counts['passes'] += 1
+        moved = 0
+        for key, tree_root, want_dirs, suffix in trees:
+            for name in _flat_entries(tree_root, want_dirs, suffix):
+                src = os.path.join(tree_root, name)
+                try:
+                    if want_dirs and is_shard_name(name):
+                        # A user named like a shard: new users' shard dirs may already live in
+                        # the same directory, so only the user's own entries are moved out
+                        dest = sharded_path(tree_root, safe_username(name) if key == REPLAYS else name)
+                        for child in os.listdir(src):
+                            child_path = os.path.join(src, child)
+                            if is_shard_name(child) and os.path.isdir(child_path):
+                                continue
+                            if os.path.isdir(child_path):
+                                _move_dir(child_path, os.path.join(dest, child))
+                            else:
+                                _move_file(child_path, os.path.join(dest, child))
+                    elif want_dirs:
+                        # Replays used to be recorded under the raw username; they are looked up by the safe one
+                        _move_dir(src, sharded_path(tree_root, safe_username(name) if key == REPLAYS else name))
+                    else:
+                        _move_file(src, sharded_path(tree_root, name))
+                except OSError as e:
+                    print(f"[MIGRATE] Could not shard {src}: {e}")
+                    counts['errors'] += 1
+                    continue
+                counts[key] += 1
+                moved += 1
+        if not moved:
+            break
+    counts['left'] = [os.path.join(tree_root, name) for _key, tree_root, want_dirs, suffix in trees
+                      for name in _flat_entries(tree_root, want_dirs, suffix)]
+    return counts
+
+
+def import_intro_markers(storage, root=USER_DATA_DIR):
+    """
+    Move the intro_markers/<user>.seen files into the user records (snake_intro_seen = True).
+
+    Markers are deleted only after the records are flushed, so an interrupted import is
+    simply repeated on the next run.
+
+    Returns:
+        dict with imported, already_set, orphaned (no user record) and errors counts
+    """
+    marker_root = os.path.join(root, INTRO_MARKERS)
+    counts = {'imported': 0, 'already_set': 0, 'orphaned': 0, 'errors': 0}
+    if not os.path.isdir(marker_root):
+        return counts
+    markers = list(iter_entries(marker_root, suffix='.seen'))
+    for name, _path in markers:
+        username = name[:-len('.seen')] # Marker names are already storage keys
+        user_data = storage.load_user_data(username)
+        if user_data is None:
+            counts['orphaned'] += 1
+        elif user_data.get('snake_intro_seen') is True:
+            counts['already_set'] += 1
+        else:
+            user_data['snake_intro_seen'] = True
+            if storage.save_user_data(username, user_data):
+                counts['imported'] += 1
+            else:
+                counts['errors'] += 1
+    storage.flush()
+    unflushed = set(storage.unflushed_users()) & {name[:-len('.seen')] for name, _path in markers}
+    counts['errors'] += len(unflushed) # Their saves didn't reach the backend; keep the markers
+    if not counts['errors']:
+        for _name, path in markers:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for directory, _dirs, _files in os.walk(marker_root, topdown=False):
+            try:
+                os.rmdir(directory) # Only succeeds for the (now) empty ones
+            except OSError:
+                pass
+    print(f"[MIGRATE] Intro markers: {counts['imported']} imported, {counts['already_set']} already set, "
+          f"{counts['orphaned']} without a user record, {counts['errors']} errors")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy user_data/*.json records into the SQLite storage backend")
+    parser.add_argument('--dir', default='user_data', help="Directory holding the <user>.json files")
+    parser.add_argument('--db', help=f"SQLite database (default: <dir>/{SQLITE_DB_NAME})")
+    parser.add_argument('--overwrite', action='store_true', help="Replace users that are already in the database")
+    parser.add_argument('--shard', action='store_true', help="Move flat per-user files into the sharded layout instead")
+    parser.add_argument('--intro-markers', action='store_true', help="Import intro_markers/*.seen into the user records instead")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    if args.intro_markers:
+        import_intro_markers(PersistentStorage(args.dir, flush_interval=0), args.dir)
+        return
+    if args.shard:
+        counts = shard_user_data(args.dir)
+        print(f"[MIGRATE] Sharded {counts['json']} user files, {counts[INTRO_MARKERS]} intro markers, "
+              f"{counts[SNAKE_CODE]} snake code dirs, {counts[REPLAYS]} replay dirs in {counts['passes']} passes, {counts['errors']} errors "
+              f"in {time.monotonic() - started:.2f}s")
+        if counts['left']:
+            print(f"[MIGRATE] Still flat (re-run to retry): {json.dumps(counts['left'])}")
+        return
+    counts = migrate_json_to_sqlite(args.dir, args.db, args.overwrite)
+    print(f"[MIGRATE] {counts['migrated']} migrated, {counts['skipped']} already present, "
+          f"{counts['invalid']} invalid in {time.monotonic() - started:.2f}s")
+    if counts['invalid_users']:
+        print(f"[MIGRATE] Invalid: {json.dumps(counts['invalid_users'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,545 @@
 import os
 import json
-from flask import session
+import copy
+import time
+import atexit
+import threading
+import collections
+import sqlite3
+import stat
+import tempfile
+from user_paths import iter_entries, safe_username, user_json_path
 import logging
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("storage")
 
+# Write-back cache of user records (see PersistentStorage)
+USER_CACHE_SIZE = 256 # Records kept in memory; the least recently used one is dropped (flushed first if dirty)
+USER_CACHE_FLUSH_INTERVAL = 2.0 # Seconds between background flushes of dirty records; 0 writes on every save
+USER_CACHE_FLUSH_WINDOW = 500 # Recent flushes kept for the latency percentiles
+
+# Where records live: 'json' (one file per user in storage_dir) or 'sqlite' (one WAL-mode database
+# in storage_dir). Existing JSON files can be copied over with migrate_storage.py.
+STORAGE_BACKEND = 'json'
+SQLITE_DB_NAME = 'users.sqlite3'
+SQLITE_BUSY_TIMEOUT = 5.0 # Seconds a write waits for another process (e.g. slith_pet.py) to finish its own
+# When JSON writes reach the disk: 'off' (renames keep files whole if the process dies, not on power loss),
+# 'each' (fsync every file and its directory) or 'batch' (fsync a whole flush's files, then each directory once)
+JSON_FSYNC = 'batch'
+
+class AtomicJsonWriter:
+    """
+    Writes JSON files through a temp file in the same directory that is renamed over the target,
+    so a crash leaves the old file or the new one, never a truncated one.
+
+    write_many() is a group commit: every file is written first, then (with fsync='batch') all
+    are fsynced back to back, renamed, and each directory is fsynced once for the whole group.
+
+    Args:
+        fsync: 'off', 'each' or 'batch' (see JSON_FSYNC)
+    """
+
+    def __init__(self, fsync=JSON_FSYNC):
+        self.fsync = fsync
+        self.counters = {'batches': 0, 'files': 0, 'bytes': 0, 'fsyncs': 0, 'dir_fsyncs': 0, 'errors': 0}
+
+    def _fsync_dir(self, directory):
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return # Directories can't be opened on Windows; the rename is still atomic
+        try:
+            os.fsync(fd)
+            self.counters['dir_fsyncs'] += 1
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def write(self, filename, data):
+        """Write one file; raises on failure"""
+        error = self.write_many({filename: data}).get(filename)
+        if error is not None:
+            raise error
+
+    def write_many(self, items):
+        """Write {filename: data} as one group. Returns {filename: exception} for the files that failed"""
+        errors = {}
+        staged = [] # (filename, temp path, open file)
+        self.counters['batches'] += 1
+        for filename, data in items.items():
+            directory = os.path.dirname(filename) or '.'
+            tmp = None
+            try:
+                text = json.dumps(data, indent=2, default=str)
+                fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix='.tmp', dir=directory)
+                f = os.fdopen(fd, 'w', encoding='utf-8')
+                staged.append((filename, tmp, f))
+                f.write(text)
+                f.flush()
+                try:
+                    os.chmod(tmp, stat.S_IMODE(os.stat(filename).st_mode)) # Keep the file's mode (mkstemp uses 0600)
+                except FileNotFoundError:
+                    os.chmod(tmp, 0o644)
+                self.counters['bytes'] += len(text.encode('utf-8'))
+                if self.fsync == 'each':
+                    os.fsync(f.fileno())
+                    self.counters['fsyncs'] += 1
+            except Exception as e:
+                errors[filename] = e
+        if self.fsync == 'batch':
+            for filename, tmp, f in staged:
+                if filename not in errors:
+                    try:
+                        os.fsync(f.fileno())
+                        self.counters['fsyncs'] += 1
+                    except OSError as e:
+                        errors[filename] = e
+        directories = set()
+        for filename, tmp, f in staged:
+            try:
+                f.close()
+                if filename in errors:
+                    os.remove(tmp)
+                    continue
+                os.replace(tmp, filename)
+                self.counters['files'] += 1
+                directory = os.path.dirname(filename) or '.'
+                if self.fsync == 'each':
+                    self._fsync_dir(directory)
+                else:
+                    directories.add(directory)
+            except Exception as e:
+                errors[filename] = e
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        if self.fsync == 'batch':
+            for directory in directories:
+                self._fsync_dir(directory)
+        self.counters['errors'] += len(errors)
+        return errors
+
+class JsonFileBackend:
+    """
+    One pretty-printed JSON file per user: <storage_dir>/<aa>/<bb>/<safe username>.json, or the
+    flat <storage_dir>/<safe username>.json for users not migrated yet (see user_paths.py).
+
+    Creating or deleting a user touches storage_dir, so its mtime (listing_version) still
+    changes when users come and go although the files live in shard directories.
+    """
+    name = 'json'
+
+    def __init__(self, storage_dir, writer=None):
+        self.storage_dir = storage_dir
+        self.writer = writer or AtomicJsonWriter()
+
+    def filename(self, username):
+        return user_json_path(username, self.storage_dir)
+
+    def _touch_listing(self):
+        try:
+            os.utime(self.storage_dir)
+        except OSError:
+            pass
+
+    def describe(self, username):
+        return self.filename(username)
+
+    def version(self, username):
+        """Changes whenever the record is written (the file's mtime); None if there is no record"""
+        try:
+            return os.stat(self.filename(username)).st_mtime_ns
+        except OSError:
+            return None
+
+    def read(self, username):
+        """The stored data, or None if there is no record. Raises ValueError/OSError on unreadable data"""
+        filename = self.filename(username)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, username, data):
+        error = self.write_many({username: data}).get(username)
+        if error is not None:
+            raise error
+
+    def write_many(self, items):
+        """Store {username: data} as one group commit. Returns {username: exception} for failures"""
+        filenames = {self.filename(username): username for username in items}
+        created = [filename for filename in filenames if not os.path.exists(filename)]
+        for filename in created:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        errors = self.writer.write_many({filename: items[username] for filename, username in filenames.items()})
+        if any(filename not in errors for filename in created):
+            self._touch_listing()
+        return {filenames[filename]: error for filename, error in errors.items()}
+
+    def io_stats(self):
+        return dict(self.writer.counters)
+
+    def delete(self, username):
+        """Remove the record. Returns False if there was none"""
+        filename = self.filename(username)
+        if not os.path.exists(filename):
+            return False
+        os.remove(filename)
+        self._touch_listing()
+        return True
+
+    def users(self):
+        """Storage keys of every stored user (both layouts)"""
+        return [name[:-5] for name, _path in iter_entries(self.storage_dir, suffix='.json')]
+
+    def listing_version(self):
+        """Changes when users may have been added or removed (the directory's mtime)"""
+        try:
+            return os.stat(self.storage_dir).st_mtime_ns
+        except OSError:
+            return None
+
+class SqliteBackend:
+    """
+    All users in one SQLite database in WAL mode, so readers never wait for a writer and each
+    save replaces the whole record atomically (no half-written files when two processes save).
+
+    Each record carries a version that goes up on every write, which the cache compares to notice
+    writes from other processes. One connection per backend, shared under a lock: under eventlet
+    every green thread runs on the same OS thread anyway.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.commits = self.rows_written = self.bytes_written = 0
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # WAL stays consistent; only the last commits can be lost on power failure
+            conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                         "username TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                         "version INTEGER NOT NULL, updated REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def describe(self, username):
+        return f"{self.path}[{safe_username(username)}]"
+
+    def version(self, username):
+        rows = self._query("SELECT version FROM users WHERE username = ?", (safe_username(username),))
+        return rows[0][0] if rows else None
+
+    def read(self, username):
+        rows = self._query("SELECT data FROM users WHERE username = ?", (safe_username(username),))
+        return json.loads(rows[0][0]) if rows else None
+
+    _UPSERT = ("INSERT INTO users (username, data, version, updated) VALUES (?, ?, 1, ?) "
+               "ON CONFLICT(username) DO UPDATE SET data = excluded.data, "
+               "version = users.version + 1, updated = excluded.updated")
+
+    def write(self, username, data):
+        error = self.write_many({username: data}).get(username)
+        if error is not None:
+            raise error
+
+    def write_many(self, items):
+        """Store {username: data} in one transaction (one WAL commit). Returns {username: exception} for failures"""
+        now = time.time()
+        try:
+            rows = [(safe_username(username), json.dumps(data, default=str), now) for username, data in items.items()]
+        except Exception as e:
+            return {username: e for username in items}
+        with self._lock:
+            conn = self._connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(self._UPSERT, rows)
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                return {username: e for username in items}
+            self.commits += 1
+            self.rows_written += len(rows)
+            self.bytes_written += sum(len(row[1]) for row in rows)
+        return {}
+
+    def io_stats(self):
+        return {'commits': self.commits, 'rows': self.rows_written, 'bytes': self.bytes_written}
+
+    def delete(self, username):
+        with self._lock:
+            cursor = self._connection().execute("DELETE FROM users WHERE username = ?", (safe_username(username),))
+            return cursor.rowcount > 0
+
+    def users(self):
+        return [row[0] for row in self._query("SELECT username FROM users ORDER BY username")]
+
+    def listing_version(self):
+        """Changes when another connection (e.g. slith_pet.py) commits; this connection's writes go through hooks"""
+        return self._query("PRAGMA data_version")[0][0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def make_backend(kind=None, storage_dir='user_data'):
+    """Backend for STORAGE_BACKEND (or `kind`) storing under storage_dir"""
+    kind = kind or STORAGE_BACKEND
+    if kind == 'sqlite':
+        return SqliteBackend(os.path.join(storage_dir, SQLITE_DB_NAME))
+    if kind == 'json':
+        return JsonFileBackend(storage_dir)
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+class _CachedRecord:
+    """One user's record in the cache."""
+    __slots__ = ('data', 'dirty', 'version', 'seq', 'stored')
+
+    def __init__(self, data, version, stored=None):
+        self.data = data # JSON-normalized dict (what a reload from disk would return); replaced, never changed
+        self.dirty = False # Saved since the last write to disk
+        self.version = version # Backend version when it was last read or written (None if not stored yet)
+        self.seq = 0 # Bumped on every save, so a flush knows whether it wrote the latest data
+        self.stored = stored # The data as stored at `version` (None if unknown); unwritten changes are relative to it
+
+def merge_changes(stored, base, ours):
+    """
+    Apply the top-level keys changed between base and ours on top of stored (a three-way merge).
+
+    Args:
+        stored: The record as it is stored now
+        base: The record ours was changed from (None if unknown: every key of ours counts as changed)
+        ours: The changed record
+
+    Returns:
+        (merged dict, keys that were changed on both sides; ours wins for those)
+    """
+    merged = dict(stored)
+    conflicts = []
+    for key, value in ours.items():
+        if base is None or key not in base or base[key] != value:
+            if base is not None and key in stored and stored[key] != base.get(key) and stored[key] != value:
+                conflicts.append(key)
+            merged[key] = value
+    if base is not None:
+        for key in base:
+            if key not in ours:
+                merged.pop(key, None)
+    return merged, conflicts
+
 class PersistentStorage:
     """
     Class to handle persistent storage of user progress
-    by saving data to JSON files on disk
+    in a backend on disk (JSON files or SQLite, see STORAGE_BACKEND)
+
+    Records are kept in a write-back cache: loads are served from memory and saves only mark
+    the record dirty; a background thread writes dirty records every flush_interval seconds
+    (and at exit) as one group commit, so a burst of saves for one user costs one write.
+    A cached record is re-read when its stored version changed, since slith_pet.py reads and
+    writes the same records directly. A dirty record whose stored version changed is rebased:
+    its unwritten top-level changes are reapplied on top of the newer stored record (on the
+    next load, and before the flush writes it), so neither process's update is lost.
     """
-    def __init__(self, storage_dir='user_data'):
+    def __init__(self, storage_dir='user_data', backend=None, cache_size=USER_CACHE_SIZE, flush_interval=USER_CACHE_FLUSH_INTERVAL):
         """Initialize with a directory to store user data"""
         self.storage_dir = storage_dir
         # Create the storage directory if it doesn't exist
         if not os.path.exists(storage_dir):
             os.makedirs(storage_dir)
-        logger.info(f"Storage initialized in directory: {storage_dir}")
+        self.backend = backend or make_backend(STORAGE_BACKEND, storage_dir)
+        logger.info(f"Storage initialized in directory: {storage_dir} ({self.backend.name})")
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache = collections.OrderedDict() # username -> _CachedRecord, least recently used first
+        self._cache_lock = threading.Lock() # Guards _cache order/membership and _user_locks
+        self._user_locks = {} # username -> Lock held while a record is read or changed
+        self._flush_lock = threading.Lock() # One group commit at a time, so an older snapshot never lands last
+        self._listeners = [] # Called as listener(event, username) on 'save' and 'delete'
+        self._flusher = None
+        self._flush_ms = collections.deque(maxlen=USER_CACHE_FLUSH_WINDOW)
+        self.counters = {'hits': 0, 'misses': 0, 'stale_reloads': 0, 'rebases': 0, 'saves': 0, 'bytes_saved': 0,
+                         'evictions': 0, 'flushes': 0, 'records_written': 0, 'write_errors': 0}
+        atexit.register(self.flush)
+
+    def add_listener(self, listener):
+        """Register listener(event, username), called after every save ('save') and delete ('delete')"""
+        self._listeners.append(listener)
+
+    def _notify(self, event, username):
+        for listener in self._listeners:
+            try:
+                listener(event, username)
+            except Exception as e:
+                logger.error(f"Storage listener failed on {event} for '{username}': {str(e)}")
 
     def get_user_filename(self, username):
-        """Generate a filename for the user's data"""
-        # Replace any characters that might cause issues in filenames
-        safe_username = "".join(c for c in username if c.isalnum() or c in "._- ")
-        return os.path.join(self.storage_dir, f"{safe_username}.json")
+        """Generate a filename for the user's data (JSON backend layout)"""
+        return user_json_path(username, self.storage_dir)
+
+    # --- Cache helpers ---
+    def _user_lock(self, username):
+        with self._cache_lock:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.Lock()
+            return lock
+
+    def _touch(self, username):
+        with self._cache_lock:
+            if username in self._cache:
+                self._cache.move_to_end(username)
+
+    def _cache_insert(self, username, record, replace=None):
+        """
+        Insert or refresh a record as most recently used (call with the user's lock held).
+
+        Args:
+            replace: Only insert if the cached record is still this one (None: only if there is none)
+
+        Returns:
+            The evicted dirty records; pass them to _write_evicted once the user lock is released
+            (writing takes the flush lock, which is taken before user locks)
+        """
+        with self._cache_lock:
+            current = self._cache.get(username)
+            if current is not None and current is not record and current is not replace:
+                return [] # Someone else's newer record is already cached
+            self._cache[username] = record
+            self._cache.move_to_end(username)
+            evicted = []
+            while len(self._cache) > self.cache_size:
+                evicted.append(self._cache.popitem(last=False))
+        self.counters['evictions'] += len(evicted)
+        return [(old_username, old_record) for old_username, old_record in evicted if old_record.dirty]
+
+    def _write_evicted(self, dirty):
+        if dirty:
+            self._write_records(dirty)
+
+    def _rebase_if_changed(self, username, record):
+        """
+        Reapply a dirty record's changes on top of the stored record if another process wrote it
+        since it was cached (call with the user's lock held).
+        """
+        version = self._stored_version(username)
+        if version is None or version == record.version:
+            return
+        stored = self._read_record(username)
+        if stored is None:
+            return # Unreadable: the next write replaces it
+        merged, conflicts = merge_changes(stored, record.stored, record.data)
+        if conflicts:
+            logger.warning(f"User data {self.backend.describe(username)} changed on disk and in the cache; keeping the cached {conflicts}")
+        record.data = merged
+        record.stored = stored
+        record.version = version
+        record.seq += 1 # A flush holding the pre-rebase data must leave the record dirty
+        self.counters['rebases'] += 1
+
+    def _write_records(self, records):
+        """Group-commit [(username, record)] to the backend. Returns the usernames written."""
+        with self._flush_lock:
+            batch = {} # username -> (record, seq, data) as of the snapshot
+            for username, record in records:
+                with self._user_lock(username):
+                    if not record.dirty: # Deleted, or written by an earlier flush
+                        continue
+                    self._rebase_if_changed(username, record) # e.g. slith_pet.py saved since the record was cached
+                    batch[username] = (record, record.seq, record.data)
+            if not batch:
+                return []
+            try:
+                errors = self.backend.write_many({username: data for username, (_record, _seq, data) in batch.items()})
+            except Exception as e:
+                errors = {username: e for username in batch}
+            written = []
+            for username, (record, seq, _data) in batch.items():
+                if username in errors:
+                    self.counters['write_errors'] += 1
+                    logger.error(f"Error saving user data: {str(errors[username])}")
+                    continue
+                version = self._stored_version(username)
+                with self._user_lock(username):
+                    if record.seq == seq: # Not saved again while the batch was being written
+                        record.dirty = False
+                    record.version = version
+                    record.stored = batch[username][2]
+                written.append(username)
+            self.counters['records_written'] += len(written)
+            return written
+
+    def _start_flusher(self):
+        with self._cache_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="user-cache-flusher", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write every dirty record to disk. Returns the number of records written."""
+        with self._cache_lock:
+            dirty = [(username, record) for username, record in self._cache.items() if record.dirty]
+        if not dirty:
+            return 0
+        start = time.monotonic()
+        written = len(self._write_records(dirty))
+        self._flush_ms.append((time.monotonic() - start) * 1000)
+        self.counters['flushes'] += 1
+        logger.info(f"Flushed {written} user record(s) in {self._flush_ms[-1]:.1f} ms")
+        return written
+
+    def unflushed_users(self):
+        """Usernames with saves that haven't been written to the backend yet"""
+        with self._cache_lock:
+            return [username for username, record in self._cache.items() if record.dirty]
+
+    def get_stats(self):
+        """Cache hit ratio, size, flush latency (ms) and what the backend actually wrote."""
+        with self._cache_lock:
+            cached = len(self._cache)
+            dirty = sum(1 for record in self._cache.values() if record.dirty)
+        flush_ms = sorted(self._flush_ms)
+        lookups = self.counters['hits'] + self.counters['misses']
+        stats = dict(self.counters)
+        stats.update({
+            'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else None,
+            'cached': cached,
+            'dirty': dirty,
+            'backend': self.backend.name,
+            'cache_size': self.cache_size,
+            'flush_interval': self.flush_interval,
+            'flush_ms_p50': round(flush_ms[len(flush_ms) // 2], 3) if flush_ms else None,
+            'flush_ms_p95': round(flush_ms[min(len(flush_ms) - 1, int(len(flush_ms) * 0.95))], 3) if flush_ms else None,
+            'flush_ms_max': round(flush_ms[-1], 3) if flush_ms else None,
+            'io': self.backend.io_stats(),
+        })
+        # Saves per record actually written (bursts coalesced by the cache) and bytes written per byte saved
+        stats['saves_per_write'] = round(stats['saves'] / stats['records_written'], 3) if stats['records_written'] else None
+        if stats['bytes_saved'] and stats['io'].get('bytes') is not None:
+            stats['write_amplification'] = round(stats['io']['bytes'] / stats['bytes_saved'], 3)
+        return stats
 
     def save_user_data(self, username, user_data_to_save): # Changed parameter name for clarity
-        """Save user session data to a file"""
+        """Save user session data (to the cache; the file is written by the next flush)"""
         if not username:
             logger.warning("Cannot save data: Empty username")
             return False
@@ -39,41 +551,105 @@ class PersistentStorage:
             # logger.error(f"Problematic data: {user_data_to_save}")
             return False # Prevent saving incorrect data type
 
-        filename = self.get_user_filename(username)
-
         # Log what we're saving (be careful with sensitive data in real apps)
-        logger.info(f"Saving data for user '{username}' to {filename}")
+        logger.info(f"Saving data for user '{username}' to {self.backend.describe(username)}")
         # Example logging specific fields:
         # logger.info(f"Saving XP: {user_data_to_save.get('xp')}, Completed: {len(user_data_to_save.get('completed', []))}")
         # logger.info(f"Saving snake_intro_seen: {user_data_to_save.get('snake_intro_seen')}")
 
         try:
-            # Save to file
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(user_data_to_save, f, indent=2, default=str) # Added default=str for non-serializables
-
-            logger.info("User data saved successfully")
-            return True
+            # Snapshot as the file would store it (default=str for non-serializables), so later
+            # changes to the caller's dict don't leak into the cache
+            text = json.dumps(user_data_to_save, default=str)
+            data = json.loads(text)
         except Exception as e:
             logger.error(f"Error saving user data: {str(e)}")
             return False
 
+        with self._user_lock(username):
+            with self._cache_lock:
+                record = self._cache.get(username)
+            if record is None:
+                record = _CachedRecord(data, self._stored_version(username))
+            record.data = data
+            record.dirty = True
+            record.seq += 1
+            self.counters['saves'] += 1
+            self.counters['bytes_saved'] += len(text)
+            evicted = self._cache_insert(username, record) # Under the lock, so a concurrent load can't replace it
+        self._write_evicted(evicted)
+        if not self.flush_interval:
+            if not self._write_records([(username, record)]): # Write-through
+                return False
+        else:
+            self._start_flusher()
+        self._notify('save', username)
+        logger.info("User data saved successfully")
+        return True
+
+    def _stored_version(self, username):
+        try:
+            return self.backend.version(username)
+        except Exception as e:
+            logger.error(f"Error checking stored user data for '{username}': {str(e)}")
+            return None
+
     def load_user_data(self, username):
-        """Load user data from file. Returns the loaded dict or None."""
+        """Load user data from the cache or backend. Returns the loaded dict or None."""
         if not username:
             logger.warning("Cannot load data: Empty username")
             return None # Return None instead of False on failure
+        return self._load(username, copy.deepcopy) # Callers change the dict they get
 
-        filename = self.get_user_filename(username)
-        logger.info(f"Attempting to load user data for '{username}' from {filename}")
+    def get_user_value(self, username, key, default=None):
+        """
+        One top-level value of the user's record, without copying the whole record
+        (for flags checked on every request, e.g. snake_intro_seen).
 
-        if not os.path.exists(filename):
-            logger.warning(f"User data file not found: {filename}")
-            return None # Return None if file doesn't exist
+        Returns:
+            The value, or default if the user or key doesn't exist
+        """
+        if not username:
+            return default
+        data = self._load(username, lambda data: data)
+        return copy.deepcopy(data.get(key, default)) if data is not None else default
+
+    def _load(self, username, extract):
+        """Cached record of username passed through extract (or None), reading the backend on a miss or stale entry"""
+        with self._user_lock(username):
+            with self._cache_lock:
+                record = self._cache.get(username)
+            if record is not None and record.dirty:
+                self._rebase_if_changed(username, record) # Don't hide another process's newer save
+                self.counters['hits'] += 1
+                self._touch(username)
+                return extract(record.data)
+            version = self._stored_version(username)
+            if record is not None:
+                if version == record.version:
+                    self.counters['hits'] += 1
+                    self._touch(username)
+                    return extract(record.data)
+                self.counters['stale_reloads'] += 1 # Written by another process (slith_pet.py)
+            self.counters['misses'] += 1
+            user_data = self._read_record(username)
+            evicted = []
+            if user_data is not None:
+                # Still under the user lock: a save can't slip in between the read and the insert
+                data = copy.deepcopy(user_data)
+                evicted = self._cache_insert(username, _CachedRecord(data, version, data), replace=record)
+        self._write_evicted(evicted)
+        return user_data
+
+    def _read_record(self, username):
+        filename = self.backend.describe(username)
+        logger.info(f"Attempting to load user data for '{username}' from {filename}")
 
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
+            user_data = self.backend.read(username)
+            if user_data is None:
+                logger.warning(f"User data file not found: {filename}")
+                return None # Return None if there is no record
 
             # --- ADDED: Validate that loaded data is a dictionary ---
             if not isinstance(user_data, dict):
@@ -97,18 +673,29 @@ class PersistentStorage:
         if not username:
             logger.warning("Cannot delete data: Empty username")
             return False
-        filename = self.get_user_filename(username)
-        if os.path.exists(filename):
+        filename = self.backend.describe(username)
+        with self._flush_lock, self._user_lock(username): # A flush in progress must not write the record back
+            with self._cache_lock:
+                record = self._cache.pop(username, None)
+            was_unflushed = record is not None and record.dirty
+            if record is not None:
+                record.dirty = False # A flush already holding this record must not write it back
             try:
-                os.remove(filename)
+                deleted = self.backend.delete(username)
+            except Exception as e:
+                logger.error(f"Error deleting user data file {filename}: {e}")
+                return False
+            if deleted or was_unflushed:
+                self._notify('delete', username)
+            if deleted:
                 logger.info(f"Deleted user data file: {filename}")
                 return True
-            except OSError as e:
-                logger.error(f"Error deleting user data file {filename}: {e}")
+            elif was_unflushed:
+                logger.info(f"Deleted unflushed user data for '{username}'")
+                return True
+            else:
+                logger.warning(f"Attempted to delete non-existent user data file: {filename}")
                 return False
-        else:
-            logger.warning(f"Attempted to delete non-existent user data file: {filename}")
-            return False
 
 
 # Create a global instance to use throughout the app
@@ -0,0 +1,120 @@
+"""
+preview_latency.py - Where the time between a key press and the frame showing it goes.
+
+Each direction input is followed through the preview pipeline:
+
+    client keydown --network--> change_direction received --queue--> sent to the worker
+      --to_worker--> get_user_direction() returns --student--> next state sent
+      --to_emit--> frame emitted --network--> frame drawn on the page
+
+Server-side stages use time.monotonic(), which the worker process shares with the server on
+Linux. The page only knows its own clock, so it reports keydown-to-draw (total) and
+frame-arrival-to-draw (render); the socket legs in both directions, eventlet hub delays
+included, come out as network = total - server - render.
+
+Samples go into fixed-bucket histograms, globally and per session (the most recent
+LATENCY_SESSIONS sessions are kept), so percentiles cost the same after a million inputs.
+"""
+import bisect
+import collections
+import threading
+
+STAGES = ('network', 'queue', 'to_worker', 'student', 'to_emit', 'server', 'render', 'total')
+LATENCY_SESSIONS = 100 # Sessions whose own histograms are kept
+LATENCY_MAX_MS = 10000.0 # Samples above this (or negative from clock skew) are clamped
+
+# Bucket upper bounds in ms: 0.1 ms to 10 s, ~12% apart, so a percentile is off by at most that
+_BUCKETS = []
+_bound = 0.1
+while _bound < LATENCY_MAX_MS:
+    _BUCKETS.append(round(_bound, 3))
+    _bound *= 1.12
+_BUCKETS.append(LATENCY_MAX_MS)
+
+
+class LatencyHistogram:
+    """Counts of samples (ms) per bucket plus count, sum and max."""
+
+    def __init__(self):
+        self.counts = [0] * len(_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        ms = min(max(ms, 0.0), LATENCY_MAX_MS)
+        self.counts[bisect.bisect_left(_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile (None without samples)."""
+        if not self.count:
+            return None
+        rank = max(1, int(self.count * pct / 100 + 0.5))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_BUCKETS[i], round(self.max, 3))
+        return round(self.max, 3)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': round(self.max, 3) if self.count else None,
+        }
+
+
+class LatencyTracker:
+    """Global and per-session histograms for every stage in STAGES."""
+
+    def __init__(self, max_sessions=LATENCY_SESSIONS):
+        self.max_sessions = max_sessions
+        self._global = {stage: LatencyHistogram() for stage in STAGES}
+        self._sessions = collections.OrderedDict() # sid -> {stage: LatencyHistogram}
+        self._lock = threading.Lock()
+
+    def record(self, sid, samples):
+        """Add {stage: ms} samples for one input (stages that weren't measured are left out)."""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                session = self._sessions[sid] = {stage: LatencyHistogram() for stage in STAGES}
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(sid)
+            for stage, ms in samples.items():
+                if stage in self._global and ms is not None:
+                    self._global[stage].add(ms)
+                    session[stage].add(ms)
+
+    def record_client(self, sid, report):
+        """Add the page's report for one input: total and render times, plus the server time it was shown."""
+        try:
+            total = float(report['total_ms'])
+            render = float(report['render_ms'])
+            server = float(report['server_ms'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        self.record(sid, {'total': total, 'render': render, 'network': total - server - render})
+        return True
+
+    def get_stats(self, sid=None):
+        """Per-stage summaries, for one session when sid is given."""
+        with self._lock:
+            if sid is not None:
+                histograms = self._sessions.get(sid)
+                if histograms is None:
+                    return {'sid': sid, 'stages': {}}
+                return {'sid': sid, 'stages': {stage: h.summary() for stage, h in histograms.items()}}
+            return {
+                'stages': {stage: h.summary() for stage, h in self._global.items()},
+                'sessions': len(self._sessions),
+            }
@@ -0,0 +1,185 @@
+"""
+process_limits.py - Per-job resource limits and usage accounting for worker processes.
+
+Pooled workers run many student programs, so limits are applied as soft rlimits relative to
+what the warm worker already uses and restored after each job (lowering a hard limit cannot
+be undone by an unprivileged process). CPU overruns arrive as SIGXCPU, which the worker turns
+into an exception; address-space and open-file limits surface as MemoryError and EMFILE.
+
+Usage is measured per job: CPU time from getrusage deltas and peak RSS from VmHWM, which
+Linux lets a process reset through /proc/self/clear_refs. Elsewhere the lifetime ru_maxrss
+is reported instead.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+try:
+    import resource # POSIX only; limits are skipped where it is unavailable (Windows)
+except ImportError:
+    resource = None
+
+_PROC_STATUS = '/proc/self/status'
+_PROC_STATM = '/proc/self/statm'
+_PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def _cpu_time():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _address_space_bytes():
+    """Current virtual memory size, or None if it can't be read (non-Linux)."""
+    try:
+        with open(_PROC_STATM, 'r') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _set_soft_limit(kind, soft):
+    """Set a soft limit (never above the hard one). Returns the previous soft limit."""
+    old_soft, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY and (soft == resource.RLIM_INFINITY or soft > hard):
+        soft = hard
+    resource.setrlimit(kind, (soft, hard))
+    return old_soft
+
+
+def set_cpu_budget(seconds):
+    """Allow the current process `seconds` more CPU time (or lift the limit when seconds is None)."""
+    if resource is None:
+        return
+    if seconds is None:
+        _set_soft_limit(resource.RLIMIT_CPU, resource.RLIM_INFINITY)
+        return
+    _set_soft_limit(resource.RLIMIT_CPU, int(_cpu_time() + seconds) + 1)
+
+
+def apply_job_limits(cpu_seconds=None, memory_bytes=None, max_open_files=None):
+    """
+    Apply soft limits for the next job.
+
+    Args:
+        cpu_seconds: CPU seconds the job may use (SIGXCPU when exceeded)
+        memory_bytes: Address space the job may add on top of what the process already maps
+        max_open_files: Highest number of file descriptors the process may hold
+
+    Returns:
+        Saved soft limits to pass to restore_job_limits()
+    """
+    saved = {}
+    if resource is None:
+        return saved
+    if cpu_seconds is not None:
+        saved[resource.RLIMIT_CPU] = _set_soft_limit(resource.RLIMIT_CPU, int(_cpu_time() + cpu_seconds) + 1)
+    if memory_bytes is not None and hasattr(resource, 'RLIMIT_AS'):
+        current = _address_space_bytes()
+        if current is not None:
+            saved[resource.RLIMIT_AS] = _set_soft_limit(resource.RLIMIT_AS, current + int(memory_bytes))
+    if max_open_files is not None:
+        saved[resource.RLIMIT_NOFILE] = _set_soft_limit(resource.RLIMIT_NOFILE, int(max_open_files))
+    return saved
+
+
+def restore_job_limits(saved):
+    """Put back the soft limits returned by apply_job_limits()."""
+    for kind, soft in saved.items():
+        try:
+            _set_soft_limit(kind, soft)
+        except (ValueError, OSError) as e:
+            print(f"[LIMITS] Could not restore limit {kind}: {e}")
+
+
+def _read_peak_rss_kb():
+    try:
+        with open(_PROC_STATUS, 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+class JobUsage:
+    """Measures CPU time, wall time and peak RSS of one job in the current process."""
+
+    def __init__(self):
+        try:
+            with open(_PROC_CLEAR_REFS, 'w') as f:
+                f.write('5') # Reset VmHWM so the peak belongs to this job, not an earlier one
+        except OSError:
+            pass
+        self._cpu_start = _cpu_time()
+        self._wall_start = time.monotonic()
+
+    def finish(self):
+        return {
+            'cpu_seconds': round(_cpu_time() - self._cpu_start, 3),
+            'wall_seconds': round(time.monotonic() - self._wall_start, 3),
+            'peak_rss_kb': _read_peak_rss_kb(),
+        }
+
+
+class UsageAccounting:
+    """
+    Keeps per-session usage records and aggregates for sizing the server.
+
+    Args:
+        log_path: JSON-lines file every record is appended to (None to keep records in memory only)
+        window: Number of recent records kept in memory
+    """
+
+    def __init__(self, log_path=None, window=500):
+        self.log_path = log_path
+        self._recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.totals = {'sessions': 0, 'cpu_seconds': 0.0, 'limit_hits': {}}
+        self.max_cpu_seconds = 0.0
+        self.max_peak_rss_kb = 0
+
+    def record(self, entry):
+        entry = dict(entry, time=round(time.time(), 3))
+        with self._lock:
+            self._recent.append(entry)
+            self.totals['sessions'] += 1
+            self.totals['cpu_seconds'] += entry.get('cpu_seconds') or 0.0
+            self.max_cpu_seconds = max(self.max_cpu_seconds, entry.get('cpu_seconds') or 0.0)
+            self.max_peak_rss_kb = max(self.max_peak_rss_kb, entry.get('peak_rss_kb') or 0)
+            if entry.get('limit'):
+                hits = self.totals['limit_hits']
+                hits[entry['limit']] = hits.get(entry['limit'], 0) + 1
+        if self.log_path:
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                print(f"[LIMITS] Could not write usage log {self.log_path}: {e}")
+
+    def get_stats(self):
+        """Totals, maxima and percentiles over the recent window."""
+        with self._lock:
+            recent = list(self._recent)
+            stats = {
+                'sessions': self.totals['sessions'],
+                'cpu_seconds_total': round(self.totals['cpu_seconds'], 3),
+                'cpu_seconds_max': round(self.max_cpu_seconds, 3),
+                'peak_rss_kb_max': self.max_peak_rss_kb,
+                'limit_hits': dict(self.totals['limit_hits']),
+            }
+        cpu = sorted(r['cpu_seconds'] for r in recent if r.get('cpu_seconds') is not None)
+        rss = sorted(r['peak_rss_kb'] for r in recent if r.get('peak_rss_kb') is not None)
+        for name, values in (('cpu_seconds', cpu), ('peak_rss_kb', rss)):
+            stats[f'{name}_p50'] = values[len(values) // 2] if values else None
+            stats[f'{name}_p95'] = values[min(len(values) - 1, int(len(values) * 0.95))] if values else None
+        stats['recent'] = recent[-20:]
+        return stats
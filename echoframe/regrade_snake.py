@@ -0,0 +1,180 @@
+"""
+regrade_snake.py - Re-check every stored snake submission against snake_quests.json.
+
+Walks user_data/snake_code/<aa>/<bb>/<user>/snake_echo_N/ (and flat <user>/ directories not
+sharded yet), runs each echo's files through the grading sandbox with quest N's
+check_var/expected (the same check the quest page uses) and appends one row per submission to
+a TSV file:
+
+    user  echo  status  error  runtime_ms  files_hash  quest_hash
+
+status is pass, fail (ran, wrong answer or failed a behavior scenario) or error (exception/timeout). Rows are flushed as
+they finish, so an interrupted run can be restarted with the same --out file: submissions
+whose (user, echo, files_hash, quest_hash) already has a row are skipped. Changing a quest's
+expectations changes quest_hash, so those submissions are graded again.
+
+Usage (from the echoframe directory):
+    python regrade_snake.py                              # Everything, results in regrade_results.tsv
+    python regrade_snake.py --workers 16 --out run2.tsv
+    python regrade_snake.py --users alice bob --echo 5 8
+    python regrade_snake.py --fresh                      # Ignore and overwrite existing results
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import grading_sandbox
+from snake_code_store import code_store
+from user_paths import iter_entries
+
+DEFAULT_CODE_ROOT = os.path.join('user_data', 'snake_code')
+DEFAULT_QUESTS_FILE = 'snake_quests.json'
+DEFAULT_OUT = 'regrade_results.tsv'
+MAX_ERROR_CHARS = 200
+
+COLUMNS = ['user', 'echo', 'status', 'error', 'runtime_ms', 'files_hash', 'quest_hash']
+ECHO_DIR_RE = re.compile(r'^snake_echo_(\d+)$')
+
+
+def files_hash(files):
+    """Stable hash of a {filename: source} dict."""
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(files[name].encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def quest_hash(quest):
+    """Hash of the parts of a quest that decide pass/fail."""
+    parts = [quest.get('check_var'), quest.get('expected')]
+    if quest.get('behavior'):
+        parts.append(quest['behavior'])
+    spec = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]
+
+
+def find_submissions(code_root, users=None, echoes=None):
+    """Yield (user, echo, echo_dir) for every snake_echo_N directory, in a stable order."""
+    for user, user_dir in iter_entries(code_root, want_dirs=True):
+        if users and user not in users:
+            continue
+        for entry in sorted(os.listdir(user_dir)):
+            match = ECHO_DIR_RE.match(entry)
+            if not match or not os.path.isdir(os.path.join(user_dir, entry)):
+                continue
+            echo = int(match.group(1))
+            if echoes and echo not in echoes:
+                continue
+            yield user, echo, os.path.join(user_dir, entry)
+
+
+def load_files(echo_dir):
+    """Read the .py files of one submission (through the code store, like the app)."""
+    files = code_store.read_dir(echo_dir)
+    return {filename: files[filename] for filename in sorted(files) if filename.endswith('.py')}
+
+
+def load_done_keys(out_path):
+    """Keys of submissions that already have a row in the results file."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            done.add((row['user'], row['echo'], row['files_hash'], row['quest_hash']))
+    return done
+
+
+def _clean_error(error):
+    if not error:
+        return ''
+    error = ' '.join(str(error).split()) # Keep each row on one line
+    return error if len(error) <= MAX_ERROR_CHARS else error[:MAX_ERROR_CHARS - 3] + '...'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch regrade stored snake submissions")
+    parser.add_argument('--root', default=DEFAULT_CODE_ROOT, help="Directory holding <user>/snake_echo_N folders")
+    parser.add_argument('--quests', default=DEFAULT_QUESTS_FILE, help="Snake quest definitions")
+    parser.add_argument('--out', default=DEFAULT_OUT, help="TSV results file (appended to when resuming)")
+    parser.add_argument('--workers', type=int, default=grading_sandbox.GRADING_POOL_SIZE, help="Sandbox worker processes")
+    parser.add_argument('--users', nargs='+', help="Only regrade these users")
+    parser.add_argument('--echo', type=int, nargs='+', help="Only regrade these echo numbers (1-based)")
+    parser.add_argument('--fresh', action='store_true', help="Start a new results file instead of resuming")
+    args = parser.parse_args()
+
+    with open(args.quests, 'r', encoding='utf-8') as f:
+        quests = json.load(f)
+
+    if args.fresh and os.path.exists(args.out):
+        os.remove(args.out)
+    done_keys = load_done_keys(args.out)
+    new_file = not os.path.exists(args.out)
+
+    sandbox = grading_sandbox.GradingSandbox(size=args.workers)
+    sandbox.start()
+    counts = {'pass': 0, 'fail': 0, 'error': 0, 'skipped': 0}
+    in_flight = {} # future -> (row without results, quest, files, submit time)
+    started = time.monotonic()
+
+    with open(args.out, 'a', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        if new_file:
+            writer.writerow(COLUMNS)
+            out.flush()
+
+        def collect(futures):
+            for future in futures:
+                row, quest, files, submitted = in_flight.pop(future)
+                runtime_ms = round((time.monotonic() - submitted) * 1000)
+                result_str, _debug, err, _err_line = future.result()
+                success, error = grading_sandbox.evaluate_snake_result(result_str, err, quest.get('check_var'),
+                                                                       quest.get('expected'))
+                if success and quest.get('behavior'):
+                    success, error = grading_sandbox.grade_snake_behavior(sandbox, files, quest)
+                status = 'pass' if success else ('error' if err else 'fail')
+                counts[status] += 1
+                writer.writerow(row[:2] + [status, _clean_error(error), runtime_ms] + row[2:])
+            out.flush() # Rows on disk are what a resumed run skips
+
+        for user, echo, echo_dir in find_submissions(args.root, args.users, args.echo):
+            if not 1 <= echo <= len(quests):
+                print(f"[REGRADE] Skipping {echo_dir}: no snake quest #{echo}")
+                continue
+            quest = quests[echo - 1]
+            files = load_files(echo_dir)
+            if not files:
+                continue
+            key = (user, str(echo), files_hash(files), quest_hash(quest))
+            if key in done_keys:
+                counts['skipped'] += 1
+                continue
+            # Keep one job per worker in flight so runtime_ms measures the run, not the queue
+            while len(in_flight) >= sandbox.size:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                collect(finished)
+            future = sandbox.submit_snake(files, quest.get('check_var'))
+            in_flight[future] = ([user, echo, key[2], key[3]], quest, files, time.monotonic())
+        if in_flight:
+            collect(wait(list(in_flight)).done)
+
+    sandbox.shutdown()
+    elapsed = time.monotonic() - started
+    graded = counts['pass'] + counts['fail'] + counts['error']
+    print(f"[REGRADE] Graded {graded} submissions in {elapsed:.1f}s "
+          f"(pass: {counts['pass']}, fail: {counts['fail']}, error: {counts['error']}, "
+          f"already graded: {counts['skipped']}) -> {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -144,9 +144,13 @@ except ImportError as e:
 # --- Storage Path & Load/Save Functions ---
 STORAGE_DIR = os.path.join(SCRIPT_DIR, 'user_data')
 logging.info(f"User data storage directory: {STORAGE_DIR}")
+# Same backend and layout as the app (JSON files in shard directories, or the SQLite database);
+# JSON saves go through a temp file + rename, so the app never reads a half-written save
+from persistent_storage import STORAGE_BACKEND, make_backend
+storage_backend = make_backend(STORAGE_BACKEND, STORAGE_DIR)
 
 def load_pet_data_direct(username):
-    filename = os.path.join(STORAGE_DIR, f"{username}.json")
+    filename = storage_backend.describe(username)
     default_vitals = {'food': 100, 'water': 100, 'entertainment': 100, 'love': 100, 'patience': 100}
     default_pet_state = {
         'stage': 0, 'unlocked': False, 'vitals': default_vitals.copy(),
@@ -160,11 +164,11 @@ def load_pet_data_direct(username):
         'high_scores': {'node_defender': 0, 'terminal_typer': 0, 'neon_jetpack': 0, 'signal_tracer': 0}
     }
     default_user_data = { 'slith_pet': default_pet_state, 'completed': [], 'snake_intro_seen': False }
-    if not os.path.exists(filename):
-        logging.warning(f"Load: Pet data file not found for {username} at {filename}. Returning defaults.")
-        return default_user_data
     try:
-        with open(filename, 'r', encoding='utf-8') as f: data = json.load(f)
+        data = storage_backend.read(username)
+        if data is None:
+            logging.warning(f"Load: Pet data file not found for {username} at {filename}. Returning defaults.")
+            return default_user_data
         logging.info(f"Load: Successfully read JSON from {filename}")
         merged_data = default_user_data.copy(); merged_data.update(data)
         if 'slith_pet' not in merged_data or not isinstance(merged_data['slith_pet'], dict):
@@ -194,14 +198,14 @@ def load_pet_data_direct(username):
         return default_user_data
 
 def save_pet_data_direct(username, user_data):
-    filename = os.path.join(STORAGE_DIR, f"{username}.json")
+    filename = storage_backend.describe(username)
     try:
         if 'slith_pet' in user_data and isinstance(user_data['slith_pet'], dict):
             if 'last_update_time' not in user_data['slith_pet']: user_data['slith_pet']['last_update_time'] = time.time()
             if 'vitals' not in user_data['slith_pet'] or not isinstance(user_data['slith_pet']['vitals'], dict):
                  user_data['slith_pet']['vitals'] = {'food': 100, 'water': 100, 'entertainment': 100, 'love': 100, 'patience': 100}
         os.makedirs(STORAGE_DIR, exist_ok=True)
-        with open(filename, 'w', encoding='utf-8') as f: json.dump(user_data, f, indent=2)
+        storage_backend.write(username, user_data)
         logging.info(f"Save: Saved pet data for {username} to {filename}")
     except IOError as e:
         logging.error(f"Save: Error saving pet data for {username}: {e}")
@@ -0,0 +1,226 @@
+"""
+snake_behavior.py - Scripted-input behavioral checks for snake quests.
+
+Checking `str(env[check_var])` after the files ran says nothing about whether the game
+actually plays. A quest can add a "behavior" block to snake_quests.json:
+
+    "behavior": {
+      "compare": ["snake", "game_over"],     # What is checked every tick
+      "scenarios": [
+        {"name": "turns", "ticks": 12, "keys": {"2": "UP", "5": "LEFT"}},
+        {"name": "chase food", "ticks": 150, "seek": true, "seed": 7}
+      ]
+    }
+
+Each scenario runs the student's game headless (headless_pygame) with a fixed seed in a
+grading worker. Arrow-key KEYDOWN events are delivered at the start of the scripted tick,
+or for "seek" scenarios computed every tick from the game state so the snake chases the
+food. At the end of every frame the student's state (snake.positions, food.position,
+score, game_over) is compared with the reference engine (snake_engine.SnakeEngine) stepped
+from the previous frame's state with the same input. The first difference stops the run.
+
+Growth may show on the tick the food is eaten or on the next one (snakedebug grows on the
+next update). Food may respawn anywhere off the snake; the engine adopts the student's
+food position, score and body every tick, so one mistake is reported once, where it happens.
+"""
+import random
+
+import numpy as np
+
+from snake_engine import DIRECTION_CODES, DIRECTIONS, SnakeEngine, food_seeking_directions
+
+DEFAULT_TICKS = 60
+DEFAULT_SEED = 1234
+COMPARE_FIELDS = ('snake', 'food', 'score', 'game_over')
+SEEK_NOISE = 0.1 # Share of "seek" ticks with a random direction, so turns and self-collisions get tried
+_REVERSE = {'UP': 'DOWN', 'DOWN': 'UP', 'LEFT': 'RIGHT', 'RIGHT': 'LEFT'}
+
+
+class BehaviorDivergence(BaseException):
+    """The student's game differs from the reference; BaseException so student `except Exception:` can't hide it."""
+
+
+class ScenarioComplete(BaseException):
+    """All scripted ticks were checked (or the game ended as expected)."""
+
+
+def scenarios_for(quest):
+    """Scenario dicts of a quest's "behavior" block, with the quest's compare list and defaults filled in."""
+    behavior = quest.get('behavior') or {}
+    compare = [field for field in behavior.get('compare', ['snake']) if field in COMPARE_FIELDS]
+    scenarios = []
+    for i, scenario in enumerate(behavior.get('scenarios', [])):
+        scenarios.append({
+            'name': scenario.get('name', f"scenario {i + 1}"),
+            'ticks': int(scenario.get('ticks', DEFAULT_TICKS)),
+            'seed': int(scenario.get('seed', DEFAULT_SEED)),
+            'keys': {int(tick): direction for tick, direction in scenario.get('keys', {}).items()},
+            'seek': bool(scenario.get('seek', False)),
+            'compare': scenario.get('compare', compare),
+        })
+    return scenarios
+
+
+def _cell(value):
+    x, y = value
+    return (int(x), int(y))
+
+
+def read_student_state(env):
+    """The parts of the student's namespace the checks look at (None where missing)."""
+    state = {'snake': None, 'food': None, 'score': env.get('score'), 'game_over': env.get('game_over')}
+    snake = env.get('snake')
+    try:
+        state['snake'] = [_cell(p) for p in snake.positions]
+    except (AttributeError, TypeError, ValueError):
+        pass
+    food = env.get('food')
+    try:
+        state['food'] = _cell(food.position)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return state
+
+
+class BehaviorCheck:
+    """
+    Compares one scenario's frames with the reference engine (see module docstring).
+
+    Args:
+        scenario: Scenario dict from scenarios_for()
+        env: The namespace the student's main file runs in
+        shim: The HeadlessPygame instance the student's code uses
+    """
+
+    def __init__(self, scenario, env, shim):
+        self.scenario = scenario
+        self.env = env
+        self.shim = shim
+        self.compare = set(scenario['compare'])
+        self.ticks_checked = 0
+        self.engine = None
+        self.state = None # Student state after the previous frame
+        self._rng = np.random.default_rng(scenario['seed'])
+        self._key_codes = {name: getattr(shim.module, f'K_{name}') for name in DIRECTIONS}
+        self.inputs = dict(scenario['keys']) # tick -> direction (seek scenarios add to it as they go)
+
+    def start(self):
+        """Seed the student's randomness, queue the scripted keys and hook the end of every frame."""
+        random.seed(self.scenario['seed'])
+        for tick, direction in self.inputs.items():
+            self._press(direction, tick)
+        self.shim.on_frame = self.on_frame
+        self.env['get_user_direction'] = self.get_user_direction
+
+    def get_user_direction(self):
+        """The preview's input hook, answered with the scenario's latest direction."""
+        tick = self.shim.frame
+        latest = max((t for t in self.inputs if t <= tick), default=None)
+        return self.inputs[latest] if latest is not None else 'RIGHT'
+
+    def _press(self, direction, tick):
+        self.shim.schedule(tick, self.shim.module.event.Event(
+            self.shim.module.KEYDOWN, key=self._key_codes[direction], mod=0, unicode='', scancode=0))
+
+    def _fail(self, tick, message):
+        raise BehaviorDivergence(f"Behavior check '{self.scenario['name']}' failed at tick {tick + 1}: {message}")
+
+    def on_frame(self, frame):
+        tick = frame - 1 # Ticks are 0-based; frame 1 ends tick 0
+        state = read_student_state(self.env)
+        if state['snake'] is None or not state['snake']:
+            self._fail(tick, "no `snake` object with a `positions` list was found.")
+        if self.engine is None:
+            self._start_engine(state, tick)
+        else:
+            self._check_tick(tick, state)
+        self.state = state
+        self.ticks_checked = frame
+        if frame >= self.scenario['ticks'] or bool(self.engine.game_over[0]):
+            raise ScenarioComplete()
+        if self.scenario['seek']:
+            direction = self._seek_direction()
+            self.inputs[frame] = direction
+            self._press(direction, frame)
+
+    def _seek_direction(self):
+        """Head for the food, turning away from walls and the body when that move would end the game."""
+        engine = self.engine
+        wanted = DIRECTIONS[int(food_seeking_directions(engine, self._rng, SEEK_NOISE)[0])]
+        current = DIRECTIONS[engine.direction[0]]
+        head_x, head_y = int(engine.head_x[0]), int(engine.head_y[0])
+        tail = engine.positions(0)[-1]
+
+        def safe(direction):
+            if direction == _REVERSE[current]:
+                direction = current # change_direction() would ignore the reversal
+            x = head_x + {'LEFT': -1, 'RIGHT': 1}.get(direction, 0)
+            y = head_y + {'UP': -1, 'DOWN': 1}.get(direction, 0)
+            if not (0 <= x < engine.width and 0 <= y < engine.height):
+                return False
+            return engine.occupancy[0, y, x] == 0 or ((x, y) == tail and not engine.grow_pending[0])
+
+        if safe(wanted):
+            return wanted
+        options = [d for d in DIRECTIONS if d != _REVERSE[current] and safe(d)]
+        return options[int(self._rng.integers(len(options)))] if options else wanted
+
+    def _start_engine(self, state, tick):
+        """The first frame is the baseline: the engine starts from what the student's game shows after tick 0."""
+        width = int(self.env.get('GRID_WIDTH', 30))
+        height = int(self.env.get('GRID_HEIGHT', 30))
+        self.engine = SnakeEngine(1, width, height)
+        self.engine.direction[0] = DIRECTION_CODES['RIGHT'] # Quest 3: the snake starts out heading right
+        self._turn(self.inputs.get(tick))
+        self._load(state, grow_pending=False)
+
+    def _turn(self, direction):
+        if direction is not None and direction != _REVERSE[DIRECTIONS[self.engine.direction[0]]]:
+            self.engine.direction[0] = DIRECTION_CODES[direction]
+
+    def _load(self, state, grow_pending):
+        try:
+            self.engine.load_game(0, state['snake'], state['food'] or (-1, -1),
+                                  int(state['score'] or 0), bool(state['game_over']))
+        except (ValueError, TypeError) as e:
+            self._fail(self.ticks_checked, str(e))
+        self.engine.grow_pending[0] = grow_pending
+
+    def _check_tick(self, tick, state):
+        engine = self.engine
+        previous = self.state
+        ate = bool(engine.step(np.array([DIRECTION_CODES[self.inputs[tick]] if tick in self.inputs else -1]))[0])
+        expected_snake = engine.positions(0)
+        grew_now = False
+        if 'snake' in self.compare:
+            got = state['snake']
+            if got[0] != expected_snake[0]:
+                self._fail(tick, f"the head should be at {expected_snake[0]}, but it is at {got[0]}.")
+            lengths = {len(expected_snake)}
+            if ate:
+                lengths.add(len(expected_snake) + 1) # Growing right away is fine too
+            if len(got) not in lengths:
+                self._fail(tick, f"the snake should be {len(expected_snake)} long, but it is {len(got)}.")
+            if got[:len(expected_snake)] != expected_snake:
+                self._fail(tick, f"the body should be {expected_snake}, but it is {got}.")
+            grew_now = len(got) > len(expected_snake)
+        if 'food' in self.compare:
+            if ate:
+                food = state['food']
+                if food is None or not (0 <= food[0] < engine.width and 0 <= food[1] < engine.height) \
+                        or food in state['snake']:
+                    self._fail(tick, f"after eating, the food should move to a free cell, but it is at {food}.")
+            elif state['food'] != previous['food']:
+                self._fail(tick, f"the food moved from {previous['food']} to {state['food']} without being eaten.")
+        if 'score' in self.compare:
+            expected_score = int(previous['score'] or 0) + int(ate)
+            if state['score'] != expected_score:
+                self._fail(tick, f"the score should be {expected_score}, but it is {state['score']}.")
+        if 'game_over' in self.compare:
+            expected_over = bool(engine.game_over[0])
+            if bool(state['game_over']) != expected_over:
+                reason = "the snake hit a wall or itself" if expected_over else "nothing was hit"
+                self._fail(tick, f"game_over should be {expected_over} ({reason}), but it is {state['game_over']}.")
+        game_over = bool(engine.game_over[0])
+        self._load(state, grow_pending=ate and not grew_now)
+        engine.game_over[0] = game_over
@@ -0,0 +1,252 @@
+"""
+snake_code_store.py - Per-user store for the students' snake code.
+
+Every quest page load used to rewrite constants.py, every preview rewrote all editor files,
+and quest submissions landed in snake_code/<user>/ instead of the echo directory. The store
+keeps each file's content once, named by its sha256, and a small manifest per echo level
+mapping filenames to those hashes:
+
+    snake_code/<aa>/<bb>/<user>/blobs/<sha256>
+    snake_code/<aa>/<bb>/<user>/snake_echo_N/manifest.json   {"files": {name: sha256}, "updated": t}
+
+A write that doesn't change the manifest touches nothing on disk; one that does writes only
+the blobs that don't exist yet plus the manifest (temp file + rename, so readers never see a
+half-written one). Manifests are cached per echo and checked with a stat (inode, mtime, size); blobs never change,
+so their contents are cached by hash.
+
+Echo directories written before the store still hold plain snake_echo_N/*.py files; read()
+returns those while there is no manifest, and the first write imports them.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from compile_cache import source_hash
+from user_paths import USER_DATA_DIR, snake_code_dir, snake_echo_dir
+
+MANIFEST_NAME = 'manifest.json'
+BLOBS_DIR = 'blobs'
+BLOB_CACHE_SIZE = 1024 # File contents kept in memory, by hash
+MANIFEST_CACHE_SIZE = 512 # Echo manifests kept in memory
+
+
+def _write_atomic(path, data):
+    """Write bytes through a temp file in the same directory renamed over path."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _stat_key(st):
+    """
+    What identifies one version of a manifest. Manifests are replaced by rename, so a rewrite
+    always has a new inode, even when the filesystem clock is too coarse to change the mtime.
+    """
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def read_legacy_files(echo_dir):
+    """The snake_echo_N/*.py files of an echo written before the store ({} if none)"""
+    files = {}
+    try:
+        names = sorted(os.listdir(echo_dir))
+    except OSError:
+        return files
+    for filename in names:
+        if filename.endswith('.py'):
+            try:
+                with open(os.path.join(echo_dir, filename), 'r', encoding='utf-8', errors='replace') as f:
+                    files[filename] = f.read()
+            except OSError as e:
+                print(f"[CODE STORE] Error reading {echo_dir}/{filename}: {e}")
+    return files
+
+
+class SnakeCodeStore:
+    """
+    Content-addressed snake code, one manifest per (user, echo level).
+
+    Args:
+        root: user_data directory (snake code lives under <root>/snake_code)
+    """
+
+    def __init__(self, root=USER_DATA_DIR):
+        self.root = root
+        self._lock = threading.Lock() # Guards the caches and _user_locks
+        self._user_locks = {}
+        self._manifests = OrderedDict() # echo_dir -> (_stat_key of the manifest, {name: sha256})
+        self._blobs = OrderedDict() # sha256 -> content
+        self.counters = {'reads': 0, 'manifest_hits': 0, 'manifest_loads': 0, 'legacy_reads': 0,
+                         'blob_hits': 0, 'blob_loads': 0, 'writes': 0, 'writes_skipped': 0,
+                         'blobs_written': 0, 'blobs_reused': 0, 'manifests_written': 0}
+
+    def _user_lock(self, username):
+        with self._lock:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.Lock()
+            return lock
+
+    def echo_dir(self, username, echo_level):
+        return snake_echo_dir(username, echo_level, self.root)
+
+    def blobs_dir(self, echo_dir):
+        """Blobs are shared by all echo levels of a user: <user dir>/blobs"""
+        return os.path.join(os.path.dirname(echo_dir), BLOBS_DIR)
+
+    # --- Caches ---
+    def _remember_manifest(self, echo_dir, entry):
+        with self._lock:
+            self._manifests[echo_dir] = entry
+            self._manifests.move_to_end(echo_dir)
+            while len(self._manifests) > MANIFEST_CACHE_SIZE:
+                self._manifests.popitem(last=False)
+
+    def _remember_blob(self, digest, content):
+        with self._lock:
+            self._blobs[digest] = content
+            self._blobs.move_to_end(digest)
+            while len(self._blobs) > BLOB_CACHE_SIZE:
+                self._blobs.popitem(last=False)
+
+    def _manifest(self, echo_dir):
+        """{name: sha256} of the echo, or None if it has no manifest yet"""
+        path = os.path.join(echo_dir, MANIFEST_NAME)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._manifests.get(echo_dir)
+        if cached is not None and cached[0] == _stat_key(st):
+            self.counters['manifest_hits'] += 1
+            return cached[1]
+        self.counters['manifest_loads'] += 1
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                files = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"[CODE STORE] Unreadable manifest {path}: {e}")
+            return None
+        self._remember_manifest(echo_dir, (_stat_key(st), files))
+        return files
+
+    def _blob(self, blobs_dir, digest):
+        with self._lock:
+            content = self._blobs.get(digest)
+            if content is not None:
+                self._blobs.move_to_end(digest)
+        if content is not None:
+            self.counters['blob_hits'] += 1
+            return content
+        self.counters['blob_loads'] += 1
+        with open(os.path.join(blobs_dir, digest), 'rb') as f:
+            content = f.read().decode('utf-8', 'surrogatepass')
+        self._remember_blob(digest, content)
+        return content
+
+    # --- Reading ---
+    def read(self, username, echo_level):
+        """
+        The files of one echo level.
+
+        Returns:
+            {filename: source}, {} if the echo has no files yet
+        """
+        return self.read_dir(self.echo_dir(username, echo_level))
+
+    def read_dir(self, echo_dir):
+        """read() for an echo directory path (e.g. one found by walking snake_code/)"""
+        self.counters['reads'] += 1
+        manifest = self._manifest(echo_dir)
+        if manifest is None:
+            self.counters['legacy_reads'] += 1
+            return read_legacy_files(echo_dir)
+        files = {}
+        for filename, digest in manifest.items():
+            try:
+                files[filename] = self._blob(self.blobs_dir(echo_dir), digest)
+            except OSError as e:
+                print(f"[CODE STORE] Missing blob {digest} for {echo_dir}/{filename}: {e}")
+        return files
+
+    def get_files(self, username, hashes):
+        """{filename: source} for a {filename: sha256} map (e.g. a history entry)"""
+        blobs_dir = os.path.join(snake_code_dir(username, self.root), BLOBS_DIR)
+        return {filename: self._blob(blobs_dir, digest) for filename, digest in hashes.items()}
+
+    # --- Writing ---
+    def _store_blobs(self, blobs_dir, contents):
+        """Write the blobs of {filename: source} that don't exist yet. Returns {filename: sha256}"""
+        os.makedirs(blobs_dir, exist_ok=True)
+        hashes = {}
+        for filename, content in contents.items():
+            digest = hashes[filename] = source_hash(content)
+            path = os.path.join(blobs_dir, digest)
+            if os.path.exists(path):
+                self.counters['blobs_reused'] += 1
+            else:
+                _write_atomic(path, content.encode('utf-8', 'surrogatepass'))
+                self.counters['blobs_written'] += 1
+            self._remember_blob(digest, content)
+        return hashes
+
+    def put_files(self, username, files):
+        """Store the contents of {filename: source} without touching any manifest. Returns {filename: sha256}"""
+        contents = {filename: content for filename, content in files.items() if isinstance(content, str)}
+        return self._store_blobs(os.path.join(snake_code_dir(username, self.root), BLOBS_DIR), contents)
+
+    def write(self, username, echo_level, files, replace=False):
+        """
+        Store files for one echo level, skipping everything that is already stored.
+
+        Args:
+            files: {filename: source} to add or update
+            replace: Drop files that aren't in `files` (default: keep them)
+
+        Returns:
+            True if anything was written
+        """
+        echo_dir = self.echo_dir(username, echo_level)
+        with self._user_lock(username):
+            current = self._manifest(echo_dir)
+            legacy = None
+            if current is None:
+                legacy = read_legacy_files(echo_dir)
+                current = {}
+                if not replace:
+                    files = {**legacy, **files} # Import the plain files the first time
+            contents = {filename: content for filename, content in files.items() if isinstance(content, str)}
+            manifest = {} if replace else dict(current)
+            manifest.update({filename: source_hash(content) for filename, content in contents.items()})
+            if manifest == current and not legacy:
+                self.counters['writes_skipped'] += 1
+                return False
+
+            self._store_blobs(self.blobs_dir(echo_dir), contents)
+            os.makedirs(echo_dir, exist_ok=True)
+            manifest_path = os.path.join(echo_dir, MANIFEST_NAME)
+            _write_atomic(manifest_path, json.dumps({'files': manifest, 'updated': time.time()}, indent=1).encode('utf-8'))
+            st = os.stat(manifest_path)
+            self._remember_manifest(echo_dir, (_stat_key(st), manifest))
+            self.counters['manifests_written'] += 1
+            self.counters['writes'] += 1
+            for filename in legacy or ():
+                try:
+                    os.remove(os.path.join(echo_dir, filename)) # Now in the blobs
+                except OSError:
+                    pass
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['cached_manifests'] = len(self._manifests)
+            stats['cached_blobs'] = len(self._blobs)
+        return stats
+
+
+code_store = SnakeCodeStore()
@@ -0,0 +1,338 @@
+"""
+snake_engine.py - Vectorized reference snake engine (many games at once, as NumPy arrays).
+
+A fast oracle for what a correct snake does. One SnakeEngine holds N independent games and
+steps all of them per call, with the tick semantics of the reference solution in snakedebug/
+(snake.py's main loop over snake_class.Snake and food.Food):
+
+1. the tick's direction is applied unless it reverses the current one (Snake.change_direction)
+2. the snake moves: the new head is added and the tail dropped, unless a grow is pending
+   (Snake.update; growing takes effect on the tick *after* eating)
+3. the game is over if the head left the grid or landed on the body (check_wall_collision,
+   check_self_collision - moving into the cell the tail just left is fine)
+4. if the head is on the food: grow, score += 1 and the food respawns on a free cell
+
+State per game: an occupancy grid (cells covered by the body), the body as a ring buffer of
+x/y coordinates, direction, grow flag, score, food and game-over flag. Collision checks and
+movement are whole-array operations; only respawning food touches individual games.
+
+Food placement:
+    'numpy'  - uniform over free cells from a numpy Generator (fast; same distribution)
+    'python' - one random.Random(seed + i) per game, with the same randint() rejection
+               sampling as food.Food, so game i matches the reference solution run after
+               random.seed(seed + i) frame for frame
+
+Usage (from the echoframe directory):
+    python snake_engine.py                          # Benchmark 10000 food-seeking games x 500 ticks
+    python snake_engine.py --games 1000 --ticks 2000
+    python snake_engine.py --verify 200             # Compare 200 games against snakedebug/
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+# Direction codes; -1 in a directions array means "no input this tick"
+DIRECTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTIONS)}
+NO_INPUT = -1
+_DX = np.array([0, 0, -1, 1], dtype=np.int16)
+_DY = np.array([-1, 1, 0, 0], dtype=np.int16)
+_OPPOSITE = np.array([1, 0, 3, 2], dtype=np.int8)
+
+DEFAULT_GRID_WIDTH = 30 # snakedebug/constants.py
+DEFAULT_GRID_HEIGHT = 30
+NO_FOOD = -1 # Food coordinate once the board is full
+
+
+class SnakeEngine:
+    """
+    N snake games stepped together.
+
+    Args:
+        games: Number of games
+        grid_width: Grid width in cells
+        grid_height: Grid height in cells
+        seed: Seed for food placement
+        food_mode: 'numpy' or 'python' (see module docstring)
+    """
+
+    def __init__(self, games, grid_width=DEFAULT_GRID_WIDTH, grid_height=DEFAULT_GRID_HEIGHT, seed=0, food_mode='numpy'):
+        if food_mode not in ('numpy', 'python'):
+            raise ValueError(f"Unknown food_mode: {food_mode}")
+        self.games = int(games)
+        self.width = int(grid_width)
+        self.height = int(grid_height)
+        self.food_mode = food_mode
+        self.capacity = self.width * self.height + 1 # Longest body, plus the head that moved out
+        n = self.games
+        self._index = np.arange(n)
+        self.occupancy = np.zeros((n, self.height, self.width), dtype=np.int8)
+        self.body_x = np.zeros((n, self.capacity), dtype=np.int16) # Ring buffers, head at head_ptr
+        self.body_y = np.zeros((n, self.capacity), dtype=np.int16)
+        self.head_ptr = np.zeros(n, dtype=np.int32)
+        self.length = np.ones(n, dtype=np.int32)
+        self.direction = np.full(n, DIRECTION_CODES['RIGHT'], dtype=np.int8)
+        self.grow_pending = np.zeros(n, dtype=bool)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.score = np.zeros(n, dtype=np.int32)
+        self.food_x = np.zeros(n, dtype=np.int16)
+        self.food_y = np.zeros(n, dtype=np.int16)
+        self.ticks = 0
+
+        # Snake.__init__: one segment in the middle of the grid, heading right
+        start_x, start_y = self.width // 2, self.height // 2
+        self.body_x[:, 0] = start_x
+        self.body_y[:, 0] = start_y
+        self.occupancy[:, start_y, start_x] = 1
+
+        # Food.__init__: reset_position([]) - the first food may land on the snake
+        if food_mode == 'python':
+            self._py_rngs = [random.Random(seed + i) for i in range(n)]
+            for i, rng in enumerate(self._py_rngs):
+                self.food_x[i] = rng.randint(0, self.width - 1)
+                self.food_y[i] = rng.randint(0, self.height - 1)
+        else:
+            self._rng = np.random.default_rng(seed)
+            self.food_x[:] = self._rng.integers(0, self.width, n)
+            self.food_y[:] = self._rng.integers(0, self.height, n)
+
+    # --- Accessors ---
+    @property
+    def head_x(self):
+        return self.body_x[self._index, self.head_ptr]
+
+    @property
+    def head_y(self):
+        return self.body_y[self._index, self.head_ptr]
+
+    def positions(self, game):
+        """Body of one game, head first, as [(x, y), ...] (Snake.positions)."""
+        ptrs = (self.head_ptr[game] - np.arange(self.length[game])) % self.capacity
+        return list(zip(self.body_x[game, ptrs].tolist(), self.body_y[game, ptrs].tolist()))
+
+    def game_state(self, game):
+        """One game in the shape of student_driven_snake._extract_game_state() plus direction."""
+        return {
+            'grid_width': self.width,
+            'grid_height': self.height,
+            'snake': [list(p) for p in self.positions(game)],
+            'food': [int(self.food_x[game]), int(self.food_y[game])],
+            'score': int(self.score[game]),
+            'game_over': bool(self.game_over[game]),
+            'direction': DIRECTIONS[self.direction[game]],
+        }
+
+    def load_game(self, game, positions, food, score=0, game_over=False):
+        """Replace one game's snake (head first), food, score and game-over flag; direction and grow flag are kept."""
+        if not 1 <= len(positions) <= self.capacity:
+            raise ValueError(f"Snake length {len(positions)} does not fit a {self.width}x{self.height} grid")
+        self.occupancy[game] = 0
+        for x, y in positions:
+            if 0 <= x < self.width and 0 <= y < self.height:
+                self.occupancy[game, y, x] += 1
+        length = len(positions)
+        tail_first = positions[::-1]
+        self.body_x[game, :length] = [x for x, _ in tail_first]
+        self.body_y[game, :length] = [y for _, y in tail_first]
+        self.head_ptr[game] = length - 1
+        self.length[game] = length
+        self.food_x[game], self.food_y[game] = food
+        self.score[game] = score
+        self.game_over[game] = game_over
+
+    # --- Stepping ---
+    def step(self, directions=None):
+        """
+        Advance every game by one tick.
+
+        Args:
+            directions: int array of shape (games,) with direction codes or NO_INPUT,
+                one code for all games, or None for no input
+
+        Returns:
+            Boolean array of the games that ate this tick
+        """
+        alive = ~self.game_over
+        if directions is not None:
+            want = np.broadcast_to(np.asarray(directions, dtype=np.int8), (self.games,))
+            turn = alive & (want >= 0) & (want != _OPPOSITE[self.direction])
+            self.direction = np.where(turn, want, self.direction).astype(np.int8)
+
+        idx = self._index[alive]
+        if idx.size == 0:
+            self.ticks += 1
+            return np.zeros(self.games, dtype=bool)
+        # Move: drop the tail unless a grow is pending (before placing the head, like Snake.update)
+        shrink = idx[~self.grow_pending[idx]]
+        tail_ptr = (self.head_ptr[shrink] - self.length[shrink] + 1) % self.capacity
+        tail_x = self.body_x[shrink, tail_ptr]
+        tail_y = self.body_y[shrink, tail_ptr]
+        inside_tail = (tail_x >= 0) & (tail_x < self.width) & (tail_y >= 0) & (tail_y < self.height)
+        self.occupancy[shrink[inside_tail], tail_y[inside_tail], tail_x[inside_tail]] -= 1
+        self.length[shrink] -= 1
+        self.grow_pending[idx] = False
+
+        code = self.direction[idx]
+        new_x = self.body_x[idx, self.head_ptr[idx]] + _DX[code]
+        new_y = self.body_y[idx, self.head_ptr[idx]] + _DY[code]
+        self.head_ptr[idx] = (self.head_ptr[idx] + 1) % self.capacity
+        self.body_x[idx, self.head_ptr[idx]] = new_x
+        self.body_y[idx, self.head_ptr[idx]] = new_y
+        self.length[idx] += 1
+
+        # Collisions
+        inside = (new_x >= 0) & (new_x < self.width) & (new_y >= 0) & (new_y < self.height)
+        self.occupancy[idx[inside], new_y[inside], new_x[inside]] += 1
+        hit_self = np.zeros(idx.size, dtype=bool)
+        hit_self[inside] = self.occupancy[idx[inside], new_y[inside], new_x[inside]] > 1
+        self.game_over[idx[~inside | hit_self]] = True
+
+        # Food
+        ate = np.zeros(self.games, dtype=bool)
+        ate[idx] = (new_x == self.food_x[idx]) & (new_y == self.food_y[idx])
+        if ate.any():
+            eaten = self._index[ate]
+            self.grow_pending[eaten] = True
+            self.score[eaten] += 1
+            self._respawn_food(eaten)
+        self.ticks += 1
+        return ate
+
+    def _respawn_food(self, games):
+        """Food.reset_position(snake.positions) for the given games."""
+        if self.food_mode == 'python':
+            cells = self.width * self.height
+            for i in games.tolist():
+                if self.length[i] >= cells:
+                    self.food_x[i] = self.food_y[i] = NO_FOOD # Board full; Food would loop forever
+                    continue
+                rng = self._py_rngs[i]
+                while True:
+                    x, y = rng.randint(0, self.width - 1), rng.randint(0, self.height - 1)
+                    if self.occupancy[i, y, x] == 0:
+                        break
+                self.food_x[i], self.food_y[i] = x, y
+            return
+        free = (self.occupancy[games] == 0).reshape(games.size, -1)
+        free_counts = free.sum(axis=1)
+        has_room = free_counts > 0
+        pick = self._rng.integers(0, np.maximum(free_counts, 1))
+        cell = np.argmax(np.cumsum(free, axis=1) > pick[:, None], axis=1)
+        self.food_x[games] = np.where(has_room, cell % self.width, NO_FOOD)
+        self.food_y[games] = np.where(has_room, cell // self.width, NO_FOOD)
+
+    def run(self, directions):
+        """
+        Step through a whole input sequence and record the trajectory.
+
+        Args:
+            directions: int array of shape (ticks, games) (or (ticks,) for the same input everywhere)
+
+        Returns:
+            dict of arrays with a leading ticks axis: head_x, head_y, length, score, game_over, food_x, food_y
+        """
+        directions = np.asarray(directions)
+        ticks = directions.shape[0]
+        keys = ('head_x', 'head_y', 'length', 'score', 'game_over', 'food_x', 'food_y')
+        trajectory = {key: np.empty((ticks, self.games), dtype=getattr(self, key).dtype) for key in keys}
+        for t in range(ticks):
+            self.step(directions[t])
+            for key in keys:
+                trajectory[key][t] = getattr(self, key)
+        return trajectory
+
+
+def food_seeking_directions(engine, rng, noise=0.1):
+    """Input that heads for the food (x first, then y), with a random direction on `noise` of the ticks."""
+    dx = engine.food_x.astype(np.int32) - engine.head_x
+    dy = engine.food_y.astype(np.int32) - engine.head_y
+    directions = np.where(dx > 0, DIRECTION_CODES['RIGHT'], DIRECTION_CODES['LEFT'])
+    directions = np.where(dx == 0, np.where(dy > 0, DIRECTION_CODES['DOWN'], DIRECTION_CODES['UP']), directions)
+    random_turn = rng.random(engine.games) < noise
+    directions[random_turn] = rng.integers(0, 4, int(random_turn.sum()))
+    return directions.astype(np.int8)
+
+
+def _reference_classes():
+    """Snake and Food from snakedebug/, loaded headless and from memory."""
+    import os
+    from headless_pygame import HeadlessPygame
+    from student_imports import StudentFiles
+    debug_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snakedebug')
+    files = {}
+    for name in ('constants.py', 'snake_class.py', 'food.py'):
+        with open(os.path.join(debug_dir, name), 'r', encoding='utf-8') as f:
+            files[name] = f.read()
+    HeadlessPygame().install()
+    StudentFiles(files).install()
+    import snake_class
+    import food
+    return snake_class.Snake, food.Food
+
+
+def verify(games, ticks, seed=0):
+    """Run `games` games through the engine and through snakedebug's classes; return mismatching game indices."""
+    Snake, Food = _reference_classes()
+    engine = SnakeEngine(games, seed=seed, food_mode='python')
+    rng = np.random.default_rng(seed)
+    directions = np.empty((ticks, games), dtype=np.int8)
+    for t in range(ticks):
+        directions[t] = food_seeking_directions(engine, rng)
+        engine.step(directions[t])
+    mismatched = []
+    for i in range(games):
+        random.seed(seed + i)
+        snake, food = Snake(), Food()
+        score, game_over = 0, False
+        for t in range(ticks):
+            # snake.py's loop: input, update, collisions, food
+            if not game_over:
+                if directions[t, i] != NO_INPUT:
+                    snake.change_direction(DIRECTIONS[directions[t, i]])
+                snake.update()
+                if snake.check_wall_collision() or snake.check_self_collision():
+                    game_over = True
+                if snake.positions[0] == food.position:
+                    snake.grow()
+                    food.reset_position(snake.positions)
+                    score += 1
+        if (engine.positions(i) != list(snake.positions) or int(engine.score[i]) != score
+                or bool(engine.game_over[i]) != game_over
+                or (int(engine.food_x[i]), int(engine.food_y[i])) != tuple(food.position)):
+            mismatched.append(i)
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized reference snake engine")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--ticks', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--food', choices=['numpy', 'python'], default='numpy', help="Food placement mode")
+    parser.add_argument('--verify', type=int, metavar='GAMES', help="Check GAMES games against snakedebug/ instead")
+    args = parser.parse_args()
+
+    if args.verify:
+        started = time.perf_counter()
+        mismatched = verify(args.verify, args.ticks, args.seed)
+        print(f"[ENGINE] Verified {args.verify} games x {args.ticks} ticks against snakedebug/ in "
+              f"{time.perf_counter() - started:.2f}s: {len(mismatched)} mismatched {mismatched[:10]}")
+        return 1 if mismatched else 0
+
+    engine = SnakeEngine(args.games, seed=args.seed, food_mode=args.food)
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    for t in range(args.ticks):
+        engine.step(food_seeking_directions(engine, rng))
+    elapsed = time.perf_counter() - started
+    print(f"[ENGINE] {args.games} games x {args.ticks} ticks in {elapsed:.2f}s "
+          f"({args.games * args.ticks / elapsed:,.0f} game-ticks/s); "
+          f"{int(engine.game_over.sum())} over, best score {int(engine.score.max())}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
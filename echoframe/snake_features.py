@@ -0,0 +1,260 @@
+"""
+snake_features.py - AST feature extraction for student snake code, cached by source hash.
+
+One ast walk per file collects what the echo-level rules need: assigned names, classes and
+their methods, dotted call targets (pygame.draw.rect), dotted attribute references
+(pygame.K_UP), loops, identifiers and string literals. Features are keyed by the sha256 of
+the source, so re-detecting a multi-file submission after an edit only parses the file
+that changed. Files that don't parse fall back to the old substring heuristics.
+
+The rules follow the old substring checks except where those matched by accident
+(tests/test_snake_features.py compares the two on the starters and snakedebug/):
+- the rules see the merged features of all files (Snake.draw and pygame.draw.rect may be apart)
+- comments never count, so the commented-out grid constants of the echo 1 starter are level 0
+- growth needs a grow method or call; 'eat' inside a word ('Create') and 'grow' in a comment don't
+- the game loop may refresh with pygame.display.update() as well as flip()
+- collision needs a function or call named *collision*/*collide*, without the 'wall'/'self' text
+- 'restart' counts in identifiers and strings ("Press R to restart"), not in comments
+"""
+import ast
+import threading
+from collections import OrderedDict
+
+from compile_cache import source_hash
+
+FEATURE_CACHE_SIZE = 2048  # Distinct sources kept
+
+
+def _dotted_name(node):
+    """'pygame.draw.rect' for an Attribute/Name chain, None for anything else (calls, subscripts...)."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return '.'.join(reversed(parts))
+    return None
+
+
+class _FeatureVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.features = set()
+        self._class_stack = []
+
+    def _add_identifier(self, name):
+        self.features.add('ident:' + name.lower())
+
+    def visit_ClassDef(self, node):
+        self.features.add('class:' + node.name)
+        self._add_identifier(node.name)
+        self._class_stack.append(node.name)
+        self.generic_visit(node)
+        self._class_stack.pop()
+
+    def visit_FunctionDef(self, node):
+        if self._class_stack:
+            self.features.add(f"method:{self._class_stack[-1]}.{node.name}")
+        self.features.add('def:' + node.name)
+        self._add_identifier(node.name)
+        # Methods of nested functions aren't methods of the class
+        saved, self._class_stack = self._class_stack, []
+        self.generic_visit(node)
+        self._class_stack = saved
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            self._add_targets(target)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node):
+        self._add_targets(node.target)
+        self.generic_visit(node)
+
+    def _add_targets(self, target):
+        if isinstance(target, ast.Name):
+            self.features.add('assign:' + target.id)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self._add_targets(element)
+
+    def visit_Call(self, node):
+        name = _dotted_name(node.func)
+        if name:
+            self.features.add('call:' + name)
+            self.features.add('callname:' + name.rsplit('.', 1)[-1])
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        name = _dotted_name(node)
+        if name:
+            self.features.add('attr:' + name)
+        self._add_identifier(node.attr)
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        self._add_identifier(node.id)
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            self.features.add(f"import:{node.module}.{alias.name}")
+            self._add_identifier(alias.asname or alias.name)
+
+    def visit_While(self, node):
+        self.features.add('loop:while')
+        self.generic_visit(node)
+
+    def visit_For(self, node):
+        self.features.add('loop:for')
+        self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str) and node.value:
+            self.features.add('text:' + node.value.lower())
+
+
+def extract_features(source):
+    """Return the frozenset of features of one source file (raises SyntaxError if it doesn't parse)."""
+    visitor = _FeatureVisitor()
+    visitor.visit(ast.parse(source))
+    return frozenset(visitor.features)
+
+
+class FeatureCache:
+    """
+    LRU cache of extract_features() results keyed by source hash.
+
+    Unparsable sources are cached as None so they aren't re-parsed either.
+    """
+
+    def __init__(self, max_entries=FEATURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, source):
+        key = source_hash(source)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return self._entries[key]
+            self.counters['misses'] += 1
+        try:
+            features = extract_features(source)
+        except (SyntaxError, ValueError, RecursionError):
+            features = None
+        with self._lock:
+            self._entries[key] = features
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return features
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), max_entries=self.max_entries)
+
+
+# Create a global instance to use throughout the app
+feature_cache = FeatureCache()
+
+
+def _has_text(features, *needles):
+    return any(f.startswith('text:') and any(n in f for n in needles) for f in features)
+
+
+def _has_identifier(features, *needles):
+    return any(f.startswith('ident:') and any(n in f for n in needles) for f in features)
+
+
+def _uses_key(features, key):
+    return f'attr:pygame.{key}' in features or f'import:pygame.locals.{key}' in features \
+        or f'ident:{key.lower()}' in features
+
+
+def echo_level_from_features(features):
+    """Map the merged features of a submission to an echo level (0-9), same scale as the text heuristics."""
+    echo_level = 0
+    snake_methods = {f.split('.', 1)[1] for f in features if f.startswith('method:Snake.')}
+    # Echo 1: grid constants defined
+    if {'assign:GRID_WIDTH', 'assign:GRID_HEIGHT', 'assign:CELL_SIZE'} <= features:
+        echo_level = 1
+    # Echo 2: game loop (init, while loop, display refresh)
+    if 'call:pygame.init' in features and 'loop:while' in features \
+            and ('call:pygame.display.flip' in features or 'call:pygame.display.update' in features):
+        echo_level = 2
+    # Echo 3: Snake class
+    if 'class:Snake' in features:
+        echo_level = 3
+    # Echo 4: Snake draws itself with rectangles
+    if 'draw' in snake_methods and 'call:pygame.draw.rect' in features:
+        echo_level = 4
+    # Echo 5: Food class
+    if 'class:Food' in features:
+        echo_level = 5
+    # Echo 6: the snake grows when it reaches food
+    if ('grow' in snake_methods or 'callname:grow' in features or 'def:grow' in features) \
+            and ('class:Food' in features or _has_identifier(features, 'food')):
+        echo_level = 6
+    # Echo 7: arrow-key input handling
+    if _uses_key(features, 'K_UP') or _uses_key(features, 'K_DOWN'):
+        echo_level = 7
+    # Echo 8: wall/self collision checks
+    if any(f.startswith(('def:', 'callname:')) and ('collision' in f or 'collide' in f) for f in features):
+        echo_level = 8
+    # Echo 9: game over / restart
+    if _has_text(features, 'game over', 'gameover', 'restart') or _has_identifier(features, 'game_over', 'gameover', 'restart'):
+        echo_level = 9
+    return echo_level
+
+
+def _text_echo_level(code):
+    """Substring heuristics for a file that doesn't parse (the original detector, per file)."""
+    lowered = code.lower()
+    echo_level = 0
+    if 'GRID_WIDTH' in code and 'GRID_HEIGHT' in code and 'CELL_SIZE' in code:
+        echo_level = 1
+    if 'pygame.init()' in code and 'while' in code and 'pygame.display.flip()' in code:
+        echo_level = 2
+    if 'class Snake' in code:
+        echo_level = 3
+    if 'class Snake' in code and 'def draw' in code and 'pygame.draw.rect' in code:
+        echo_level = 4
+    if 'class Food' in code:
+        echo_level = 5
+    if ('grow' in code or 'eat' in code) and 'food' in lowered:
+        echo_level = 6
+    if 'pygame.K_UP' in code or 'pygame.K_DOWN' in code:
+        echo_level = 7
+    if ('collision' in code or 'collide' in code) and ('wall' in code or 'self' in code):
+        echo_level = 8
+    if 'game over' in lowered or 'gameover' in lowered or 'restart' in lowered:
+        echo_level = 9
+    return echo_level
+
+
+def detect_echo_level(files):
+    """
+    Determine which echo level a submission is at.
+
+    Args:
+        files: {filename: source} dict
+
+    Returns:
+        Echo level 0-9 from the merged features of every parsable file (and the text
+        heuristics of any file that doesn't parse)
+    """
+    merged = set()
+    fallback_level = 0
+    for code in files.values():
+        if not isinstance(code, str):
+            continue
+        features = feature_cache.get(code)
+        if features is None:
+            fallback_level = max(fallback_level, _text_echo_level(code))
+        else:
+            merged |= features
+    return max(echo_level_from_features(merged), fallback_level)
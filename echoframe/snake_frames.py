@@ -0,0 +1,109 @@
+"""
+snake_frames.py - Delta-encoded frame protocol for the snake preview socket.
+
+Instead of re-sending the whole snake, food, grid size and message fields on every tick,
+a session sends one keyframe followed by small deltas:
+
+    keyframe: {'v': 1, 'seq': n, 'key': {...full state...}}
+    delta:    {'v': 1, 'seq': n, 'h': [[x, y], ...], 't': 1, 'f': [x, y], 's': 3, 'g': True, 'x': {...}}
+
+In a delta, 'h' lists new head segments (front first), 't' is how many tail segments were
+removed, 'f'/'s'/'g' are only present when food/score/game_over changed, and 'x' carries any
+other changed top-level field. Keyframes are repeated every `keyframe_interval` frames so a
+client that missed something resyncs on its own; it can also ask for one via 'request_keyframe'.
+"""
+
+PROTOCOL_VERSION = 1
+KEYFRAME_INTERVAL = 40  # Frames between forced keyframes (2 seconds at 20 fps)
+MAX_HEAD_SEGMENTS = 2   # A delta covers at most this many new head segments per frame
+
+# Fields with their own delta key; everything else travels in 'x'
+_DELTA_KEYS = {'food': 'f', 'score': 's', 'game_over': 'g'}
+
+
+def _normalize_segments(snake):
+    """Return the snake as a list of (x, y) tuples, or None if it isn't a list of pairs."""
+    try:
+        return [(seg[0], seg[1]) for seg in snake]
+    except (TypeError, IndexError, KeyError):
+        return None
+
+
+def _as_list(value):
+    return [value[0], value[1]] if isinstance(value, tuple) else value
+
+
+class FrameEncoder:
+    """Turns successive full game states for one session into keyframes and deltas."""
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._prev_state = None
+        self._prev_snake = None
+        self._since_keyframe = 0
+        self._force_keyframe = True
+        self.counters = {'keyframes': 0, 'deltas': 0}
+
+    def request_keyframe(self):
+        """Make the next encoded frame a keyframe (e.g. the client reconnected or lost track)."""
+        self._force_keyframe = True
+
+    def _snake_delta(self, snake):
+        """Return (new_heads, removed_tail_count) turning the previous snake into `snake`, or None."""
+        prev = self._prev_snake
+        for k in range(min(MAX_HEAD_SEGMENTS, len(snake)) + 1):
+            kept = len(snake) - k
+            if kept <= len(prev) and snake[k:] == prev[:kept]:
+                return snake[:k], len(prev) - kept
+        return None
+
+    def encode(self, state):
+        """Encode a full game state dict into the next frame dict."""
+        self.seq += 1
+        snake = _normalize_segments(state.get('snake', []))
+        frame = None
+        if not self._force_keyframe and self._since_keyframe < self.keyframe_interval \
+                and self._prev_state is not None and snake is not None and self._prev_snake is not None:
+            frame = self._encode_delta(state, snake)
+        if frame is None:
+            frame = self._encode_keyframe(state)
+        self._prev_state = dict(state)
+        self._prev_snake = snake
+        return frame
+
+    def _encode_keyframe(self, state):
+        self._force_keyframe = False
+        self._since_keyframe = 0
+        self.counters['keyframes'] += 1
+        key = dict(state)
+        key['snake'] = [_as_list(seg) for seg in state.get('snake', [])]
+        key['food'] = _as_list(state.get('food'))
+        return {'v': PROTOCOL_VERSION, 'seq': self.seq, 'key': key}
+
+    def _encode_delta(self, state, snake):
+        snake_change = self._snake_delta(snake)
+        if snake_change is None:
+            return None # Teleport, reset or multi-segment jump: cheaper to send a keyframe
+        heads, removed = snake_change
+        frame = {'v': PROTOCOL_VERSION, 'seq': self.seq}
+        if heads:
+            frame['h'] = [[x, y] for x, y in heads]
+        if removed:
+            frame['t'] = removed
+        prev = self._prev_state
+        extra = {}
+        for name, value in state.items():
+            if name == 'snake' or prev.get(name) == value:
+                continue
+            if name in _DELTA_KEYS:
+                frame[_DELTA_KEYS[name]] = _as_list(value)
+            else:
+                extra[name] = value
+        if any(name not in state for name in prev):
+            return None # A field disappeared; let a keyframe replace the client's state wholesale
+        if extra:
+            frame['x'] = extra
+        self._since_keyframe += 1
+        self.counters['deltas'] += 1
+        return frame
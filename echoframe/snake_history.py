@@ -0,0 +1,172 @@
+"""
+snake_history.py - Version history of every snake quest submission and preview run.
+
+Each run appends one small entry to the user's log; the code itself goes into the user's
+content-addressed blobs (snake_code_store), so a file that didn't change between runs is
+stored once no matter how many versions use it:
+
+    snake_code/<aa>/<bb>/<user>/history.jsonl   one JSON entry per line
+    snake_code/<aa>/<bb>/<user>/history.idx     8-byte little-endian offset of entry N at (N - 1) * 8
+
+An entry is {"v", "t", "source" ('quest' or 'preview'), "qid", "echo", "files" {name: sha256},
+"result" ('pass'/'fail', None for previews), "error"}. The index makes getting version N one
+seek in each file and a history page one read of the index plus one line per entry, so a
+user with thousands of runs lists and restores as fast as one with ten.
+
+A crash between the two appends leaves a log line without an index entry; it is never listed
+and the next entry is appended after it.
+"""
+import json
+import os
+import struct
+import threading
+import time
+
+from snake_code_store import code_store
+from user_paths import snake_code_dir
+
+HISTORY_LOG = 'history.jsonl'
+HISTORY_INDEX = 'history.idx'
+HISTORY_PAGE_SIZE = 20 # Default versions per page
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_ERROR_CHARS = 300 # Grading errors are cut to this length in entries
+
+_OFFSET = struct.Struct('<Q')
+
+
+class SubmissionHistory:
+    """
+    Append-only per-user history of snake code versions.
+
+    Args:
+        store: SnakeCodeStore holding the file contents
+    """
+
+    def __init__(self, store=code_store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._user_locks = {}
+        self.counters = {'recorded': 0, 'restored': 0, 'pages': 0}
+
+    def _user_lock(self, username):
+        with self._lock:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.Lock()
+            return lock
+
+    def _paths(self, username):
+        user_dir = snake_code_dir(username, self.store.root)
+        return os.path.join(user_dir, HISTORY_LOG), os.path.join(user_dir, HISTORY_INDEX)
+
+    def count(self, username):
+        """Number of recorded versions"""
+        try:
+            return os.path.getsize(self._paths(username)[1]) // _OFFSET.size
+        except OSError:
+            return 0
+
+    def record(self, username, files, qid=None, echo_level=None, source='preview', result=None, error=None):
+        """
+        Append a version for one run.
+
+        Args:
+            files: {filename: source} that ran
+            qid: Quest id, if the run belongs to one
+            echo_level: 0-based echo level the files were stored under
+            source: 'quest' (graded submission) or 'preview'
+            result: 'pass' / 'fail' for graded submissions
+            error: Grading error message, if any
+
+        Returns:
+            The new version number (1-based)
+        """
+        hashes = self.store.put_files(username, files)
+        log_path, index_path = self._paths(username)
+        with self._user_lock(username):
+            with open(index_path, 'ab') as index:
+                size = index.tell()
+                version = size // _OFFSET.size + 1
+                if size % _OFFSET.size:
+                    index.truncate((version - 1) * _OFFSET.size) # Drop a torn offset
+                entry = {'v': version, 't': round(time.time(), 3), 'source': source, 'qid': qid,
+                         'echo': echo_level, 'files': hashes, 'result': result,
+                         'error': str(error)[:HISTORY_ERROR_CHARS] if error else None}
+                with open(log_path, 'ab') as log:
+                    offset = log.tell()
+                    log.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+                index.write(_OFFSET.pack(offset))
+        self.counters['recorded'] += 1
+        return version
+
+    def _read_entries(self, username, first, last):
+        """Entries first..last (1-based, inclusive) in version order"""
+        log_path, index_path = self._paths(username)
+        with open(index_path, 'rb') as index:
+            index.seek((first - 1) * _OFFSET.size)
+            raw = index.read((last - first + 1) * _OFFSET.size)
+        entries = []
+        with open(log_path, 'rb') as log:
+            for (offset,) in _OFFSET.iter_unpack(raw[:len(raw) - len(raw) % _OFFSET.size]):
+                log.seek(offset)
+                entries.append(json.loads(log.readline()))
+        return entries
+
+    def get(self, username, version):
+        """The entry of one version, or None if it doesn't exist"""
+        if not isinstance(version, int) or not 1 <= version <= self.count(username):
+            return None
+        try:
+            entries = self._read_entries(username, version, version)
+        except (OSError, ValueError) as e:
+            print(f"[HISTORY] Could not read version {version} of {username}: {e}")
+            return None
+        return entries[0] if entries else None
+
+    def restore(self, username, version):
+        """
+        The files of one version, for loading back into the editor.
+
+        Returns:
+            (entry, {filename: source}), or (None, None) if the version doesn't exist
+        """
+        entry = self.get(username, version)
+        if entry is None:
+            return None, None
+        try:
+            files = self.store.get_files(username, entry['files'])
+        except OSError as e:
+            print(f"[HISTORY] Missing code for version {version} of {username}: {e}")
+            return None, None
+        self.counters['restored'] += 1
+        return entry, files
+
+    def page(self, username, page=1, per_page=HISTORY_PAGE_SIZE):
+        """
+        One page of the history, newest first.
+
+        Returns:
+            dict with total, page, per_page, pages and versions (entries with filenames but no code)
+        """
+        per_page = max(1, min(int(per_page), HISTORY_MAX_PAGE_SIZE))
+        total = self.count(username)
+        pages = max(1, -(-total // per_page))
+        page = max(1, min(int(page), pages))
+        last = total - (page - 1) * per_page
+        first = max(1, last - per_page + 1)
+        versions = []
+        if total:
+            try:
+                versions = self._read_entries(username, first, last)
+            except (OSError, ValueError) as e:
+                print(f"[HISTORY] Could not read history page {page} of {username}: {e}")
+        self.counters['pages'] += 1
+        for entry in versions:
+            entry['files'] = sorted(entry['files'])
+        return {'total': total, 'page': page, 'per_page': per_page, 'pages': pages, 'versions': versions[::-1]}
+
+    def get_stats(self):
+        return dict(self.counters)
+
+
+history = SubmissionHistory()
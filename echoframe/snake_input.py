@@ -0,0 +1,87 @@
+"""
+snake_input.py - Per-session queue of direction inputs for snake previews.
+
+The scheduler used to send whatever direction arrived last, so two taps within one tick
+(UP then LEFT to turn a corner) lost the first one. An InputQueue keeps taps in order and
+hands out one per tick. Taps that would do nothing are collapsed when they arrive: pressing
+the current heading again, or the exact reverse of it (which the snake would ignore anyway).
+The reference is the last queued direction, so UP, LEFT from a snake heading RIGHT is kept
+while UP, DOWN becomes just UP. With nothing queued it is the snake's direction as the worker
+last reported it (observe()), not the last direction handed out: a tap the student's code
+ignored, or an echo without controls yet, must not make later taps look like reversals.
+
+Every input keeps the client's timestamp (performance.now() on the page) and the server's
+receive time. The scheduler attaches both to the first frame rendered after the input took
+effect, so the page can show input-to-render latency on its own clock.
+"""
+import threading
+import time
+from collections import deque
+
+INPUT_QUEUE_SIZE = 3 # Taps buffered ahead; more within a few ticks is mashing, and dropped
+REVERSE = {'UP': 'DOWN', 'DOWN': 'UP', 'LEFT': 'RIGHT', 'RIGHT': 'LEFT'}
+
+
+class DirectionInput:
+    __slots__ = ('direction', 'client_time', 'received', 'dispatched')
+
+    def __init__(self, direction, client_time=None):
+        self.direction = direction
+        self.client_time = client_time # Client clock, ms (echoed back as-is)
+        self.received = time.monotonic()
+        self.dispatched = None # Set by the scheduler when the input goes to the worker
+
+
+class InputQueue:
+    """
+    Bounded FIFO of direction inputs for one preview.
+
+    Args:
+        maxlen: Inputs kept waiting; newer ones are dropped while the queue is full
+        heading: Direction the snake starts with
+    """
+
+    def __init__(self, maxlen=INPUT_QUEUE_SIZE, heading='RIGHT'):
+        self.maxlen = maxlen
+        self.heading = heading # Snake's reported direction, or the last one handed out until it reports one
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self.counters = {'queued': 0, 'delivered': 0, 'duplicates': 0, 'reversals': 0, 'overflow': 0}
+
+    def push(self, direction, client_time=None):
+        """Queue a tap. Returns True if it was kept."""
+        if direction not in REVERSE:
+            return False
+        with self._lock:
+            previous = self._queue[-1].direction if self._queue else self.heading
+            if direction == previous:
+                self.counters['duplicates'] += 1
+                return False
+            if direction == REVERSE[previous]:
+                self.counters['reversals'] += 1
+                return False
+            if len(self._queue) >= self.maxlen:
+                self.counters['overflow'] += 1
+                return False
+            self._queue.append(DirectionInput(direction, client_time))
+            self.counters['queued'] += 1
+            return True
+
+    def observe(self, direction):
+        """Take the direction the snake reported in its latest state as the heading (ignored if None)."""
+        if isinstance(direction, str) and direction in REVERSE:
+            with self._lock:
+                self.heading = direction
+
+    def next(self):
+        """The input for this tick (None if nothing is waiting; the heading stays)."""
+        with self._lock:
+            if not self._queue:
+                return None
+            item = self._queue.popleft()
+            self.heading = item.direction
+            self.counters['delivered'] += 1
+            return item
+
+    def __len__(self):
+        return len(self._queue)
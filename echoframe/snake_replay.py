@@ -0,0 +1,266 @@
+"""
+snake_replay.py - Compact replay recordings of snake preview sessions.
+
+A preview is deterministic once three things are pinned down: the student's files, the seed
+of the `random` module in the worker, and the direction each get_user_direction() call
+returned (the scheduler's answer, or the worker's fallback when the answer came too late). A replay file stores exactly that, plus a CRC of every frame so a
+re-run can prove it produced the same game:
+
+    header (56 bytes): b'EFRP', version, flags, seed, sha256 of the files, start time
+    frame  (6 bytes):  b'F', direction code, crc32 of the frame's state
+    end    (6 bytes):  b'E', end reason code, frame count
+
+Files are only ever appended to, so a session that dies mid-way still leaves a readable
+prefix. A 200-frame preview takes about 1.3 KB. The files themselves are stored once per
+content hash next to the replays (files/<sha256>.json).
+
+Replaying (from the echoframe directory):
+    python snake_replay.py user_data/replays/52/2b/alice/20250101-120000_1a2b3c4d.efr
+    python snake_replay.py some.efr --files path/to/snake_echo_5
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+MAGIC = b'EFRP'
+FORMAT_VERSION = 1
+REPLAY_EXTENSION = '.efr'
+
+_HEADER = struct.Struct('<4sBBxxQ32sd') # magic, version, flags, seed, files sha256, start time
+_RECORD = struct.Struct('<cBI')         # record type, direction/reason code, crc32/frame count
+
+DIRECTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+_DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTIONS)}
+NO_DIRECTION = 255
+
+END_REASONS = ['finished', 'stopped', 'error', 'budget', 'other']
+_REASON_CODES = {name: code for code, name in enumerate(END_REASONS)}
+
+
+def files_sha256(files):
+    """Content hash of a {filename: source} dict (independent of dict order)."""
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode('utf-8') + b'\0')
+        digest.update(files[name].encode('utf-8', 'surrogatepass') + b'\0')
+    return digest.digest()
+
+
+def frame_crc(state):
+    """CRC32 of a game state dict, independent of key order and list/tuple differences."""
+    encoded = json.dumps(state, sort_keys=True, separators=(',', ':'), default=str)
+    return zlib.crc32(encoded.encode('utf-8')) & 0xFFFFFFFF
+
+
+def save_files_snapshot(replay_dir, files):
+    """Store the files under their content hash (once) so the replay can be re-run later."""
+    files_dir = os.path.join(replay_dir, 'files')
+    path = os.path.join(files_dir, files_sha256(files).hex() + '.json')
+    if not os.path.exists(path):
+        os.makedirs(files_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(files, f)
+        os.replace(tmp_path, path)
+    return path
+
+
+class ReplayWriter:
+    """
+    Appends one preview session to a replay file.
+
+    Args:
+        path: Replay file to create (parent directories are created)
+        seed: Seed the worker's `random` module was given
+        files: The student's {filename: source} dict
+    """
+
+    def __init__(self, path, seed, files):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.frames = 0
+        self._file = open(path, 'ab')
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, seed, files_sha256(files), time.time()))
+
+    def record(self, direction, state):
+        """Log one get_user_direction() call: the state the worker reported and the direction the call returned."""
+        if self._file is None:
+            return
+        self._file.write(_RECORD.pack(b'F', _DIRECTION_CODES.get(direction, NO_DIRECTION), frame_crc(state)))
+        self.frames += 1
+
+    def close(self, reason='other'):
+        """Write the end record and close the file."""
+        if self._file is None:
+            return
+        f, self._file = self._file, None # Closed even if the write fails
+        try:
+            f.write(_RECORD.pack(b'E', _REASON_CODES.get(reason, _REASON_CODES['other']), self.frames))
+        finally:
+            f.close()
+
+
+def read_replay(path):
+    """
+    Parse a replay file.
+
+    Returns:
+        dict with seed, files_sha256 (hex), started, frames [(direction, crc), ...],
+        end_reason (None if the session never finished) and truncated
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"{path}: too short to be a replay file")
+    magic, version, _flags, seed, sha, started = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a replay file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported replay version {version}")
+    replay = {'seed': seed, 'files_sha256': sha.hex(), 'started': started, 'frames': [],
+              'end_reason': None, 'truncated': False}
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        kind, code, value = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if kind == b'F':
+            replay['frames'].append((DIRECTIONS[code] if code < len(DIRECTIONS) else None, value))
+        elif kind == b'E':
+            replay['end_reason'] = END_REASONS[code] if code < len(END_REASONS) else 'other'
+            break
+        else:
+            break # Corrupt tail; keep what was read
+    replay['truncated'] = replay['end_reason'] is None
+    return replay
+
+
+def load_files_for(replay, replay_path, files_dir=None):
+    """Find the files a replay was recorded with, from a directory or the hash-keyed snapshot."""
+    if files_dir:
+        files = {}
+        for filename in sorted(os.listdir(files_dir)):
+            if filename.endswith('.py'):
+                with open(os.path.join(files_dir, filename), 'r', encoding='utf-8') as f:
+                    files[filename] = f.read()
+    else:
+        # Snapshots live in files/ next to the replay (see save_files_snapshot)
+        snapshot = os.path.join(os.path.dirname(os.path.abspath(replay_path)), 'files',
+                                replay['files_sha256'] + '.json')
+        with open(snapshot, 'r', encoding='utf-8') as f:
+            files = json.load(f)
+    if files_sha256(files).hex() != replay['files_sha256']:
+        raise ValueError("The files do not match the hash recorded in the replay")
+    return files
+
+
+class _FastClock:
+    """pygame.time.Clock stand-in that never sleeps, so replays run faster than real time."""
+
+    def __init__(self):
+        self._fps = 0.0
+
+    def tick(self, framerate=0):
+        self._fps = float(framerate or 0)
+        return int(1000 / framerate) if framerate else 0
+
+    tick_busy_loop = tick
+
+    def get_time(self):
+        return int(1000 / self._fps) if self._fps else 0
+
+    get_rawtime = get_time
+
+    def get_fps(self):
+        return self._fps
+
+
+class _ErrorSink:
+    """Collects what the student job would have sent to the parent (only errors, in a replay)."""
+
+    def __init__(self):
+        self.errors = []
+
+    def send(self, msg):
+        if isinstance(msg, dict) and 'error' in msg:
+            self.errors.append(msg['error'])
+
+
+def replay_session(replay, files):
+    """
+    Re-run the student's code headlessly with the recorded seed and directions.
+
+    Returns:
+        dict with frames_checked, frames_recorded, identical, first_divergence (tick index or None),
+        error and seconds
+    """
+    import builtins
+    import student_driven_snake as sds
+
+    frames = replay['frames']
+    result = {'frames_recorded': len(frames), 'frames_checked': 0, 'identical': False,
+              'first_divergence': None, 'error': None, 'seconds': 0.0}
+
+    def replay_get_user_direction():
+        tick = result['frames_checked']
+        if tick >= len(frames):
+            raise sds.PreviewStopped()
+        direction, expected_crc = frames[tick]
+        if frame_crc(sds._extract_game_state(sds._job_namespace)) != expected_crc:
+            result['first_divergence'] = tick
+            raise sds.PreviewStopped()
+        result['frames_checked'] += 1
+        return direction or 'RIGHT'
+
+    sds._prepare_student_runtime()
+    builtins.get_user_direction = replay_get_user_direction
+    real_time = None
+    if sds.PREVIEW_PYGAME != 'headless':
+        # The headless shim's clock is virtual and never sleeps; real pygame's has to be swapped out
+        import pygame
+        real_time = (pygame.time.Clock, pygame.time.delay, pygame.time.wait)
+        pygame.time.Clock = _FastClock
+        pygame.time.delay = pygame.time.wait = lambda ms: 0
+    sink = _ErrorSink()
+    started = time.perf_counter()
+    try:
+        main_file = 'snake.py' if 'snake.py' in files else 'main.py'
+        sds._run_student_job(sink, files, main_file, replay['seed'])
+    finally:
+        if real_time is not None:
+            pygame.time.Clock, pygame.time.delay, pygame.time.wait = real_time
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    result['error'] = sink.errors[0] if sink.errors else None
+    if result['first_divergence'] is None and result['frames_checked'] < len(frames):
+        result['first_divergence'] = result['frames_checked'] # Student code ended early
+    result['identical'] = result['first_divergence'] is None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run a recorded snake preview and compare every frame")
+    parser.add_argument('replay', help="Replay file (.efr)")
+    parser.add_argument('--files', help="Directory with the student's .py files (default: the stored snapshot)")
+    args = parser.parse_args()
+
+    replay = read_replay(args.replay)
+    files = load_files_for(replay, args.replay, args.files)
+    print(f"[REPLAY] {args.replay}: seed {replay['seed']}, {len(replay['frames'])} frames, "
+          f"ended: {replay['end_reason'] or 'truncated'}")
+    result = replay_session(replay, files)
+    if result['identical']:
+        print(f"[REPLAY] Identical: {result['frames_checked']} frames in {result['seconds']}s")
+        return 0
+    print(f"[REPLAY] Diverged at frame {result['first_divergence']} of {result['frames_recorded']}"
+          f" ({result['seconds']}s)")
+    if result['error']:
+        print(f"[REPLAY] Student code error:\n{result['error']}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+snake_worker_pool.py - Pool of pre-forked, pre-warmed worker processes for snake previews.
+
+Starting a fresh multiprocessing.Process for every preview means each child has to
+import pygame and set up SDL before the student's code even starts running. The pool
+keeps a few of those children alive and warm, hands one out per preview and recycles
+it after a configurable number of uses (or as soon as it misbehaves).
+"""
+import multiprocessing
+import threading
+
+from green_ipc import join_process
+
+# Default pool settings (overridable per pool)
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_USES = 20
+DEFAULT_CHECKOUT_TIMEOUT = 2.0  # Seconds to wait for an idle worker before cold spawning
+
+
+def detach_from_parent_hub():
+    """
+    Call first thing in a forked worker. When the parent runs under eventlet, the fork copies
+    its hub and every green thread parked on it; the first blocking call in the child would
+    otherwise resume the server's greenlets inside the worker. Dropping the inherited hub
+    leaves the worker with a fresh, empty one.
+    """
+    try:
+        from eventlet import hubs
+    except ImportError:
+        return
+    hubs.use_hub()
+
+
+class PooledWorker:
+    """A single worker process plus the parent end of its pipe."""
+
+    def __init__(self, target, max_uses):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.max_uses = max_uses
+        self.uses = 0
+        self.process = multiprocessing.Process(target=target, args=(child_conn, max_uses), daemon=True)
+        self.process.start()
+        child_conn.close()  # The child owns its end now; closing ours lets recv() see EOF if it dies
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def is_spent(self):
+        """True once the worker has served its maximum number of jobs."""
+        return self.uses >= self.max_uses
+
+    def start_job(self, *job_args):
+        """Hand a job to the worker. The worker loop expects ('run', *job_args)."""
+        self.uses += 1
+        self.conn.send(('run',) + tuple(job_args))
+
+    def drain(self):
+        """Discard anything the worker sent that nobody read. Returns False if the pipe is broken."""
+        try:
+            while self.conn.poll(0):
+                self.conn.recv()
+            return True
+        except (EOFError, OSError):
+            return False
+
+    def stop(self, timeout=0.5):
+        """Ask the worker to exit, terminating it if it does not comply in time."""
+        try:
+            if self.process.is_alive():
+                self.conn.send(('shutdown',))
+                join_process(self.process, timeout)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+            join_process(self.process, timeout)
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+
+class SnakeWorkerPool:
+    """
+    Fixed-size pool of warm worker processes.
+
+    Args:
+        target: Top-level function run in each worker as target(child_conn, max_uses)
+        size: Number of workers kept alive
+        max_uses: Jobs a worker may run before it is retired and replaced
+        checkout_timeout: Seconds checkout() waits for an idle worker before cold spawning one
+    """
+
+    def __init__(self, target, size=DEFAULT_POOL_SIZE, max_uses=DEFAULT_MAX_USES,
+                 checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT):
+        self.target = target
+        self.size = max(1, int(size))
+        self.max_uses = max(1, int(max_uses))
+        self.checkout_timeout = checkout_timeout
+        self._idle = []
+        self._busy = set()
+        self._cond = threading.Condition()
+        self._started = False
+        self._closed = False
+        self.counters = {
+            'checkouts': 0,    # Workers handed out
+            'waits': 0,        # Checkouts that found no idle worker and had to wait
+            'cold_spawns': 0,  # Workers started on demand while a preview was waiting
+            'warm_spawns': 0,  # Workers started ahead of time (prefork and refills)
+            'recycled': 0,     # Workers retired (max uses reached, died or did not stop cleanly)
+        }
+
+    def _spawn(self, cold):
+        worker = PooledWorker(self.target, self.max_uses)
+        self.counters['cold_spawns' if cold else 'warm_spawns'] += 1
+        print(f"[Snake Pool] Spawned {'cold' if cold else 'warm'} worker PID {worker.pid}")
+        return worker
+
+    def _live_count(self):
+        return len(self._idle) + len(self._busy)
+
+    def start(self):
+        """Pre-fork workers up to the pool size."""
+        with self._cond:
+            self._started = True
+            while self._live_count() < self.size:
+                self._idle.append(self._spawn(cold=False))
+
+    def _pop_idle(self):
+        """Return an idle, live worker or None. Dead workers found on the way are recycled."""
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.is_alive():
+                return worker
+            self.counters['recycled'] += 1
+            worker.stop(timeout=0)
+        return None
+
+    def checkout(self, timeout=None):
+        """Take a warm worker out of the pool, spawning one if none frees up in time."""
+        if timeout is None:
+            timeout = self.checkout_timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Snake worker pool has been shut down.")
+            if not self._started:
+                self._started = True
+                while self._live_count() < self.size:
+                    self._idle.append(self._spawn(cold=False))
+            self.counters['checkouts'] += 1
+            worker = self._pop_idle()
+            if worker is None and self._live_count() < self.size:
+                worker = self._spawn(cold=True)
+            elif worker is None:
+                self.counters['waits'] += 1
+                self._cond.wait_for(lambda: bool(self._idle), timeout=timeout)
+                worker = self._pop_idle()
+                if worker is None:
+                    # Still nothing free: start an overflow worker rather than stall the preview.
+                    worker = self._spawn(cold=True)
+            self._busy.add(worker)
+            return worker
+
+    def checkin(self, worker, healthy=True):
+        """
+        Return a worker after a preview.
+
+        Args:
+            worker: The PooledWorker obtained from checkout()
+            healthy: False if the job did not finish cleanly; the worker is then replaced
+        """
+        retire = None
+        with self._cond:
+            self._busy.discard(worker)
+            reusable = (healthy and not self._closed and worker.is_alive() and not worker.is_spent()
+                        and self._live_count() < self.size and worker.drain())
+            if reusable:
+                self._idle.append(worker)
+            else:
+                retire = worker
+                self.counters['recycled'] += 1
+                if not self._closed and self._live_count() < self.size:
+                    self._idle.append(self._spawn(cold=False))
+            self._cond.notify()
+        if retire is not None:
+            print(f"[Snake Pool] Retiring worker PID {retire.pid} (uses: {retire.uses}, healthy: {healthy})")
+            retire.stop()
+
+    def get_stats(self):
+        """Counters plus the current pool occupancy."""
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update({
+                'size': self.size,
+                'max_uses': self.max_uses,
+                'idle': len(self._idle),
+                'busy': len(self._busy),
+            })
+            return stats
+
+    def shutdown(self):
+        """Stop every idle worker. Busy workers are retired when they are checked back in."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
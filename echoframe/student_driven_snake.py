@@ -14,6 +14,7 @@ import traceback
 import importlib
 import shutil
 import tempfile
+import re
 from io import StringIO
 import eventlet
 from flask_socketio import emit
@@ -25,6 +26,20 @@ import threading
 import importlib.util
 import json
 import multiprocessing
+import collections
+from snake_frames import FrameEncoder
+from green_ipc import wait_readable
+from snake_replay import ReplayWriter, save_files_snapshot, REPLAY_EXTENSION
+from process_limits import JobUsage, UsageAccounting, apply_job_limits, restore_job_limits
+from snake_features import detect_echo_level
+from student_imports import StudentFiles
+from headless_pygame import HeadlessPygame
+from snake_input import InputQueue
+from preview_latency import LatencyTracker
+from user_paths import snake_code_dir
+from persistent_storage import storage
+import errno
+import signal
 
 # Custom exception for file loading
 class FileLoadedException(Exception):
@@ -33,12 +48,14 @@ class FileLoadedException(Exception):
 
 # Dictionary to track active simulations by session ID
 active_simulations = {}
-# Dictionary to store client input by session ID
-client_inputs = {}
+# Dictionary to store each session's queued direction inputs (snake_input.InputQueue) by session ID
+input_queues = {}
 # Dictionary to store student namespace by session ID
 student_namespaces = {}
 # Global socketio reference for use in handlers
 global_socketio = None
+# Dictionary to store the delta frame encoder by session ID (only for clients using the frame protocol)
+frame_encoders = {}
 
 # --- Constants ---
 # These constants are the default values that will be used if not defined in student's code
@@ -119,8 +136,7 @@ def get_user_snake_dir(username, echo_level=None, create=True):
     Returns:
         Path to the user's snake code directory or echo-specific directory
     """
-    base_dir = os.path.join('user_data', 'snake_code')
-    user_dir = os.path.join(base_dir, username)
+    user_dir = snake_code_dir(username) # Sharded or (not migrated yet) flat, see user_paths.py
 
     if create and not os.path.exists(user_dir):
         os.makedirs(user_dir, exist_ok=True)
@@ -134,160 +150,15 @@ def get_user_snake_dir(username, echo_level=None, create=True):
 
     return user_dir
 
-# Custom module mock for pygame to prevent window opening
-class MockPygame:
-    """Mock pygame module to prevent window opening in preview mode."""
-    class Surface:
-        def __init__(self, size):
-            self.size = size
-
-        def fill(self, color):
-            pass
-
-        def blit(self, source, dest, area=None, special_flags=0):
-            pass
-
-    class Rect:
-        def __init__(self, left, top, width, height):
-            self.left = left
-            self.top = top
-            self.width = width
-            self.height = height
-            self.size = (width, height)
-            self.topleft = (left, top)
-
-        def colliderect(self, rect):
-            return False
-
-        def move(self, x, y):
-            return MockPygame.Rect(self.left + x, self.top + y, self.width, self.height)
-
-    class Event:
-        def __init__(self, type, **kwargs):
-            self.type = type
-            for key, value in kwargs.items():
-                setattr(self, key, value)
-
-    class MockDraw:
-        def rect(self, surface, color, rect, width=0):
-            pass
-
-        def circle(self, surface, color, center, radius, width=0):
-            pass
-
-        def line(self, surface, color, start_pos, end_pos, width=1):
-            pass
-
-    class MockDisplay:
-        def set_mode(self, size, flags=0, depth=0, display=0, vsync=0):
-            return MockPygame.Surface(size)
-
-        def set_caption(self, caption):
-            pass
-
-        def flip(self):
-            pass
-
-        def update(self, *args):
-            pass
-
-    class MockTime:
-        def Clock(self):
-            return type('MockClock', (), {
-                'tick': lambda fps: time.sleep(1/fps),
-                'get_fps': lambda: 30
-            })
-
-    class MockFont:
-        def __init__(self):
-            pass
-
-        def init(self):
-            pass
-
-        def SysFont(self, name, size):
-            return type('MockFont', (), {
-                'render': lambda text, antialias, color: MockPygame.Surface((100, 30))
-            })
-
-    class MockEvent:
-        def get(self, *args, **kwargs):
-            events = []
-            return events
-
-    # Constants
-    QUIT = 12
-    KEYDOWN = 2
-    K_UP = 273
-    K_DOWN = 274
-    K_LEFT = 276
-    K_RIGHT = 275
-    K_SPACE = 32
-
-    # Create instances of our mock classes
-    display = MockDisplay()
-    draw = MockDraw()
-    time = MockTime()
-    font = MockFont()
-    event = MockEvent()
-
-    def init(self=None):
-        return 6, 0
-
-    def quit(self=None):
-        pass
+# Which pygame student code gets in preview workers: 'headless' (headless_pygame.HeadlessPygame,
+# no drawing, virtual clock) or 'real' (pygame with SDL's dummy video driver)
+PREVIEW_PYGAME = 'headless'
+_headless_pygame = None # The worker's shim, reset before every job
 
 # Function to determine the echo level based on files
 def _determine_echo_level(files):
-    """Determine which echo level the student is at based on their code."""
-    echo_level = 0
-
-    # Check for constants definition (Echo 1)
-    for _, code in files.items():
-        if 'GRID_WIDTH' in code and 'GRID_HEIGHT' in code and 'CELL_SIZE' in code:
-            echo_level = max(echo_level, 1)
-
-    # Check for game loop (Echo 2)
-    for _, code in files.items():
-        if 'pygame.init()' in code and 'while' in code and 'pygame.display.flip()' in code:
-            echo_level = max(echo_level, 2)
-
-    # Check for Snake class (Echo 3)
-    for _, code in files.items():
-        if 'class Snake' in code:
-            echo_level = max(echo_level, 3)
-
-    # Check for draw method (Echo 4)
-    for _, code in files.items():
-        if 'class Snake' in code and 'def draw' in code and 'pygame.draw.rect' in code:
-            echo_level = max(echo_level, 4)
-
-    # Check for Food class (Echo 5)
-    for _, code in files.items():
-        if 'class Food' in code:
-            echo_level = max(echo_level, 5)
-
-    # Check for snake growth (Echo 6)
-    for _, code in files.items():
-        if ('grow' in code or 'eat' in code) and 'food' in code.lower():
-            echo_level = max(echo_level, 6)
-
-    # Check for input handling (Echo 7)
-    for _, code in files.items():
-        if 'pygame.K_UP' in code or 'pygame.K_DOWN' in code:
-            echo_level = max(echo_level, 7)
-
-    # Check for collision detection (Echo 8)
-    for _, code in files.items():
-        if ('collision' in code or 'collide' in code) and ('wall' in code or 'self' in code):
-            echo_level = max(echo_level, 8)
-
-    # Check for game over (Echo 9)
-    for _, code in files.items():
-        if 'game over' in code.lower() or 'gameover' in code.lower() or 'restart' in code.lower():
-            echo_level = max(echo_level, 9)
-
-    return echo_level
+    """Determine which echo level the student is at based on their code (one cached AST walk per file)."""
+    return detect_echo_level(files)
 
 # Functions to manage built-in constants
 def _setup_builtins_constants(global_dict):
@@ -312,8 +183,8 @@ def stop_student_snake(sid):
         if sid in student_namespaces: # student_namespaces is specific to student_driven_snake
             del student_namespaces[sid]
 
-        # DO NOT DELETE client_inputs[sid] here.
-        # print(f"[student_driven_snake.py stop_student_snake SID: {sid}] client_inputs[{sid}] will NOT be deleted by stop_student_snake.")
+        # DO NOT DELETE input_queues[sid] here.
+        # print(f"[student_driven_snake.py stop_student_snake SID: {sid}] input_queues[{sid}] will NOT be deleted by stop_student_snake.")
 
         return True
     print(f"[student_driven_snake.py stop_student_snake SID: {sid}] No active simulation found to stop.")
@@ -322,34 +193,45 @@ def stop_student_snake(sid):
         active_simulations[sid] = False
         if sid in student_namespaces:
             del student_namespaces[sid]
-        if sid in client_inputs:
-            del client_inputs[sid]
+        if sid in input_queues:
+            del input_queues[sid]
         return True
     return False
 
 # Function to handle direction input from client
-def handle_direction_input(sid, direction):
-    """Handle direction input from the client."""
-    if direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
-        client_inputs[sid] = direction  # Update client_inputs with the valid direction
-        print(f"[{sid}] client_inputs for SID {sid} updated to: {direction}") # Log the update
+def handle_direction_input(sid, direction, client_time=None):
+    """
+    Queue a direction input from the client; the scheduler delivers one per tick.
+    Input for a session with no running preview is dropped (its queue is created by
+    run_student_snake and freed when the run ends).
 
-        if sid not in active_simulations or not active_simulations.get(sid):
-            print(f"[{sid}] INFO: Direction input '{direction}' processed by handle_direction_input. Simulation was not marked as 'active' in active_simulations dictionary (or SID not found). client_inputs still updated.")
-        else:
-            print(f"[{sid}] INFO: Direction input '{direction}' processed by handle_direction_input for an active simulation.")
-            # Optional: Keep the debug direct manipulation attempt for logging if useful,
-            # but it's understood this doesn't directly affect student_process.
-            if sid in student_namespaces and 'snake' in student_namespaces[sid]:
-                snake_obj = student_namespaces[sid].get('snake')
-                if hasattr(snake_obj, 'direction'):
-                    print(f"[{sid}] DEBUG_DIRECT_MANIP: current snake_obj.direction in namespace: {getattr(snake_obj, 'direction', 'N/A')}")
-                # else:
-                #     print(f"[{sid}] DEBUG_DIRECT_MANIP: snake_obj in namespace has no 'direction' attribute.")
+    Args:
+        sid: Socket session ID
+        direction: 'UP', 'DOWN', 'LEFT' or 'RIGHT'
+        client_time: The client's timestamp for the key press (ms), echoed back with the frame that shows it
+    """
+    if direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
+        queue = input_queues.get(sid)
+        if queue is None or not active_simulations.get(sid):
+            print(f"[{sid}] Direction input '{direction}' dropped: no preview running")
+            return False
+        if not queue.push(direction, client_time):
+            print(f"[{sid}] Direction input '{direction}' collapsed (repeat, reversal or queue full)")
+            return True
+        print(f"[{sid}] Direction input '{direction}' queued for SID {sid} ({len(queue)} waiting)") # Log the update
+
+        # Optional: Keep the debug direct manipulation attempt for logging if useful,
+        # but it's understood this doesn't directly affect student_process.
+        if sid in student_namespaces and 'snake' in student_namespaces[sid]:
+            snake_obj = student_namespaces[sid].get('snake')
+            if hasattr(snake_obj, 'direction'):
+                print(f"[{sid}] DEBUG_DIRECT_MANIP: current snake_obj.direction in namespace: {getattr(snake_obj, 'direction', 'N/A')}")
             # else:
-            #     print(f"[{sid}] DEBUG_DIRECT_MANIP: No 'snake' obj in student_namespaces for SID {sid}.")
+            #     print(f"[{sid}] DEBUG_DIRECT_MANIP: snake_obj in namespace has no 'direction' attribute.")
+        # else:
+        #     print(f"[{sid}] DEBUG_DIRECT_MANIP: No 'snake' obj in student_namespaces for SID {sid}.")
 
-        return True # Return True because a valid direction was received and stored in client_inputs
+        return True # Return True because a valid direction was received
     else:
         print(f"[{sid}] Invalid direction received in handle_direction_input: {direction}")
         return False # Invalid direction string
@@ -362,6 +244,72 @@ def send_game_state_update(socketio, sid, game_state):
     except Exception as e:
         print(f"Error sending game state update: {e}")
 
+# Function to make the next preview frame a keyframe
+def request_keyframe(sid):
+    """Ask the session's frame encoder for a keyframe. Returns False if the session isn't using frames."""
+    encoder = frame_encoders.get(sid)
+    if encoder is None:
+        return False
+    encoder.request_keyframe()
+    return True
+
+# --- Per-connection session context ---
+class SessionContext:
+    """What the server knows about one socket connection, recorded once instead of rediscovered per event."""
+    __slots__ = ('sid', 'username', 'qid', 'echo_level', 'files_hash', 'connected_at')
+
+    def __init__(self, sid, username, qid=None, echo_level=None):
+        self.sid = sid
+        self.username = username
+        self.qid = qid # Quest page the connection came from, if known
+        self.echo_level = echo_level # 1-based (1-10)
+        self.files_hash = None # sha256 of the files of the last preview started
+        self.connected_at = time.time()
+
+# Dictionary to store the session context by session ID
+session_contexts = {}
+
+# Snake quest IDs 20-29 are echoes 1-10
+SNAKE_QUEST_OFFSET = 19
+_QUEST_URL_RE = re.compile(r'/quest/(\d+)')
+
+def _echo_from_quest(qid):
+    """1-based echo level for a snake quest ID, or None for other quests."""
+    try:
+        echo_level = int(qid) - SNAKE_QUEST_OFFSET
+    except (TypeError, ValueError):
+        return None
+    return echo_level if 1 <= echo_level <= 10 else None
+
+def register_session(sid, username, page_url=None):
+    """Record a new connection. page_url (the referring quest page) gives the quest and echo level up front."""
+    qid = None
+    match = _QUEST_URL_RE.search(page_url or '')
+    if match:
+        qid = int(match.group(1))
+    context = SessionContext(sid, username, qid, _echo_from_quest(qid))
+    session_contexts[sid] = context
+    return context
+
+def update_session(sid, **fields):
+    """Update fields of a session's context (qid, echo_level, files_hash). Returns the context or None."""
+    context = session_contexts.get(sid)
+    if context is None:
+        return None
+    for name, value in fields.items():
+        setattr(context, name, value)
+    return context
+
+def get_session_context(sid):
+    """The session's context, or None if the connection isn't registered."""
+    return session_contexts.get(sid)
+
+def drop_session(sid):
+    """Forget everything kept for a connection (on disconnect)."""
+    session_contexts.pop(sid, None)
+    input_queues.pop(sid, None)
+    active_simulations.pop(sid, None)
+
 # Define a helper function to determine echo level
 def determine_echo_level(sid, username, socketio_instance=None):
     """Determine the echo level for a user.
@@ -369,181 +317,43 @@ def determine_echo_level(sid, username, socketio_instance=None):
     Args:
         sid: The socket ID
         username: The username if available
-        socketio_instance: The socketio instance if available
+        socketio_instance: Unused; kept for existing callers
 
     Returns:
         int: The echo level (1-10)
     """
-    echo_level = None
-    socketio_to_use = socketio_instance or global_socketio
-
-    print(f"[{sid}] DEBUG: Determining echo level...")
-
-    # Direct mapping from quest ID to echo level
-    quest_to_echo = {
-        20: 1,  # Quest 20 = Echo 1
-        21: 2,  # Quest 21 = Echo 2
-        22: 3,  # Quest 22 = Echo 3
-        23: 4,  # Quest 23 = Echo 4
-        24: 5,  # Quest 24 = Echo 5
-        25: 6,  # Quest 25 = Echo 6
-        26: 7,  # Quest 26 = Echo 7
-        27: 8,  # Quest 27 = Echo 8
-        28: 9,  # Quest 28 = Echo 9
-        29: 10  # Quest 29 = Echo 10
-    }
+    # Method 1: The session's context (set on connect / start_snake_preview)
+    context = session_contexts.get(sid)
+    if context is not None and context.echo_level:
+        return context.echo_level
+
+    # Method 2: Quest ID in the current request's path or query
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            match = _QUEST_URL_RE.search(request.path)
+            qid = match.group(1) if match else request.args.get('quest')
+            echo_level = _echo_from_quest(qid)
+            if echo_level is None and request.args.get('echo', '').isdigit() and 1 <= int(request.args['echo']) <= 10:
+                echo_level = int(request.args['echo'])
+            if echo_level is not None:
+                update_session(sid, echo_level=echo_level)
+                return echo_level
+    except Exception as e:
+        print(f"[{sid}] Error extracting quest ID from request: {e}")
 
-    # Method 1: From app function - most reliable if username is available
+    # Method 3: The user's saved progress (reads their data file, so the result is kept in the context)
     if username:
         try:
             from app import get_user_snake_echo_level
             echo_level = get_user_snake_echo_level(username)
             print(f"[{sid}] Retrieved echo level for {username}: {echo_level}")
             if echo_level is not None and echo_level >= 0:
+                update_session(sid, echo_level=echo_level + 1)
                 return echo_level + 1  # Convert 0-based to 1-based
         except Exception as e:
             print(f"[{sid}] Error getting echo level from app: {e}")
 
-    # Method 2: Extract quest ID from request context if available
-    try:
-        from flask import has_request_context, request
-        if has_request_context():
-            # Get path from request
-            path = request.path
-            print(f"[{sid}] URL path from request: {path}")
-
-            # Extract quest number using regex for more reliable parsing
-            import re
-            quest_match = re.search(r'/quest/(\d+)', path)
-            if quest_match:
-                quest_id = int(quest_match.group(1))
-                print(f"[{sid}] Found quest ID in path: {quest_id}")
-                # Special case handling for Quest 28 (Echo 9)
-                if quest_id == 28:
-                    print(f"[{sid}] Special case: Quest 28 maps to Echo 9")
-                    return 9  # Echo 9
-                if quest_id in quest_to_echo:
-                    return quest_to_echo[quest_id]
-
-            # Check query parameter as fallback
-            if hasattr(request, 'args') and 'echo' in request.args:
-                try:
-                    echo_level = int(request.args.get('echo'))
-                    print(f"[{sid}] Found echo level in query param: {echo_level}")
-                    if 1 <= echo_level <= 10:
-                        return echo_level
-                except ValueError:
-                    pass
-
-            # Check URL directly for echoframe-related paths
-            url_path = request.path
-            print(f"[{sid}] Checking URL path directly: {url_path}")
-
-            # Check for quest in URL components
-            url_parts = url_path.split('/')
-            for i, part in enumerate(url_parts):
-                if part == 'quest' and i+1 < len(url_parts):
-                    try:
-                        quest_id = int(url_parts[i+1])
-                        print(f"[{sid}] Found quest ID {quest_id} in URL parts")
-                        if quest_id in quest_to_echo:
-                            return quest_to_echo[quest_id]
-                    except (ValueError, IndexError):
-                        pass
-
-            # Check URL query parameters
-            if hasattr(request, 'args'):
-                print(f"[{sid}] Checking URL query parameters: {request.args}")
-                if 'quest' in request.args:
-                    try:
-                        quest_id = int(request.args.get('quest'))
-                        print(f"[{sid}] Found quest ID {quest_id} in query param")
-                        if quest_id in quest_to_echo:
-                            return quest_to_echo[quest_id]
-                    except ValueError:
-                        pass
-
-    except Exception as e:
-        print(f"[{sid}] Error extracting quest ID from path: {e}")
-
-    # Method 3: Check headers from socketio or session
-    try:
-        # Try to get quest ID from session
-        from flask import session
-        if hasattr(session, 'get'):
-            current_quest = session.get('current_quest')
-            print(f"[{sid}] Found current_quest in session: {current_quest}")
-            if current_quest and isinstance(current_quest, int) and current_quest in quest_to_echo:
-                return quest_to_echo[current_quest]
-
-        # Check headers from socketio environ
-        if socketio_to_use and hasattr(socketio_to_use, 'server'):
-            for client_sid, client_session in socketio_to_use.server.environ.items():
-                if client_sid == sid:
-                    # Print all headers for debugging
-                    print(f"[{sid}] All headers in socketio.server.environ: {client_session}")
-
-                    # Check various possible sources of the quest ID
-                    for header_name in ['PATH_INFO', 'HTTP_REFERER', 'REQUEST_URI']:
-                        header_value = client_session.get(header_name, '')
-                        print(f"[{sid}] Header {header_name}: {header_value}")
-
-                        # Try to extract quest ID
-                        import re
-                        quest_match = re.search(r'/quest/(\d+)', header_value)
-                        if quest_match:
-                            quest_id = int(quest_match.group(1))
-                            print(f"[{sid}] Found quest ID {quest_id} in {header_name}")
-                            if quest_id in quest_to_echo:
-                                return quest_to_echo[quest_id]
-
-                    # Check if we can extract directly from the URL
-                    request_uri = client_session.get('REQUEST_URI', '')
-                    if request_uri:
-                        url_parts = request_uri.split('/')
-                        for i, part in enumerate(url_parts):
-                            if part == 'quest' and i+1 < len(url_parts):
-                                try:
-                                    quest_id = int(url_parts[i+1])
-                                    print(f"[{sid}] Found quest ID {quest_id} in REQUEST_URI parts")
-                                    if quest_id in quest_to_echo:
-                                        return quest_to_echo[quest_id]
-                                except (ValueError, IndexError):
-                                    pass
-
-                    # Try to get the flask session from the client_session
-                    if 'flask.session' in client_session:
-                        try:
-                            flask_session = client_session['flask.session']
-                            if isinstance(flask_session, dict):
-                                current_quest = flask_session.get('current_quest')
-                                print(f"[{sid}] Found current_quest in flask.session: {current_quest}")
-                                if current_quest and isinstance(current_quest, int) and current_quest in quest_to_echo:
-                                    return quest_to_echo[current_quest]
-                        except Exception as e:
-                            print(f"[{sid}] Error accessing flask.session: {e}")
-    except Exception as e:
-        print(f"[{sid}] Error checking headers or session: {e}")
-
-    # Last resort: Try to extract quest info from url in referer
-    try:
-        if socketio_to_use and hasattr(socketio_to_use, 'server'):
-            for client_sid, client_session in socketio_to_use.server.environ.items():
-                if client_sid == sid:
-                    referer = client_session.get('HTTP_REFERER', '')
-                    if referer:
-                        import re
-                        for match in re.finditer(r'quest[=/](\d+)', referer):
-                            try:
-                                quest_id = int(match.group(1))
-                                print(f"[{sid}] Found potential quest ID {quest_id} in referer URL")
-                                if quest_id in quest_to_echo:
-                                    return quest_to_echo[quest_id]
-                            except (ValueError, IndexError):
-                                pass
-    except Exception as e:
-        print(f"[{sid}] Error extracting from referer: {e}")
-
     # Default to Echo 1 as the starting point
     print(f"[{sid}] Defaulting to echo level 1")
     return 1
@@ -565,6 +375,9 @@ def force_state_update(socketio, sid, student_namespace):
             "message_hint": "Watch this space for updates",
             "echo_level": 1
         }
+        context = session_contexts.get(sid)
+        if context is not None and context.echo_level:
+            default_state["echo_level"] = context.echo_level
 
         # If we don't have a namespace for this session, nothing to update
         if sid not in student_namespaces:
@@ -579,40 +392,9 @@ def force_state_update(socketio, sid, student_namespace):
         # Try to gather state from the namespace
         # This will vary based on the echo level
 
-        # Get echo level (either from namespace or assuming based on available objects)
-        echo_level = 1
-        socketio_instance = socketio or global_socketio
-        username = None
-
-        # Try to get echo level from Flask session
-        if hasattr(socketio_instance, 'server'):
-            for client_sid, client_session in socketio_instance.server.environ.items():
-                if client_sid == sid and 'flask.session' in client_session:
-                    try:
-                        flask_session = client_session['flask.session']
-                        if isinstance(flask_session, dict) and 'snaker_name' in flask_session:
-                            username = flask_session['snaker_name']
-                            # Use a try/except to safely determine echo level
-                            try:
-                                echo_level = determine_echo_level(sid, username, socketio_instance)
-                            except Exception as e:
-                                print(f"[{sid}] Error determining echo level: {e}")
-                            break
-                    except:
-                        pass
-
-                # Special case check for quest/29 (Echo 10) in path or referer
-                path = client_session.get('PATH_INFO', '')
-                referer = client_session.get('HTTP_REFERER', '')
-
-                if '/quest/29' in path or '/quest/29' in referer:
-                    echo_level = 10
-                    print(f"[{sid}] Special case: Found quest/29 in path or referer, forcing Echo 10")
-
-                # Special case check for quest/28 (Echo 9) in path or referer
-                if '/quest/28' in path or '/quest/28' in referer:
-                    echo_level = 9  # Echo 9 specifically for Quest 28
-                    print(f"[{sid}] Special case: Found quest/28 in path or referer, forcing Echo 9")
+        # Get echo level from the session's context
+        username = context.username if context is not None else None
+        echo_level = determine_echo_level(sid, username)
 
         # Check if all required constants exist with values
         required_constants = ['CELL_SIZE', 'GRID_WIDTH', 'GRID_HEIGHT', 'BLACK', 'WHITE', 'GREEN', 'RED']
@@ -1060,169 +842,757 @@ sys.exit()
 """
 
 # --- Top-level student_process for multiprocessing (Windows fix) ---
-def student_process(child_conn, temp_dir, student_path):
-    import sys, importlib.util, traceback, os
+# Message the parent sends to make get_user_direction() unwind the student's code
+STOP_SIGNAL = '__STOP__'
+
+# Worker pool settings for previews
+PREVIEW_POOL_SIZE = 4
+PREVIEW_POOL_MAX_USES = 20
+PREVIEW_STOP_GRACE = 0.5  # Seconds a worker gets to unwind the student's code before it is terminated
+PREVIEW_DIRECTION_WAIT = 0.5  # Seconds get_user_direction() waits for the scheduler before using the fallback
+
+# Resource limits for student code in preview workers (POSIX only; restored after each preview)
+PREVIEW_CPU_LIMIT = 10          # CPU seconds per preview (RLIMIT_CPU)
+PREVIEW_MEMORY_LIMIT_MB = 256   # Address space a preview may add on top of the warm worker (RLIMIT_AS)
+PREVIEW_MAX_OPEN_FILES = 64     # File descriptors the worker may hold while student code runs (RLIMIT_NOFILE)
+PREVIEW_WALL_LIMIT = 60.0       # Seconds a preview may run in total
+PREVIEW_USAGE_LOG = 'preview_usage.jsonl' # Per-session CPU/RSS records, in the user storage directory (None: memory only)
+
+# What the student sees when their preview is stopped by a limit
+LIMIT_MESSAGES = {
+    'cpu': f"Your snake used more than {PREVIEW_CPU_LIMIT} seconds of CPU time and was stopped. "
+           "Look for a loop that never ends or never calls get_user_direction().",
+    'memory': f"Your snake ran out of memory (limit: {PREVIEW_MEMORY_LIMIT_MB} MB) and was stopped. "
+              "Look for a list that keeps growing, e.g. adding to the snake without removing its tail.",
+    'files': f"Your snake opened too many files at once (limit: {PREVIEW_MAX_OPEN_FILES}). "
+             "Close files when you are done with them.",
+    'wall': f"Your snake preview reached its {PREVIEW_WALL_LIMIT:g} second time limit.",
+    'idle': "Your snake stopped sending frames, so the preview was stopped. "
+            "Make sure your game loop calls get_user_direction() every frame.",
+    'died': "Your snake's process stopped unexpectedly (it may have used too much memory).",
+}
+
+class PreviewLimitExceeded(BaseException):
+    """Raised inside the student's code when it runs out of CPU time (SIGXCPU)."""
+    pass
+
+def _raise_cpu_limit(signum, frame):
+    raise PreviewLimitExceeded('cpu')
+
+def _limit_hit(exc):
+    """Name of the resource limit an exception from student code reflects, or None."""
+    if isinstance(exc, PreviewLimitExceeded):
+        return 'cpu'
+    if isinstance(exc, MemoryError):
+        return 'memory'
+    if isinstance(exc, OSError) and exc.errno in (errno.EMFILE, errno.ENFILE):
+        return 'files'
+    return None
+
+class PreviewStopped(BaseException):
+    """Raised inside the student's code when the parent stops the preview.
+
+    Derives from BaseException so a student's `except Exception:` does not swallow it.
+    """
+    pass
+
+# State of the job currently running in this worker process
+_job_conn = None
+_job_namespace = None
+_direction_returned_at = None # When get_user_direction() last returned a direction from the parent
+_direction_seq = 0 # Number of the current get_user_direction() call; the parent's reply carries it
+_last_direction = None # What the previous call returned (the parent's answer or the fallback)
+
+def _extract_game_state(ns):
+    """Build the JSON-able game state from the student's module namespace."""
+    snake_positions = [[15,10]] # Default
+    if 'snake' in ns and hasattr(ns['snake'], 'positions'):
+        snake_positions = list(ns['snake'].positions)
+    elif 'snake' in ns and isinstance(ns['snake'], list): # Basic list of positions
+        snake_positions = ns['snake']
+
+    # The snake's own heading, if it keeps one as 'UP'/'DOWN'/... (the input queue compares taps with it)
+    snake_direction = getattr(ns.get('snake'), 'direction', None)
+    if not (isinstance(snake_direction, str) and snake_direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']):
+        snake_direction = None
+
+    food_position = [20,10] # Default
+    if 'food' in ns and hasattr(ns['food'], 'position'):
+        food_position = list(ns['food'].position)
+    elif 'food' in ns and isinstance(ns['food'], (list, tuple)): # Basic list/tuple
+        food_position = list(ns['food'])
+
+    return {
+        'grid_width': ns.get('GRID_WIDTH', 30),
+        'grid_height': ns.get('GRID_HEIGHT', 20),
+        'snake': snake_positions,
+        'food': food_position,
+        'score': ns.get('score', 0),
+        'game_over': ns.get('game_over', False),
+        'direction': snake_direction
+    }
+
+def _student_get_user_direction():
+    """get_user_direction() as seen by student code running in a worker process."""
+    global _direction_returned_at, _direction_seq, _last_direction
+    ns = _job_namespace if _job_namespace is not None else sys.modules['__main__'].__dict__
+    child_conn = _job_conn
+    print(f"[DEBUG get_user_direction] Called.")
+
+    # Determine a fallback direction based on snake's current direction if possible
+    fallback_direction = 'RIGHT' # Default fallback
+    if 'snake' in ns:
+        snake_obj = ns['snake']
+        if hasattr(snake_obj, 'direction'):
+            # This assumes student's snake.direction is a string 'UP', 'DOWN', etc.
+            # If it's a tuple (dx, dy) or constant, this part would need adjustment
+            # or the student code would rely purely on the received direction.
+            if isinstance(snake_obj.direction, str) and snake_obj.direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
+                fallback_direction = snake_obj.direction
+
+    # Send current game state
+    _direction_seq += 1
+    try:
+        state = _extract_game_state(ns)
+        if _direction_returned_at is not None:
+            # Popped by the scheduler: when the last direction arrived and when this state (its result) left
+            state['_timing'] = (_direction_returned_at, time.monotonic())
+        # Also popped: which call this is, and what the previous one really returned (for the replay log)
+        state['_seq'] = _direction_seq
+        state['_used'] = _last_direction
+        child_conn.send(state)
+    except Exception as e:
+        # Send error if state extraction fails
+        child_conn.send({'error': f'Error in get_user_direction while extracting state: {traceback.format_exc()}'})
+
+    # Wait for direction from parent process
+    try:
+        # The frame scheduler answers on its next tick, which paces the student's loop to the shared clock.
+        # The timeout only matters if the parent stops answering (overloaded or gone).
+        deadline = time.monotonic() + PREVIEW_DIRECTION_WAIT
+        while child_conn.poll(max(0.0, deadline - time.monotonic())):
+            reply = child_conn.recv()
+            print(f"[DEBUG get_user_direction] Received reply: {reply}")
+            if reply == STOP_SIGNAL:
+                raise PreviewStopped()
+            seq, new_direction = reply
+            if seq != _direction_seq:
+                continue # A late answer to a call that already used the fallback
+            if new_direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
+                _direction_returned_at = time.monotonic()
+                _last_direction = new_direction
+                print(f"[DEBUG get_user_direction] Returning NEWLY RECEIVED direction: {new_direction}")
+                return new_direction
+            break
+    except EOFError: # Pipe might have been closed
+        pass # Will use fallback
+    except PreviewStopped:
+        raise
+    except Exception: # Other potential errors during recv (e.g., timeout, deserialization)
+        pass # Will use fallback
+
+    print(f"[DEBUG get_user_direction] Returning FALLBACK direction: {fallback_direction}")
+    _last_direction = fallback_direction
+    return fallback_direction
+
+def _prepare_student_runtime():
+    """Load headless pygame and install the get_user_direction hook (done once per worker)."""
+    from snake_worker_pool import detach_from_parent_hub
+    detach_from_parent_hub()
+    global _headless_pygame
+    if PREVIEW_PYGAME == 'headless':
+        # Frames are paced by get_user_direction(), so Clock.tick() never needs to sleep
+        _headless_pygame = HeadlessPygame().install()
+    else:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        import pygame
+        pygame.display.set_mode = lambda *args, **kwargs: pygame.Surface((640, 480))
+        pygame.display.flip = lambda *args, **kwargs: None
+    builtins.get_user_direction = _student_get_user_direction
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+
+def _run_student_job(child_conn, files, main_file, seed=None):
+    """Run one student program and leave the worker ready for the next one.
+
+    The files are imported from memory (see student_imports.py), so `import constants` etc.
+    resolve to the student's own files without a temp directory.
+
+    The `random` module is seeded with `seed` (fresh OS entropy if None) so food placement is
+    reproducible from a replay and forked workers don't share one random sequence.
+
+    Returns:
+        The job's resource usage (cpu_seconds, wall_seconds, peak_rss_kb)
+    """
+    global _job_conn, _job_namespace, _direction_returned_at, _direction_seq, _last_direction
+    student_files = StudentFiles(files).install()
+    _job_conn = child_conn
+    _direction_returned_at = None
+    _direction_seq = 0
+    _last_direction = None
+    if _headless_pygame is not None:
+        _headless_pygame.reset()
+    random.seed(seed)
+    usage = JobUsage()
+    saved_limits = apply_job_limits(PREVIEW_CPU_LIMIT, PREVIEW_MEMORY_LIMIT_MB * 1024 * 1024, PREVIEW_MAX_OPEN_FILES)
+    try:
+        print('[DEBUG] student_process importing student code:', main_file)
+        student_mod = student_files.new_module(main_file, "student_main")
+        _job_namespace = student_mod.__dict__
+        student_files.exec_file(main_file, student_mod.__dict__)
+        print('[DEBUG] student_process finished student code')
+    except (PreviewStopped, SystemExit):
+        print('[DEBUG] student_process stopped')
+    except (Exception, PreviewLimitExceeded) as e:
+        limit = _limit_hit(e)
+        restore_job_limits(saved_limits) # Room to format and send the error
+        if limit:
+            child_conn.send({'error': LIMIT_MESSAGES[limit], 'limit': limit})
+            print(f'[DEBUG] student_process hit the {limit} limit')
+        else:
+            child_conn.send({'error': traceback.format_exc()})
+            print('[DEBUG] error sent (importing student code):', traceback.format_exc())
+    finally:
+        restore_job_limits(saved_limits)
+        _job_conn = None
+        _job_namespace = None
+        # Forget the student's modules so the next job imports its own constants/snake_class/food
+        student_files.uninstall()
+    return usage.finish()
+
+def student_process(child_conn, files, main_file, seed=None):
+    """One-shot child: prepare the runtime, run a single student program, exit."""
     print('[DEBUG] student_process started')
-    os.environ["SDL_VIDEODRIVER"] = "dummy"
-    import pygame
-    pygame.display.set_mode = lambda *args, **kwargs: pygame.Surface((640, 480))
-    pygame.display.flip = lambda *args, **kwargs: None
-    sys.path.insert(0, temp_dir)
-    # Inject custom get_user_direction
-    def get_user_direction():
-        ns = sys.modules['__main__'].__dict__
-        print(f"[DEBUG get_user_direction] Called.")
+    _prepare_student_runtime()
+    _run_student_job(child_conn, files, main_file, seed)
+
+def student_worker_loop(child_conn, max_uses):
+    """Pool worker: warm up once, then run student programs until max_uses is reached."""
+    print('[DEBUG] student_worker_loop started')
+    _prepare_student_runtime()
+    uses = 0
+    while uses < max_uses:
+        try:
+            msg = child_conn.recv()
+        except (EOFError, OSError):
+            break
+        if not isinstance(msg, tuple) or not msg:
+            continue # Stale direction or stop signal left over from the previous job
+        if msg[0] == 'shutdown':
+            break
+        if msg[0] == 'run':
+            uses += 1
+            usage = _run_student_job(child_conn, *msg[1:])
+            try:
+                child_conn.send({'done': True, 'usage': usage})
+            except (EOFError, OSError):
+                break
 
-        # Determine a fallback direction based on snake's current direction if possible
-        fallback_direction = 'RIGHT' # Default fallback
-        if 'snake' in ns:
-            snake_obj = ns['snake']
-            if hasattr(snake_obj, 'direction'):
-                # This assumes student's snake.direction is a string 'UP', 'DOWN', etc.
-                # If it's a tuple (dx, dy) or constant, this part would need adjustment
-                # or the student code would rely purely on the received direction.
-                if isinstance(snake_obj.direction, str) and snake_obj.direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
-                    fallback_direction = snake_obj.direction
+_preview_pool = None
 
-        # Send current game state
+def get_preview_pool():
+    """Return the process-wide pool of warm preview workers, creating it on first use."""
+    global _preview_pool
+    if _preview_pool is None:
+        from snake_worker_pool import SnakeWorkerPool
+        _preview_pool = SnakeWorkerPool(student_worker_loop, size=PREVIEW_POOL_SIZE,
+                                        max_uses=PREVIEW_POOL_MAX_USES)
+    return _preview_pool
+
+def _release_preview_worker(worker, job_done, sid):
+    """Stop the student's code if it is still running and give the worker back to the pool.
+
+    Returns:
+        The job's usage from the worker's 'done' message, if it arrived here
+    """
+    usage = None
+    if not job_done and worker.is_alive():
         try:
-            snake_positions = [[15,10]] # Default
-            if 'snake' in ns and hasattr(ns['snake'], 'positions'):
-                snake_positions = list(ns['snake'].positions)
-            elif 'snake' in ns and isinstance(ns['snake'], list): # Basic list of positions
-                snake_positions = ns['snake']
-
-            food_position = [20,10] # Default
-            if 'food' in ns and hasattr(ns['food'], 'position'):
-                food_position = list(ns['food'].position)
-            elif 'food' in ns and isinstance(ns['food'], (list, tuple)): # Basic list/tuple
-                food_position = list(ns['food'])
-
-            game_state = {
-                'grid_width': ns.get('GRID_WIDTH', 30),
-                'grid_height': ns.get('GRID_HEIGHT', 20),
-                'snake': snake_positions,
-                'food': food_position,
-                'score': ns.get('score', 0),
-                'game_over': ns.get('game_over', False),
-                'message_title': '', 'message_text': '', 'message_hint': ''
-            }
-            child_conn.send(game_state)
+            worker.conn.send(STOP_SIGNAL)
+            deadline = time.time() + PREVIEW_STOP_GRACE
+            while not job_done and time.time() < deadline:
+                if wait_readable(worker.conn, 0.05):
+                    msg = worker.conn.recv()
+                    job_done = isinstance(msg, dict) and msg.get('done', False)
+                    if job_done:
+                        usage = msg.get('usage')
+        except (EOFError, OSError):
+            job_done = False
+    if not job_done:
+        print(f"[DEBUG run_student_snake SID: {sid}] Worker {worker.pid} did not stop cleanly, recycling it.")
+    get_preview_pool().checkin(worker, healthy=job_done)
+    return usage
+
+# --- Shared frame scheduler for all previews ---
+# Scheduler settings
+PREVIEW_TICK = 0.05            # Seconds per shared tick (20 fps for every preview)
+PREVIEW_MAX_FRAMES = 200       # Frame budget per preview session
+PREVIEW_IDLE_TIMEOUT = 10.0    # Seconds a session may go without sending anything before it is ended
+PREVIEW_MAX_STRIDE = 4         # Slowest a session gets before it is shed (1 frame every 4 ticks)
+SCHEDULER_OVERLOAD_LOAD = 0.8  # Tick work above this fraction of the tick counts as overloaded
+SCHEDULER_CALM_LOAD = 0.4      # Tick work below this fraction counts as calm
+SCHEDULER_SLOW_AFTER = 3       # Consecutive overloaded ticks before slowing (or shedding) a session
+SCHEDULER_RECOVER_AFTER = 40   # Consecutive calm ticks before a slowed session speeds back up
+SCHEDULER_JITTER_WINDOW = 1000 # Recent ticks kept for the jitter percentiles
+
+class _PreviewSession:
+    """Scheduler bookkeeping for one running preview."""
+
+    def __init__(self, socketio, sid, worker, run_token, encoder, max_frames, phase, recorder=None):
+        self.socketio = socketio
+        self.sid = sid
+        self.worker = worker
+        self.run_token = run_token
+        self.encoder = encoder
+        self.recorder = recorder # ReplayWriter logging (direction, frame) per get_user_direction() call, if recording
+        self.max_frames = max_frames
+        self.phase = phase
+        self.stride = 1 # Served every `stride` ticks; raised when the server falls behind
+        self.frames = 0
+        self.pending_state = None # Latest state waiting for this session's next turn
+        self.pending_seq = None # Worker's get_user_direction() call number for the pending state
+        self.unrecorded_state = None # Last state whose direction the worker hasn't reported yet (replay)
+        self.pending_timing = None # Worker's (direction returned, state sent) times for the pending state
+        self.last_direction = None # Direction sent with the pending state
+        self.input_sent = None # DirectionInput delivered with this tick's direction
+        self.input_unshown = None # Input delivered last turn; the next emitted frame is the first to show it
+        self.started = self.last_message = time.monotonic()
+        self.job_done = False
+        self.usage = None # Worker-reported CPU/RSS usage, from its 'done' message
+        self.limit = None # Limit that ended the session ('cpu', 'memory', 'files', 'wall', 'idle', 'died')
+        self.outcome = None # 'finished', 'stopped', 'error', 'budget' or 'other' once the session ends
+        self.finished = threading.Event()
+
+class FrameScheduler:
+    """
+    Drives every active preview from one fixed-tick loop.
+
+    Each tick the scheduler collects the state each worker reported, then answers all of them with
+    their direction in one pass and emits all frames in a second pass. Workers block in
+    get_user_direction() until their answer arrives, so every preview advances in lockstep with
+    the shared clock. When a tick's work approaches the tick length the newest sessions are slowed
+    to every 2nd/4th tick and, if that is not enough, shed with an error.
+
+    Args:
+        tick: Seconds per tick
+        max_frames: Frame budget per session
+    """
+
+    def __init__(self, tick=PREVIEW_TICK, max_frames=PREVIEW_MAX_FRAMES):
+        self.tick = tick
+        self.max_frames = max_frames
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._next_phase = 0
+        self._hot_ticks = 0
+        self._calm_ticks = 0
+        self._jitter = collections.deque(maxlen=SCHEDULER_JITTER_WINDOW)
+        self._last_load = 0.0
+        self.counters = {
+            'ticks': 0,
+            'overruns': 0,         # Ticks whose work took longer than the tick itself
+            'skipped_ticks': 0,    # Ticks dropped because the loop fell behind
+            'frames': 0,
+            'coalesced_frames': 0, # States replaced by a newer one before they were emitted
+            'slowed': 0,
+            'recovered': 0,
+            'shed': 0,
+            'sessions': 0,
+            'inputs': 0,           # Queued inputs delivered to workers
+        }
+
+    def add(self, socketio, sid, worker, run_token, encoder=None, recorder=None):
+        """Start scheduling a preview whose worker is already running. Returns its session."""
+        with self._lock:
+            session = _PreviewSession(socketio, sid, worker, run_token, encoder, self.max_frames, self._next_phase,
+                                      recorder)
+            self._next_phase += 1
+            self._sessions[sid] = session
+            self.counters['sessions'] += 1
+            if self._thread is None:
+                self._start_thread()
+        return session
+
+    def _start_thread(self):
+        # Caller holds self._lock
+        self._thread = threading.Thread(target=self._loop, name="preview-scheduler", daemon=True)
+        self._thread.start()
+
+    def _finish(self, session, reason, outcome='other'):
+        session.outcome = session.outcome or outcome
+        with self._lock:
+            if self._sessions.get(session.sid) is session:
+                del self._sessions[session.sid]
+        print(f"[DEBUG FrameScheduler SID: {session.sid}] Session finished after {session.frames} frames: {reason}")
+        session.finished.set()
+
+    def _fail(self, session, error):
+        """End one session whose share of a tick raised; the other sessions keep running."""
+        print(f"[DEBUG FrameScheduler SID: {session.sid}] Error while serving the preview: {error!r}")
+        traceback.print_exc()
+        self._emit(session, 'preview_error', {'error': 'The server hit an internal error while running your preview. Please try again.'})
+        self._finish(session, f"internal error: {error!r}", 'error')
+
+    def _emit(self, session, event, data):
+        try:
+            session.socketio.emit(event, data, room=session.sid)
         except Exception as e:
-            # Send error if state extraction fails
-            child_conn.send({'error': f'Error in get_user_direction while extracting state: {traceback.format_exc()}'})
+            print(f"[DEBUG FrameScheduler SID: {session.sid}] Error emitting {event}: {e}")
 
-        # Wait for direction from parent process
+    def _collect(self, session, now):
+        """Read everything the worker sent since the last tick. Returns False once the session is over."""
+        conn = session.worker.conn
         try:
-            # Poll for a short time (e.g., up to 50ms, matching frame_delay)
-            # This timeout should ideally be less than or equal to frame_delay in run_student_snake
-            polled_value = child_conn.poll(0.04)
-            print(f"[DEBUG get_user_direction] child_conn.poll(0.04) result: {polled_value}")
-            if polled_value:
-                new_direction = child_conn.recv()
-                print(f"[DEBUG get_user_direction] Received new_direction: {new_direction}")
-                if new_direction in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
-                    print(f"[DEBUG get_user_direction] Returning NEWLY RECEIVED direction: {new_direction}")
-                    return new_direction
-        except EOFError: # Pipe might have been closed
-            pass # Will use fallback
-        except Exception: # Other potential errors during recv (e.g., timeout, deserialization)
-            pass # Will use fallback
-
-        print(f"[DEBUG get_user_direction] Returning FALLBACK direction: {fallback_direction}")
-        return fallback_direction
-    import builtins
-    builtins.get_user_direction = get_user_direction
-    try:
-        print('[DEBUG] student_process importing student code:', student_path)
-        spec = importlib.util.spec_from_file_location("student_main", student_path)
-        student_mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(student_mod)
-        print('[DEBUG] student_process finished student code')
-    except Exception as e:
-        child_conn.send({'error': traceback.format_exc()})
-        print('[DEBUG] error sent (importing student code):', traceback.format_exc())
+            while conn.poll(0):
+                msg = conn.recv()
+                session.last_message = now
+                if isinstance(msg, dict) and msg.get('done'):
+                    session.job_done = True
+                    session.usage = msg.get('usage')
+                    self._finish(session, "student code finished", 'finished')
+                    return False
+                if isinstance(msg, dict) and 'error' in msg:
+                    session.limit = msg.get('limit')
+                    self._emit(session, 'preview_error', {'error': msg['error'], 'limit': session.limit})
+                    self._finish(session, "student code raised an error", 'error')
+                    return False
+                timing = msg.pop('_timing', None) if isinstance(msg, dict) else None
+                seq = msg.pop('_seq', None) if isinstance(msg, dict) else None
+                used = msg.pop('_used', None) if isinstance(msg, dict) else None
+                if session.recorder is not None:
+                    self._record_frame(session, used, msg)
+                if session.pending_state is not None:
+                    self.counters['coalesced_frames'] += 1
+                if session.pending_timing is None:
+                    session.pending_timing = timing # The first state after a dispatch is the one that used it
+                session.pending_state = msg
+                session.pending_seq = seq
+                queue = input_queues.get(session.sid)
+                if queue is not None and isinstance(msg, dict):
+                    queue.observe(msg.get('direction')) # Taps are judged against where the snake really heads
+        except (EOFError, OSError):
+            self._finish(session, "worker pipe closed")
+            return False
+        if not session.worker.is_alive():
+            self._end_on_limit(session, 'died', "student process died")
+            return False
+        if now - session.last_message > PREVIEW_IDLE_TIMEOUT:
+            self._end_on_limit(session, 'idle', "no frames received")
+            return False
+        if now - session.started > PREVIEW_WALL_LIMIT:
+            self._end_on_limit(session, 'wall', "wall-time limit reached")
+            return False
+        return True
+
+    def _end_on_limit(self, session, limit, reason):
+        session.limit = limit
+        self._emit(session, 'preview_error', {'error': LIMIT_MESSAGES[limit], 'limit': limit})
+        self._finish(session, reason, 'error')
+
+    def _run_tick(self, tick_no):
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        due = []
+        for session in sessions:
+            try:
+                if active_simulations.get(session.sid) is not session.run_token:
+                    self._finish(session, "stopped or superseded", 'stopped')
+                elif self._collect(session, now) and session.pending_state is not None \
+                        and (tick_no + session.phase) % session.stride == 0:
+                    due.append(session)
+            except Exception as e:
+                self._fail(session, e)
+        # Batched dispatch: release every worker waiting in get_user_direction() this tick
+        for session in due:
+            try:
+                self._dispatch(session)
+            except Exception as e:
+                self._fail(session, e)
+        # Batched emit: one frame per served session
+        for session in due:
+            if session.finished.is_set():
+                continue
+            try:
+                self._emit_frame(session)
+            except Exception as e:
+                self._fail(session, e)
+
+    def _dispatch(self, session):
+        """Answer the worker waiting in get_user_direction() with this tick's direction."""
+        queue = input_queues.get(session.sid)
+        session.input_sent = queue.next() if queue is not None else None # One queued input per tick
+        session.last_direction = queue.heading if queue is not None else 'RIGHT'
+        if session.input_sent is not None:
+            session.input_sent.dispatched = time.monotonic()
+            self.counters['inputs'] += 1
+        try:
+            # Tagged with the call it answers; the worker drops answers that arrive after its fallback
+            session.worker.conn.send((session.pending_seq, session.last_direction))
+        except (EOFError, OSError):
+            self._finish(session, "worker pipe closed")
+
+    def _emit_frame(self, session):
+        """Record, encode and emit the session's pending state."""
+        state, session.pending_state = session.pending_state, None
+        session.frames += 1
+        self.counters['frames'] += 1
+        data = session.encoder.encode(state) if session.encoder is not None else dict(state)
+        timing, session.pending_timing = session.pending_timing, None
+        shown, session.input_unshown = session.input_unshown, session.input_sent
+        session.input_sent = None
+        if shown is not None:
+            # Echo the client's timestamp so the page can measure input-to-render on its own clock
+            server_ms = self._record_input_latency(session, shown, timing)
+            data['input'] = {'t': shown.client_time, 'direction': shown.direction, 'server_ms': server_ms}
+        self._emit(session, 'game_frame' if session.encoder is not None else 'game_state_update', data)
+        if session.frames >= session.max_frames:
+            self._finish(session, "frame budget reached", 'budget')
+
+    def _record_frame(self, session, used, state):
+        """
+        Log the previous state with the direction the worker reports it actually returned for it
+        (the scheduler's answer, or its fallback if the answer came too late), then hold on to this one.
+        Every state is logged, including ones coalesced away before they were emitted.
+        """
+        previous, session.unrecorded_state = session.unrecorded_state, state
+        if previous is None:
+            return
+        try:
+            session.recorder.record(used, previous)
+        except OSError as e:
+            self._stop_recording(session, e)
+
+    def _stop_recording(self, session, error):
+        """Drop a session's replay after a write failed (e.g. full disk); the preview itself goes on."""
+        print(f"[DEBUG FrameScheduler SID: {session.sid}] Replay recording stopped: {error}")
+        recorder, session.recorder = session.recorder, None
+        try:
+            recorder.close('other')
+        except OSError:
+            pass
 
-def run_student_snake(socketio, sid, files, pre_determined_echo_level=None):
+    def _record_input_latency(self, session, shown, timing):
+        """Add an input's server-side stages (see preview_latency.py) to the histograms. Returns the server ms."""
+        emitted = time.monotonic()
+        samples = {
+            'queue': (shown.dispatched - shown.received) * 1000,
+            'server': (emitted - shown.received) * 1000,
+        }
+        if timing is not None:
+            returned, sent = timing
+            samples['to_worker'] = (returned - shown.dispatched) * 1000
+            samples['student'] = (sent - returned) * 1000
+            samples['to_emit'] = (emitted - sent) * 1000
+        get_latency_tracker().record(session.sid, samples)
+        return round(samples['server'], 1)
+
+    def _adapt(self, work):
+        """Slow, shed or speed sessions back up depending on how much of the tick the work used."""
+        self._last_load = load = work / self.tick
+        if load > SCHEDULER_OVERLOAD_LOAD:
+            self._hot_ticks += 1
+            self._calm_ticks = 0
+        elif load < SCHEDULER_CALM_LOAD:
+            self._calm_ticks += 1
+            self._hot_ticks = 0
+        if self._hot_ticks >= SCHEDULER_SLOW_AFTER:
+            self._hot_ticks = 0
+            with self._lock:
+                newest_first = list(reversed(self._sessions.values()))
+            slowable = [s for s in newest_first if s.stride < PREVIEW_MAX_STRIDE]
+            if slowable:
+                slowable[0].stride *= 2
+                self.counters['slowed'] += 1
+                print(f"[DEBUG FrameScheduler SID: {slowable[0].sid}] Server behind (load {load:.2f}), "
+                      f"serving every {slowable[0].stride} ticks")
+            elif newest_first:
+                victim = newest_first[0]
+                self.counters['shed'] += 1
+                self._emit(victim, 'preview_error', {'error': 'The server is too busy to run this preview right now. Please try again in a moment.'})
+                self._finish(victim, f"shed under load ({load:.2f})")
+        elif self._calm_ticks >= SCHEDULER_RECOVER_AFTER:
+            self._calm_ticks = 0
+            with self._lock:
+                slowed = [s for s in self._sessions.values() if s.stride > 1]
+            if slowed:
+                slowed[0].stride //= 2
+                self.counters['recovered'] += 1
+
+    def _loop(self):
+        try:
+            tick_no = 0
+            next_tick = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._sessions:
+                        self._thread = None
+                        return
+                start = time.monotonic()
+                self._jitter.append(start - next_tick)
+                self._run_tick(tick_no)
+                work = time.monotonic() - start
+                self.counters['ticks'] += 1
+                if work > self.tick:
+                    self.counters['overruns'] += 1
+                self._adapt(work)
+                tick_no += 1
+                next_tick += self.tick
+                behind = time.monotonic() - next_tick
+                if behind > 0:
+                    # Don't try to catch up with a burst of ticks; drop the missed ones
+                    missed = int(behind // self.tick) + 1
+                    self.counters['skipped_ticks'] += missed
+                    next_tick += missed * self.tick
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+        except Exception as e:
+            # Outside any one session (e.g. _adapt): end them all rather than leave their runs waiting
+            print(f"[DEBUG FrameScheduler] Scheduler loop failed: {e!r}")
+            with self._lock:
+                sessions = list(self._sessions.values())
+            for session in sessions:
+                self._fail(session, e)
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                    if self._sessions: # Added while this loop was failing
+                        self._start_thread()
+
+    def get_stats(self):
+        """Counters plus jitter (ms) over the recent ticks and current session strides."""
+        with self._lock:
+            strides = {sid: s.stride for sid, s in self._sessions.items()}
+        jitter = sorted(self._jitter)
+        stats = dict(self.counters)
+        stats.update({
+            'tick_ms': round(self.tick * 1000, 2),
+            'active_sessions': len(strides),
+            'slowed_sessions': sum(1 for stride in strides.values() if stride > 1),
+            'last_load': round(self._last_load, 3),
+            'jitter_ms_mean': round(1000 * sum(jitter) / len(jitter), 3) if jitter else None,
+            'jitter_ms_p99': round(1000 * jitter[min(len(jitter) - 1, int(len(jitter) * 0.99))], 3) if jitter else None,
+            'jitter_ms_max': round(1000 * jitter[-1], 3) if jitter else None,
+        })
+        return stats
+
+_latency_tracker = None
+
+def get_latency_tracker():
+    """Return the process-wide input-to-frame latency histograms, creating them on first use."""
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = LatencyTracker()
+    return _latency_tracker
+
+_usage_accounting = None
+
+def get_usage_accounting():
+    """Return the process-wide per-session CPU/RSS accounting, creating it on first use."""
+    global _usage_accounting
+    if _usage_accounting is None:
+        # Next to the user records (persistent_storage's directory), not wherever the process was started
+        log_path = os.path.join(storage.storage_dir, PREVIEW_USAGE_LOG) if PREVIEW_USAGE_LOG else None
+        _usage_accounting = UsageAccounting(log_path)
+    return _usage_accounting
+
+_frame_scheduler = None
+
+def get_frame_scheduler():
+    """Return the process-wide preview frame scheduler, creating it on first use."""
+    global _frame_scheduler
+    if _frame_scheduler is None:
+        _frame_scheduler = FrameScheduler()
+    return _frame_scheduler
+
+def run_student_snake(socketio, sid, files, pre_determined_echo_level=None, frame_protocol=0, replay_dir=None):
     """
-    Run the student's snake code in a subprocess, capturing game state as JSON after each frame.
-    Inject a custom get_user_direction() that sends state to the parent process after each frame.
+    Run the student's snake code in a pooled worker process, capturing game state as JSON after each frame.
+    The worker's get_user_direction() sends state to the parent process after each frame; the shared
+    FrameScheduler emits it and answers with the client's direction on the next tick.
     On error, send error state to the client. All file/echo handling is dynamic and global.
+
+    With frame_protocol >= 1 the state is sent as 'game_frame' keyframes/deltas (see snake_frames.py)
+    instead of a full 'game_state_update' per frame. With a replay_dir the session's seed, inputs and
+    frame checksums are recorded there (see snake_replay.py).
     """
-    import sys, importlib.util, traceback, time, multiprocessing, os, tempfile, shutil, json
-    temp_dir = None
-    proc = None
+    import sys, traceback, time, os, json
+    worker = None
+    job_done = False
+    run_token = object() # Identifies this run in active_simulations so a restart can supersede it
+    encoder = FrameEncoder() if frame_protocol >= 1 else None
+    if pre_determined_echo_level is None:
+        pre_determined_echo_level = _determine_echo_level(files)
+    recorder = None
+    session = None
+    seed = random.SystemRandom().getrandbits(63) # Seeds the worker's `random` so the run can be replayed
     try:
-        # --- PATCH: Enforce headless Pygame and suppress window creation ---
-        os.environ["SDL_VIDEODRIVER"] = "dummy"
-        import pygame
-        pygame.display.set_mode = lambda *args, **kwargs: pygame.Surface((640, 480))
-        pygame.display.flip = lambda *args, **kwargs: None
-        # ---------------------------------------------------------------
-
-        # Setup: create a temp directory for the student's files
-        temp_dir = tempfile.mkdtemp(prefix=f"snake_{sid}_")
-        sys.path.insert(0, temp_dir)
-        for filename, content in files.items():
-            with open(os.path.join(temp_dir, filename), 'w', encoding='utf-8') as f:
-                f.write(content)
+        # The worker imports the files from memory (student_imports.StudentFiles)
         main_file = 'snake.py' if 'snake.py' in files else 'main.py'
-        student_path = os.path.join(temp_dir, main_file)
-
-        # Use multiprocessing Pipe for communication
-        parent_conn, child_conn = multiprocessing.Pipe()
-
-        # Start the student process (now top-level)
-        active_simulations[sid] = True # Set before starting process
-        print(f"[DEBUG run_student_snake SID: {sid}] Set active_simulations[{sid}] to True.")
-        proc = multiprocessing.Process(target=student_process, args=(child_conn, temp_dir, student_path))
-        proc.start()
-        max_frames = 200
-        frame_delay = 0.05
-        for _ in range(max_frames):
-            if parent_conn.poll(timeout=frame_delay * 2):
-                msg = parent_conn.recv()
-                if isinstance(msg, dict) and 'error' in msg:
-                    socketio.emit('preview_error', {'error': msg['error']}, room=sid)
-                    break
-                else:
-                    socketio.emit('game_state_update', msg, room=sid)
-
-                # Send the current direction from client_inputs to the student_process
-                # Default to 'RIGHT' if no input has been registered for the session yet
-                print(f"[DEBUG run_student_snake SID: {sid}] --- Loop Iteration Start ---")
-                print(f"[DEBUG run_student_snake SID: {sid}] Checking client_inputs. Key '{sid}' exists: {sid in client_inputs}")
-                print(f"[DEBUG run_student_snake SID: {sid}] Value for client_inputs.get('{sid}'): {client_inputs.get(sid)}")
-                print(f"[DEBUG run_student_snake SID: {sid}] Full client_inputs dictionary: {client_inputs}")
-                current_input = client_inputs.get(sid, 'RIGHT')
-                print(f"[DEBUG run_student_snake SID: {sid}] Sending to student_process direction: {current_input}")
-                parent_conn.send(current_input)
-            if not proc.is_alive():
-                print(f"[DEBUG run_student_snake SID: {sid}] Student process died. Exiting loop.")
-                break
+
+        # Check out a warm worker (pygame already imported, get_user_direction installed)
+        active_simulations[sid] = run_token # Set before starting the job
+        if encoder is not None:
+            frame_encoders[sid] = encoder
+        print(f"[DEBUG run_student_snake SID: {sid}] Marked active_simulations[{sid}] as active.")
+        worker = get_preview_pool().checkout()
+        input_queues[sid] = InputQueue() # Keys pressed during an earlier run don't carry over
+        worker.start_job(files, main_file, seed)
+        if replay_dir:
+            try:
+                save_files_snapshot(replay_dir, files)
+                replay_name = f"{time.strftime('%Y%m%d-%H%M%S')}_{sid[:8]}{REPLAY_EXTENSION}"
+                recorder = ReplayWriter(os.path.join(replay_dir, replay_name), seed, files)
+            except OSError as e:
+                print(f"[DEBUG run_student_snake SID: {sid}] Could not start replay recording: {e}")
+        # The shared scheduler exchanges frames and directions with the worker from here on
+        scheduler = get_frame_scheduler()
+        session = scheduler.add(socketio, sid, worker, run_token, encoder, recorder)
+        # The scheduler ends every session by the wall limit; past that it has stalled, so don't hold the worker
+        if not session.finished.wait(PREVIEW_WALL_LIMIT + PREVIEW_STOP_GRACE):
+            scheduler._end_on_limit(session, 'wall', "no end from the scheduler by the wall-time limit")
+        job_done = session.job_done
     except Exception as e: # Catch broader exceptions during setup/loop
         socketio.emit('preview_error', {'error': f'Internal error in run_student_snake: {traceback.format_exc()}'}, room=sid)
         print(f"[ERROR run_student_snake SID: {sid}] Exception: {e}")
         traceback.print_exc()
     finally:
         print(f"[DEBUG run_student_snake SID: {sid}] Finalizing and cleaning up in run_student_snake.")
-        if proc and proc.is_alive():
-            print(f"[DEBUG run_student_snake SID: {sid}] Terminating student process {proc.pid if hasattr(proc, 'pid') else 'N/A'}.")
-            proc.terminate()
-            proc.join(timeout=0.5)
-        if temp_dir and os.path.exists(temp_dir):
+        if session is not None:
+            recorder = session.recorder # None if the scheduler stopped recording
+        if recorder is not None:
             try:
-                shutil.rmtree(temp_dir)
-                print(f"[DEBUG run_student_snake SID: {sid}] Removed temp dir: {temp_dir}")
-            except Exception as e:
-                print(f"[DEBUG run_student_snake SID: {sid}] Error removing temp dir {temp_dir}: {e}")
+                recorder.close(session.outcome if session is not None and session.outcome else 'other')
+                print(f"[DEBUG run_student_snake SID: {sid}] Replay saved: {recorder.path} ({recorder.frames} frames)")
+            except OSError as e:
+                print(f"[DEBUG run_student_snake SID: {sid}] Could not finish replay {recorder.path}: {e}")
+        usage = None
+        if worker is not None:
+            usage = _release_preview_worker(worker, job_done, sid)
+        if session is not None:
+            usage = session.usage or usage
+            get_usage_accounting().record({
+                'sid': sid,
+                'echo_level': pre_determined_echo_level,
+                'frames': session.frames,
+                'outcome': session.outcome,
+                'limit': session.limit,
+                'cpu_seconds': usage.get('cpu_seconds') if usage else None,
+                'wall_seconds': usage.get('wall_seconds') if usage else round(time.monotonic() - session.started, 3),
+                'peak_rss_kb': usage.get('peak_rss_kb') if usage else None,
+            })
 
-        if sid in active_simulations: # Use student_driven_snake.active_simulations
+        # Only clear the session state if a newer run has not taken over this SID
+        if active_simulations.get(sid) is run_token:
             print(f"[DEBUG run_student_snake SID: {sid}] Setting active_simulations[{sid}] to False in finally block.")
             active_simulations[sid] = False # Global from student_driven_snake.py
-        if sid in client_inputs: # Use student_driven_snake.client_inputs
-            print(f"[DEBUG run_student_snake SID: {sid}] Deleting client_inputs[{sid}] in finally block.")
-            del client_inputs[sid] # Global from student_driven_snake.py
+            if sid in input_queues:
+                print(f"[DEBUG run_student_snake SID: {sid}] Deleting input_queues[{sid}] in finally block: {input_queues[sid].counters}")
+                del input_queues[sid] # Global from student_driven_snake.py
+        if encoder is not None and frame_encoders.get(sid) is encoder:
+            del frame_encoders[sid]
+            print(f"[DEBUG run_student_snake SID: {sid}] Frames sent: {encoder.counters}")
 
 # --- Standalone gameplay code below ---
 # This code is only used when running the file directly (not when imported)
@@ -0,0 +1,114 @@
+"""
+student_imports.py - Import student modules straight from the submitted files dict.
+
+Previews used to write every file into a temp directory, push it onto sys.path and delete it
+afterwards. StudentFiles is a meta-path finder/loader over the {filename: source} dict
+instead: while it is installed, `import constants` or `from snake_class import Snake` load
+the student's constants.py / snake_class.py from memory. Code is compiled with the bare
+filename and the source is registered with linecache, so tracebacks still show
+"snake_class.py", line 12 and the offending line.
+
+    with StudentFiles(files) as student_files:
+        module = student_files.new_module('snake.py', 'student_main')
+        student_files.exec_file('snake.py', module.__dict__)
+
+Uninstalling forgets every module it loaded, so the next job in a pooled worker imports
+its own constants instead of the previous student's.
+"""
+import importlib.abc
+import importlib.util
+import linecache
+import marshal
+import sys
+import types
+
+
+class StudentFiles(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """
+    Serves the .py files of one submission as top-level modules.
+
+    Args:
+        files: {filename: source} dict
+        code_blobs: Optional {filename: marshaled code} from the parent's compile cache
+    """
+
+    def __init__(self, files, code_blobs=None):
+        self.files = {name: src for name, src in files.items() if isinstance(src, str)}
+        self.code_blobs = code_blobs or {}
+        self._modules = {name[:-3]: name for name in self.files if name.endswith('.py') and name[:-3].isidentifier()}
+        self._loaded = set()
+        self._installed = False
+
+    # --- Finder / loader protocol ---
+    def find_spec(self, fullname, path=None, target=None):
+        filename = self._modules.get(fullname) if path is None else None # Top-level modules only
+        if filename is None:
+            return None
+        spec = importlib.util.spec_from_loader(fullname, self, origin=filename)
+        spec.has_location = True # Sets module.__file__ to the student's filename
+        return spec
+
+    def create_module(self, spec):
+        return None # Default module creation
+
+    def exec_module(self, module):
+        filename = self._modules[module.__name__]
+        self._loaded.add(module.__name__)
+        self.exec_file(filename, module.__dict__)
+
+    def get_source(self, fullname):
+        filename = self._modules.get(fullname)
+        return self.files.get(filename) if filename else None
+
+    # --- Running files ---
+    def get_code(self, filename):
+        """Code object for one file (from the shipped blob when there is one). Raises SyntaxError."""
+        blob = self.code_blobs.get(filename)
+        if blob:
+            return marshal.loads(blob)
+        return compile(self.files[filename], filename, 'exec')
+
+    def exec_file(self, filename, namespace):
+        """Execute one file in `namespace` (a module's __dict__ or a shared env dict)."""
+        exec(self.get_code(filename), namespace)
+
+    def new_module(self, filename, name):
+        """Empty module for running a file as a script (e.g. the main file as 'student_main')."""
+        module = types.ModuleType(name)
+        module.__file__ = filename
+        module.__loader__ = self
+        return module
+
+    # --- Installation ---
+    def install(self):
+        if self._installed:
+            return self
+        for filename, source in self.files.items():
+            # mtime None: linecache.checkcache() keeps the entry although no such file exists
+            linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        sys.meta_path.insert(0, self)
+        self._installed = True
+        return self
+
+    def uninstall(self):
+        if not self._installed:
+            return
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        for name in self._loaded:
+            module = sys.modules.get(name)
+            if module is not None and getattr(module, '__loader__', None) is self:
+                del sys.modules[name]
+        self._loaded.clear()
+        for filename in self.files:
+            entry = linecache.cache.get(filename)
+            if entry is not None and entry[1] is None:
+                del linecache.cache[filename]
+        self._installed = False
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+        return False
@@ -0,0 +1,25 @@
+import grading_sandbox
+from compile_cache import CompileCache
+
+# Parses fine but overflows the compiler's recursion limit (RecursionError, not SyntaxError)
+DEEPLY_NESTED = "x = " + "+".join(["1"] * 100000) + "\n"
+
+
+def test_uncompilable_input_is_cached_as_an_error():
+    cache = CompileCache()
+    assert cache.marshaled(DEEPLY_NESTED, "<string>") is None
+    assert cache.marshaled(DEEPLY_NESTED, "<string>") is None
+    assert cache.get_stats()['hits'] == 1
+    assert cache.disassemble(DEEPLY_NESTED, "<string>").startswith("Compilation error")
+
+
+def test_deeply_nested_submission_is_a_grading_error():
+    sandbox = grading_sandbox.GradingSandbox(size=1)
+    try:
+        result, _output, error, _line = sandbox.submit_single(DEEPLY_NESTED, "x").result(timeout=30)
+        assert result is None
+        assert error
+        result, _output, error, _line = sandbox.submit_snake({'snake.py': DEEPLY_NESTED}, "x").result(timeout=30)
+        assert error
+    finally:
+        sandbox.shutdown()
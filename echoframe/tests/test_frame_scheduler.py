@@ -0,0 +1,154 @@
+import multiprocessing
+
+import student_driven_snake as sds
+
+STATE = {'snake': [[15, 15]], 'food': [3, 4], 'score': 0, 'game_over': False, 'direction': 'RIGHT'}
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, room=None):
+        self.emitted.append((room, event, data))
+
+
+class FakeWorker:
+    """Parent end of a pipe whose child end the test writes states into"""
+
+    def __init__(self):
+        self.conn, self.child = multiprocessing.Pipe()
+
+    def is_alive(self):
+        return True
+
+
+class BrokenEncoder:
+    def encode(self, state):
+        raise ValueError("bad frame")
+
+
+def _start(scheduler, socketio, sid, encoder=None):
+    worker = FakeWorker()
+    token = sds.active_simulations[sid] = object()
+    session = scheduler.add(socketio, sid, worker, token, encoder)
+    worker.child.send(dict(STATE))
+    return session, worker
+
+
+def test_failing_session_does_not_stop_the_scheduler():
+    scheduler = sds.FrameScheduler(tick=0.01, max_frames=3)
+    socketio = FakeSocketIO()
+    broken, _ = _start(scheduler, socketio, 'broken-sid', BrokenEncoder())
+    healthy, worker = _start(scheduler, socketio, 'healthy-sid')
+
+    assert broken.finished.wait(2)
+    assert broken.outcome == 'error'
+    assert ('broken-sid', 'preview_error') in [(room, event) for room, event, _ in socketio.emitted]
+    for _ in range(3): # The other session keeps getting served
+        assert worker.child.poll(2)
+        worker.child.recv()
+        worker.child.send(dict(STATE))
+    assert healthy.finished.wait(2)
+    assert healthy.outcome == 'budget'
+    for sid in ('broken-sid', 'healthy-sid'):
+        sds.drop_session(sid)
+
+
+def test_scheduler_restarts_after_its_loop_fails(monkeypatch):
+    scheduler = sds.FrameScheduler(tick=0.01, max_frames=5)
+    socketio = FakeSocketIO()
+
+    def fail(work):
+        raise RuntimeError("adapt failed")
+
+    monkeypatch.setattr(scheduler, '_adapt', fail)
+    first, _ = _start(scheduler, socketio, 'first-sid')
+    assert first.finished.wait(2)
+    assert first.outcome == 'error'
+
+    monkeypatch.undo()
+    scheduler.max_frames = 1
+    second, worker = _start(scheduler, socketio, 'second-sid')
+    assert worker.child.poll(2) # A new loop picked up the new session
+    assert second.finished.wait(2)
+    assert second.outcome == 'budget'
+    for sid in ('first-sid', 'second-sid'):
+        sds.drop_session(sid)
+
+
+class FullDiskRecorder:
+    path = 'full.efr'
+    frames = 0
+
+    def __init__(self):
+        self.closed = False
+
+    def record(self, direction, state):
+        raise OSError(28, "No space left on device")
+
+    def close(self, reason='other'):
+        self.closed = True
+        raise OSError(28, "No space left on device")
+
+
+def test_replay_write_error_only_stops_recording():
+    scheduler = sds.FrameScheduler(tick=0.01, max_frames=2)
+    socketio = FakeSocketIO()
+    worker = FakeWorker()
+    recorder = FullDiskRecorder()
+    token = sds.active_simulations['recorded-sid'] = object()
+    session = scheduler.add(socketio, 'recorded-sid', worker, token, recorder=recorder)
+    worker.child.send(dict(STATE, _seq=1, _used=None))
+    assert worker.child.poll(2)
+    worker.child.recv()
+    worker.child.send(dict(STATE, _seq=2, _used='RIGHT')) # The first frame is logged now, and fails
+    assert session.finished.wait(2)
+    assert session.outcome == 'budget' # Both frames were still emitted
+    assert session.recorder is None and recorder.closed
+    sds.drop_session('recorded-sid')
+
+
+class ListRecorder:
+    def __init__(self):
+        self.frames = []
+
+    def record(self, direction, state):
+        self.frames.append((direction, state['score']))
+
+
+def test_replay_logs_the_direction_the_worker_used():
+    scheduler = sds.FrameScheduler(tick=0.01, max_frames=10)
+    socketio = FakeSocketIO()
+    worker = FakeWorker()
+    recorder = ListRecorder()
+    token = sds.active_simulations['seq-sid'] = object()
+    scheduler.add(socketio, 'seq-sid', worker, token, recorder=recorder)
+    worker.child.send(dict(STATE, score=1, _seq=1, _used=None))
+    assert worker.child.poll(2)
+    assert worker.child.recv() == (1, 'RIGHT') # The answer names the call it answers
+    # The worker gave up waiting before that answer and used its fallback for call 1
+    worker.child.send(dict(STATE, score=2, _seq=2, _used='UP'))
+    assert worker.child.poll(2)
+    assert worker.child.recv() == (2, 'RIGHT')
+    assert recorder.frames == [('UP', 1)]
+    sds.stop_student_snake('seq-sid')
+    sds.drop_session('seq-sid')
+
+
+def test_late_answer_is_dropped_by_the_worker(monkeypatch):
+    parent, child = multiprocessing.Pipe()
+    monkeypatch.setattr(sds, 'PREVIEW_DIRECTION_WAIT', 0.05)
+    monkeypatch.setattr(sds, '_job_conn', child)
+    monkeypatch.setattr(sds, '_job_namespace', {})
+    monkeypatch.setattr(sds, '_direction_seq', 0)
+    monkeypatch.setattr(sds, '_last_direction', None)
+
+    assert sds._student_get_user_direction() == 'RIGHT' # No answer in time: fallback
+    parent.send((1, 'UP')) # The answer to call 1 arrives late
+    parent.send((2, 'DOWN'))
+    assert sds._student_get_user_direction() == 'DOWN'
+    first, second = parent.recv(), parent.recv()
+    assert (first['_seq'], first['_used']) == (1, None)
+    assert (second['_seq'], second['_used']) == (2, 'RIGHT')
+    assert not child.poll(0) # The stale answer was consumed, not left for the next call
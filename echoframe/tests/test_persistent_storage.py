@@ -0,0 +1,100 @@
+import threading
+import time
+
+from persistent_storage import JsonFileBackend, PersistentStorage, merge_changes
+
+
+class SlowCopy:
+    """Makes the load's copy of the record slow, widening any gap between reading and caching it"""
+
+    def __deepcopy__(self, memo):
+        time.sleep(0.02)
+        return self
+
+
+class SlowReadBackend(JsonFileBackend):
+    """Signals when a read starts and returns a record that is slow to copy"""
+
+    def __init__(self, storage_dir):
+        super().__init__(storage_dir)
+        self.reading = threading.Event()
+
+    def read(self, username):
+        data = super().read(username)
+        if data is not None:
+            data['slow'] = SlowCopy()
+        self.reading.set()
+        return data
+
+
+def test_save_during_load_is_not_lost(tmp_path):
+    for i in range(20):
+        backend = SlowReadBackend(str(tmp_path))
+        storage = PersistentStorage(str(tmp_path), backend=backend, flush_interval=60)
+        username = f"user{i}"
+        backend.write(username, {'xp': 0})
+
+        loader = threading.Thread(target=storage.load_user_data, args=(username,))
+        loader.start()
+        assert backend.reading.wait(5)
+        storage.save_user_data(username, {'xp': 100}) # Queues behind the load's user lock
+        loader.join()
+
+        assert storage.load_user_data(username) == {'xp': 100}
+        assert username in storage.unflushed_users()
+        storage.flush()
+        assert JsonFileBackend(str(tmp_path)).read(username) == {'xp': 100}
+
+
+def test_eviction_writes_dirty_record(tmp_path):
+    storage = PersistentStorage(str(tmp_path), cache_size=1, flush_interval=60)
+    storage.save_user_data('alice', {'xp': 1})
+    storage.save_user_data('bob', {'xp': 2}) # Evicts alice, which must be written
+    assert storage.backend.read('alice') == {'xp': 1}
+    assert storage.load_user_data('alice') == {'xp': 1}
+
+
+def _pet_saves(tmp_path, username, **changes):
+    """What slith_pet.py does: read-modify-write the record through its own backend"""
+    time.sleep(0.05) # Distinct file mtime, the JSON backend's version
+    pet_backend = JsonFileBackend(str(tmp_path))
+    data = pet_backend.read(username)
+    data.update(changes)
+    pet_backend.write(username, data)
+
+
+def test_flush_keeps_a_save_from_another_process(tmp_path):
+    storage = PersistentStorage(str(tmp_path), flush_interval=60)
+    storage.save_user_data('alice', {'xp': 1, 'pet': {'hunger': 5}})
+    storage.flush()
+    data = storage.load_user_data('alice')
+    data['xp'] = 2
+    storage.save_user_data('alice', data) # Dirty in the cache
+
+    _pet_saves(tmp_path, 'alice', pet={'hunger': 0})
+    storage.flush()
+    assert JsonFileBackend(str(tmp_path)).read('alice') == {'xp': 2, 'pet': {'hunger': 0}}
+    assert storage.get_stats()['rebases'] == 1
+
+
+def test_load_of_a_dirty_record_sees_another_process_save(tmp_path):
+    storage = PersistentStorage(str(tmp_path), flush_interval=60)
+    storage.save_user_data('alice', {'xp': 1, 'old': True})
+    storage.flush()
+    storage.save_user_data('alice', {'xp': 2}) # Drops 'old'
+
+    _pet_saves(tmp_path, 'alice', pet={'hunger': 0})
+    assert storage.load_user_data('alice') == {'xp': 2, 'pet': {'hunger': 0}}
+    assert 'alice' in storage.unflushed_users()
+    storage.flush()
+    assert JsonFileBackend(str(tmp_path)).read('alice') == {'xp': 2, 'pet': {'hunger': 0}}
+
+
+def test_merge_changes():
+    base = {'xp': 1, 'pet': 1, 'gone': 1}
+    stored = {'xp': 5, 'pet': 2, 'gone': 1, 'new': 1}
+    ours = {'xp': 3, 'pet': 1, 'mine': 1}
+    merged, conflicts = merge_changes(stored, base, ours)
+    assert merged == {'xp': 3, 'pet': 2, 'new': 1, 'mine': 1}
+    assert conflicts == ['xp']
+    assert merge_changes(stored, None, ours)[0] == {'xp': 3, 'pet': 1, 'gone': 1, 'new': 1, 'mine': 1}
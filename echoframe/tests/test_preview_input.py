@@ -0,0 +1,60 @@
+import student_driven_snake as sds
+from snake_input import InputQueue
+
+
+def test_input_without_a_running_preview_is_dropped():
+    assert sds.handle_direction_input('idle-sid', 'UP') is False
+    assert 'idle-sid' not in sds.input_queues
+
+
+def test_drop_session_frees_input_state():
+    sid = 'running-sid'
+    sds.active_simulations[sid] = object() # What run_student_snake sets up before starting the job
+    sds.input_queues[sid] = InputQueue()
+    assert sds.handle_direction_input(sid, 'UP', 12.5) is True
+    assert len(sds.input_queues[sid]) == 1
+
+    sds.stop_student_snake(sid)
+    assert sds.handle_direction_input(sid, 'DOWN') is False # Stopped: nothing is consuming input
+
+    sds.drop_session(sid)
+    assert sid not in sds.input_queues
+    assert sid not in sds.active_simulations
+
+
+def test_taps_are_judged_against_the_reported_direction():
+    queue = InputQueue()
+    assert queue.push('UP')
+    assert queue.next().direction == 'UP'
+    queue.observe('RIGHT') # The student's code ignored the tap: the snake still heads right
+    assert queue.push('DOWN') # Not a reversal of the ignored UP
+    assert not queue.push('UP') # But queued DOWN, UP is
+    queue.observe(None) # States without a snake direction leave the heading alone
+    assert queue.heading == 'RIGHT'
+
+
+def test_scheduler_reports_the_snake_direction_to_the_queue():
+    import multiprocessing
+
+    class Worker:
+        conn, child = multiprocessing.Pipe()
+
+        def is_alive(self):
+            return True
+
+    class SocketIO:
+        def emit(self, event, data, room=None):
+            pass
+
+    sid = 'heading-sid'
+    token = sds.active_simulations[sid] = object()
+    sds.input_queues[sid] = InputQueue()
+    worker = Worker()
+    scheduler = sds.FrameScheduler(tick=0.01, max_frames=1)
+    session = scheduler.add(SocketIO(), sid, worker, token)
+    worker.child.send({'snake': [[1, 1]], 'direction': 'UP', '_seq': 1, '_used': None})
+    assert worker.child.poll(2)
+    assert worker.child.recv() == (1, 'UP') # The heading handed back is the snake's own
+    assert session.finished.wait(2)
+    assert sds.input_queues[sid].heading == 'UP'
+    sds.drop_session(sid)
@@ -0,0 +1,114 @@
+import json
+import os
+from concurrent.futures import Future
+
+import pytest
+
+import grading_sandbox
+from grading_sandbox import execute_snake_behavior, grade_snake_behavior
+from snake_behavior import scenarios_for
+
+ECHOFRAME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _snakedebug_files():
+    debug_dir = os.path.join(ECHOFRAME_DIR, 'snakedebug')
+    files = {}
+    for filename in sorted(os.listdir(debug_dir)):
+        if filename.endswith('.py'):
+            with open(os.path.join(debug_dir, filename), 'r', encoding='utf-8') as f:
+                files[filename] = f.read()
+    return files
+
+
+def _behavior_quests():
+    with open(os.path.join(ECHOFRAME_DIR, 'snake_quests.json'), 'r', encoding='utf-8') as f:
+        return [quest for quest in json.load(f) if quest.get('behavior')]
+
+
+SNAKEDEBUG = _snakedebug_files()
+QUESTS = _behavior_quests()
+SCENARIOS = {scenario['name']: scenario for quest in QUESTS for scenario in scenarios_for(quest)}
+
+
+def mutant(*replacements):
+    """snakedebug with (filename, old, new) replacements applied"""
+    files = dict(SNAKEDEBUG)
+    for filename, old, new in replacements:
+        assert old in files[filename], old
+        files[filename] = files[filename].replace(old, new)
+    return files
+
+
+# A student without any reversal check: neither snake.py's key handling nor change_direction() filters
+NO_REVERSAL = mutant(
+    ('snake_class.py', """        if (new_direction == 'UP' and self.direction != 'DOWN') or \\
+           (new_direction == 'DOWN' and self.direction != 'UP') or \\
+           (new_direction == 'LEFT' and self.direction != 'RIGHT') or \\
+           (new_direction == 'RIGHT' and self.direction != 'LEFT'):
+            self.direction = new_direction""", "        self.direction = new_direction"),
+    *[('snake.py', f" and current_direction != '{opposite}'", '') for opposite in ('DOWN', 'UP', 'RIGHT', 'LEFT')],
+)
+NEVER_MOVES = mutant(('snake_class.py', "    def update(self):\n", "    def update(self):\n        return\n"))
+# Game over one cell past each wall
+WALL_OFF_BY_ONE = mutant(
+    ('snake_class.py', "head_x < 0 or head_x >= GRID_WIDTH or head_y < 0 or head_y >= GRID_HEIGHT",
+     "head_x < -1 or head_x > GRID_WIDTH or head_y < -1 or head_y > GRID_HEIGHT"),
+)
+
+
+@pytest.mark.parametrize('name', list(SCENARIOS))
+def test_snakedebug_passes(name):
+    ticks, _debug, err, _err_line = execute_snake_behavior(SNAKEDEBUG, SCENARIOS[name])
+    assert err is None
+    assert int(ticks) > 0
+
+
+@pytest.mark.parametrize('files,name,message', [
+    (NO_REVERSAL, 'no reversing', "failed at tick 2: the head should be at (17, 15), but it is at (15, 15)."),
+    (NEVER_MOVES, 'moves right', "failed at tick 2: the head should be at (16, 15), but it is at (15, 15)."),
+    (WALL_OFF_BY_ONE, 'hits the top wall',
+     "failed at tick 16: game_over should be True (the snake hit a wall or itself), but it is False."),
+], ids=['no reversal', 'never moves', 'wall off by one'])
+def test_mutant_fails(files, name, message):
+    _ticks, _debug, err, _err_line = execute_snake_behavior(files, SCENARIOS[name])
+    assert err == f"Behavior check '{name}' {message}"
+
+
+class FakeSandbox:
+    """Futures resolved with the given results in submission order; None leaves that one queued"""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.futures = []
+
+    def submit_snake_behavior(self, files, scenario):
+        future = Future()
+        result = self.results[len(self.futures)]
+        if result is not None:
+            future.set_running_or_notify_cancel()
+            future.set_result(result)
+        self.futures.append(future)
+        return future
+
+
+def test_grading_cancels_the_rest_after_the_first_failure():
+    quest = next(quest for quest in QUESTS if len(quest['behavior']['scenarios']) == 3)
+    failure = "Behavior check 'long game' failed at tick 84: ..."
+    sandbox = FakeSandbox([('25', '', None, None), ('84', '', failure, None), None])
+    assert grade_snake_behavior(sandbox, SNAKEDEBUG, quest) == (False, failure)
+    passed, failed, queued = sandbox.futures
+    assert not passed.cancelled() and not failed.cancelled()
+    assert queued.cancelled()
+
+
+def test_grading_on_the_sandbox():
+    quest = next(quest for quest in QUESTS if quest['behavior']['scenarios'][0]['name'] == 'moves right')
+    sandbox = grading_sandbox.GradingSandbox(size=1)
+    try:
+        assert grade_snake_behavior(sandbox, SNAKEDEBUG, quest) == (True, None)
+        success, error = grade_snake_behavior(sandbox, NEVER_MOVES, quest)
+        assert not success
+        assert error.startswith("Behavior check 'moves right' failed at tick 2")
+    finally:
+        sandbox.shutdown()
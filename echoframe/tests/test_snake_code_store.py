@@ -0,0 +1,90 @@
+import json
+import os
+
+from snake_code_store import MANIFEST_NAME, SnakeCodeStore, _write_atomic
+
+
+def _manifest_path(store, echo_level, username='alice'):
+    return os.path.join(store.echo_dir(username, echo_level), MANIFEST_NAME)
+
+
+def _write_legacy(store, echo_level, files, username='alice'):
+    echo_dir = store.echo_dir(username, echo_level)
+    os.makedirs(echo_dir, exist_ok=True)
+    for filename, source in files.items():
+        with open(os.path.join(echo_dir, filename), 'w', encoding='utf-8') as f:
+            f.write(source)
+    return echo_dir
+
+
+def test_unchanged_write_touches_nothing(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    assert store.write('alice', 1, {'snake.py': 'x = 1\n'}) is True
+    st = os.stat(_manifest_path(store, 1))
+    assert store.write('alice', 1, {'snake.py': 'x = 1\n'}) is False
+    assert os.stat(_manifest_path(store, 1)).st_mtime_ns == st.st_mtime_ns
+    assert store.get_stats()['writes_skipped'] == 1
+    assert store.read('alice', 1) == {'snake.py': 'x = 1\n'}
+
+
+def test_write_keeps_other_files_and_reuses_blobs(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    store.write('alice', 1, {'snake.py': 'x = 1\n', 'constants.py': 'GRID_WIDTH = 30\n'})
+    store.write('alice', 1, {'snake.py': 'x = 2\n'})
+    assert store.read('alice', 1) == {'snake.py': 'x = 2\n', 'constants.py': 'GRID_WIDTH = 30\n'}
+    store.write('alice', 2, {'constants.py': 'GRID_WIDTH = 30\n'}) # Same content in another echo
+    assert store.get_stats()['blobs_reused'] == 1
+
+
+def test_legacy_files_are_read_then_imported_and_deleted(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    echo_dir = _write_legacy(store, 3, {'snake.py': 'old = 1\n', 'constants.py': 'GRID_WIDTH = 30\n'})
+    assert store.read('alice', 3) == {'constants.py': 'GRID_WIDTH = 30\n', 'snake.py': 'old = 1\n'}
+    assert store.get_stats()['legacy_reads'] == 1
+
+    assert store.write('alice', 3, {'snake.py': 'new = 1\n'}) is True
+    assert store.read('alice', 3) == {'constants.py': 'GRID_WIDTH = 30\n', 'snake.py': 'new = 1\n'}
+    assert sorted(os.listdir(echo_dir)) == [MANIFEST_NAME] # The plain files now live in the blobs
+
+
+def test_unchanged_write_still_imports_legacy_files(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    echo_dir = _write_legacy(store, 3, {'snake.py': 'old = 1\n'})
+    assert store.write('alice', 3, {'snake.py': 'old = 1\n'}) is True
+    assert sorted(os.listdir(echo_dir)) == [MANIFEST_NAME]
+    assert store.read('alice', 3) == {'snake.py': 'old = 1\n'}
+
+
+def test_replace_drops_files_not_given(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    store.write('alice', 1, {'snake.py': 'x = 1\n', 'food.py': 'y = 1\n'})
+    assert store.write('alice', 1, {'snake.py': 'x = 1\n'}, replace=True) is True
+    assert store.read('alice', 1) == {'snake.py': 'x = 1\n'}
+
+
+def test_replace_does_not_import_legacy_files(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    echo_dir = _write_legacy(store, 2, {'food.py': 'y = 1\n'})
+    store.write('alice', 2, {'snake.py': 'x = 1\n'}, replace=True)
+    assert store.read('alice', 2) == {'snake.py': 'x = 1\n'}
+    assert sorted(os.listdir(echo_dir)) == [MANIFEST_NAME]
+
+
+def test_manifest_rewritten_elsewhere_is_not_served_from_cache(tmp_path):
+    store = SnakeCodeStore(str(tmp_path))
+    other = SnakeCodeStore(str(tmp_path)) # E.g. another server process
+    store.write('alice', 1, {'snake.py': 'x = 1\n'})
+    assert store.read('alice', 1) == {'snake.py': 'x = 1\n'}
+    assert store.read('alice', 1) == {'snake.py': 'x = 1\n'}
+    assert store.get_stats()['manifest_hits'] >= 1
+
+    path = _manifest_path(store, 1)
+    before = os.stat(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['files'] = other.put_files('alice', {'snake.py': 'x = 2\n'}) # Another process saves new code
+    _write_atomic(path, json.dumps(manifest, indent=1).encode('utf-8'))
+    # Same size, and on a coarse filesystem clock the same mtime: only the inode tells them apart
+    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+    assert os.stat(path).st_size == before.st_size
+    assert store.read('alice', 1) == {'snake.py': 'x = 2\n'}
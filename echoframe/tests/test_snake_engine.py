@@ -0,0 +1,139 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from headless_pygame import HeadlessPygame
+from snake_engine import DIRECTION_CODES, DIRECTIONS, NO_INPUT, SnakeEngine, food_seeking_directions
+from student_imports import StudentFiles
+
+SNAKEDEBUG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snakedebug')
+
+
+@pytest.fixture(scope='module')
+def reference():
+    """Snake and Food from snakedebug/, imported headless; the shims are removed afterwards"""
+    files = {}
+    for name in ('constants.py', 'snake_class.py', 'food.py'):
+        with open(os.path.join(SNAKEDEBUG_DIR, name), 'r', encoding='utf-8') as f:
+            files[name] = f.read()
+    shim = HeadlessPygame().install()
+    student_files = StudentFiles(files).install()
+    try:
+        import food
+        import snake_class
+        yield snake_class.Snake, food.Food
+    finally:
+        student_files.uninstall()
+        shim.uninstall()
+
+
+def _state(snake, food, score, game_over):
+    return {'snake': [list(p) for p in snake.positions], 'food': list(food.position),
+            'score': score, 'game_over': game_over, 'direction': snake.direction}
+
+
+def lockstep(reference, seed, inputs, ticks, body=None, food_at=None, games=1):
+    """
+    Step the engine (python food mode) and snakedebug's classes side by side.
+
+    Args:
+        inputs: {tick: direction} for every game, or a callable(engine) -> direction codes per tick
+        body: Starting snake, head first (default: Snake.__init__'s)
+        food_at: Starting food cell (default: Food.__init__'s)
+
+    Returns:
+        One list of per-tick states per game (the same for both, or the test fails)
+    """
+    Snake, Food = reference
+    engine = SnakeEngine(games, seed=seed, food_mode='python')
+    refs = []
+    for i in range(games):
+        random.seed(seed + i)
+        snake, food = Snake(), Food()
+        if body is not None:
+            snake.positions = list(body)
+            engine.load_game(i, body, food_at or food.position)
+        if food_at is not None:
+            food.position = food_at
+            engine.food_x[i], engine.food_y[i] = food_at
+        refs.append([snake, food, 0, False, random.getstate()])
+
+    trajectories = [[] for _ in range(games)]
+    for t in range(ticks):
+        if callable(inputs):
+            directions = inputs(engine)
+        else:
+            code = DIRECTION_CODES[inputs[t]] if t in inputs else NO_INPUT
+            directions = np.full(games, code, dtype=np.int8)
+        engine.step(directions)
+        for i, ref in enumerate(refs):
+            snake, food, score, game_over, rng_state = ref
+            random.setstate(rng_state) # Each game has its own random stream, like engine._py_rngs
+            # snake.py's loop: input, update, collisions, food
+            if not game_over:
+                if directions[i] != NO_INPUT:
+                    snake.change_direction(DIRECTIONS[directions[i]])
+                snake.update()
+                if snake.check_wall_collision() or snake.check_self_collision():
+                    game_over = True
+                if snake.positions[0] == food.position:
+                    snake.grow()
+                    food.reset_position(snake.positions)
+                    score += 1
+            refs[i] = [snake, food, score, game_over, random.getstate()]
+            expected = _state(snake, food, score, game_over)
+            got = engine.game_state(i)
+            del got['grid_width'], got['grid_height']
+            assert got == expected, f"game {i} differs at tick {t}"
+            trajectories[i].append(expected)
+    return trajectories
+
+
+def test_wall_hit(reference):
+    (states,) = lockstep(reference, seed=1, inputs={0: 'UP'}, ticks=20, food_at=(0, 0))
+    assert [s['game_over'] for s in states].index(True) == 15 # Head (15, -1) after 16 moves up
+    assert states[-1] == states[15] # Nothing moves once the game is over
+
+
+def test_self_hit(reference):
+    body = [(10, 10), (9, 10), (8, 10), (7, 10), (6, 10)]
+    (states,) = lockstep(reference, seed=2, inputs={0: 'DOWN', 1: 'LEFT', 2: 'UP'}, ticks=5,
+                         body=body, food_at=(0, 0))
+    assert [s['game_over'] for s in states] == [False, False, True, True, True]
+    assert states[2]['snake'][0] == [9, 10]
+
+
+def test_moving_into_the_tail_is_not_a_hit(reference):
+    body = [(10, 10), (9, 10), (9, 11), (10, 11)]
+    (states,) = lockstep(reference, seed=3, inputs={0: 'DOWN', 1: 'LEFT', 2: 'UP', 3: 'RIGHT'}, ticks=8,
+                         body=body, food_at=(0, 0))
+    assert not any(s['game_over'] for s in states)
+
+
+def test_growth_and_food_respawn(reference):
+    (states,) = lockstep(reference, seed=4, inputs={}, ticks=5, food_at=(17, 15))
+    assert [len(s['snake']) for s in states] == [1, 1, 2, 2, 2] # Grows on the tick after eating
+    assert [s['score'] for s in states] == [0, 1, 1, 1, 1]
+    assert states[1]['food'] != [17, 15]
+    assert states[1]['food'] not in states[1]['snake']
+
+
+def test_seeded_food_seeking_games(reference):
+    rng = np.random.default_rng(5)
+    trajectories = lockstep(reference, seed=5, inputs=lambda engine: food_seeking_directions(engine, rng),
+                            ticks=300, games=8)
+    assert max(t[-1]['score'] for t in trajectories) >= 3 # Several respawns were compared
+    assert any(t[-1]['game_over'] for t in trajectories)
+
+
+def test_food_respawn_skips_a_long_snake(reference):
+    path = [] # Rows 29 to 10 back and forth, tail first: two thirds of the grid is snake
+    for row, y in enumerate(range(29, 9, -1)):
+        path += [(x, y) for x in (range(30) if row % 2 == 0 else range(29, -1, -1))]
+    body = path[::-1] # Head at (0, 10)
+    trajectories = lockstep(reference, seed=6, inputs={0: 'UP'}, ticks=3, body=body, food_at=(0, 9), games=4)
+    for states in trajectories:
+        assert states[0]['score'] == 1
+        assert states[0]['food'] not in states[0]['snake']
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from snake_features import _text_echo_level, detect_echo_level
+from snake_starters import SNAKE_STARTER_CODE
+
+SNAKEDEBUG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snakedebug')
+
+
+def old_echo_level(files):
+    """The detector before AST features: the substring heuristics, max over the files"""
+    return max([_text_echo_level(code) for code in files.values()] + [0])
+
+
+def _snakedebug_sources():
+    sources = {}
+    for filename in sorted(os.listdir(SNAKEDEBUG_DIR)):
+        if filename.endswith('.py'):
+            with open(os.path.join(SNAKEDEBUG_DIR, filename), 'r', encoding='utf-8') as f:
+                sources[filename] = f.read()
+    return sources
+
+
+SNAKEDEBUG = _snakedebug_sources()
+
+CASES = [(f'starter {i}', files) for i, files in enumerate(SNAKE_STARTER_CODE)]
+CASES += [(f'snakedebug/{filename}', {filename: code}) for filename, code in SNAKEDEBUG.items()]
+CASES += [('snakedebug', SNAKEDEBUG)]
+
+# name -> (old level, new level): where the substring heuristics matched by accident
+DELIBERATE_DIFFERENCES = {
+    'starter 0': (1, 0), # The grid constants are still commented out
+    'starter 2': (6, 5), # 'eat' in "Create a snake instance" isn't growth
+}
+
+
+@pytest.mark.parametrize('name,files', CASES, ids=[name for name, _ in CASES])
+def test_matches_old_heuristic(name, files):
+    expected = DELIBERATE_DIFFERENCES.get(name)
+    assert (old_echo_level(files), detect_echo_level(files)) == (expected or (old_echo_level(files),) * 2)
+
+
+GAME_LOOP = "import pygame\npygame.init()\nwhile True:\n    pygame.display.{}()\n"
+
+# (description, source, old level, new level)
+RULE_CHANGES = [
+    ('display.update refreshes the loop too', GAME_LOOP.format('update'), 0, 2),
+    ('display.flip', GAME_LOOP.format('flip'), 2, 2),
+    ('restart in a string', "msg = 'Press R to restart'\n", 9, 9),
+    ('restart identifier', "def restart():\n    pass\n", 9, 9),
+    ('restart in a comment', "# restart later\nx = 1\n", 9, 0),
+    ('game over text', "print('GAME OVER')\n", 9, 9),
+    ('grow in a comment', "food = 1\n# grow the snake\n", 6, 0),
+    ('grow call', "food = 1\nsnake.grow()\n", 6, 6),
+    ('collision without wall/self text', "def check_collision(a, b):\n    return a == b\n", 0, 8),
+]
+
+
+@pytest.mark.parametrize('description,source,old,new', RULE_CHANGES, ids=[c[0] for c in RULE_CHANGES])
+def test_rule_changes(description, source, old, new):
+    files = {'snake.py': source}
+    assert old_echo_level(files) == old
+    assert detect_echo_level(files) == new
+
+
+def test_unparsable_file_uses_old_heuristic():
+    files = {'snake.py': "class Snake:\n    def draw(self:\n", 'constants.py': "GRID_WIDTH = 30\n"}
+    assert detect_echo_level(files) == old_echo_level(files) == 3
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from snake_code_store import BLOBS_DIR, SnakeCodeStore
+from snake_history import HISTORY_INDEX, HISTORY_LOG, HISTORY_MAX_PAGE_SIZE, SubmissionHistory
+from user_paths import snake_code_dir
+
+
+@pytest.fixture
+def history(tmp_path):
+    return SubmissionHistory(SnakeCodeStore(str(tmp_path)))
+
+
+def _user_file(history, name, username='alice'):
+    return os.path.join(snake_code_dir(username, history.store.root), name)
+
+
+def test_torn_index_entry_is_dropped_by_the_next_record(history):
+    history.record('alice', {'snake.py': 'v = 1\n'})
+    history.record('alice', {'snake.py': 'v = 2\n'})
+    with open(_user_file(history, HISTORY_INDEX), 'ab') as f:
+        f.write(b'\x07\x00\x00') # Crash in the middle of writing version 3's offset
+    with open(_user_file(history, HISTORY_LOG), 'ab') as f:
+        f.write(b'{"v":3,"torn":true}\n') # Its log line did make it
+    assert history.count('alice') == 2
+
+    assert history.record('alice', {'snake.py': 'v = 3\n'}) == 3
+    assert os.path.getsize(_user_file(history, HISTORY_INDEX)) == 3 * 8
+    assert [history.restore('alice', v)[1] for v in (1, 2, 3)] == \
+        [{'snake.py': 'v = 1\n'}, {'snake.py': 'v = 2\n'}, {'snake.py': 'v = 3\n'}]
+
+
+def test_pages_are_newest_first_and_clamped(history):
+    for i in range(1, 26):
+        history.record('alice', {'snake.py': f'v = {i}\n'}, qid=i)
+
+    page = history.page('alice', 1, 10)
+    assert (page['total'], page['pages']) == (25, 3)
+    assert [entry['v'] for entry in page['versions']] == list(range(25, 15, -1))
+    assert page['versions'][0]['files'] == ['snake.py'] # Names only, no code
+
+    last = history.page('alice', 3, 10)
+    assert [entry['v'] for entry in last['versions']] == [5, 4, 3, 2, 1]
+    assert history.page('alice', 99, 10)['page'] == 3 # Past the end: the last page
+    assert history.page('alice', 0, 10)['page'] == 1
+    assert history.page('alice', 1, 0)['per_page'] == 1
+    assert history.page('alice', 1, 10 * HISTORY_MAX_PAGE_SIZE)['per_page'] == HISTORY_MAX_PAGE_SIZE
+
+
+def test_empty_history_page(history):
+    page = history.page('nobody')
+    assert (page['total'], page['page'], page['pages'], page['versions']) == (0, 1, 1, [])
+    assert history.get('nobody', 1) is None
+
+
+def test_restore_shares_blobs_between_versions(history):
+    constants = 'GRID_WIDTH = 30\n'
+    history.record('alice', {'constants.py': constants, 'snake.py': 'v = 1\n'})
+    history.record('alice', {'constants.py': constants, 'snake.py': 'v = 2\n'})
+    history.record('alice', {'constants.py': constants, 'snake.py': 'v = 1\n'})
+    assert len(os.listdir(_user_file(history, BLOBS_DIR))) == 3 # constants.py once, snake.py twice
+
+    fresh = SubmissionHistory(SnakeCodeStore(history.store.root)) # Nothing cached: read from the blobs
+    entry, files = fresh.restore('alice', 3)
+    assert entry['v'] == 3
+    assert files == {'constants.py': constants, 'snake.py': 'v = 1\n'}
+    assert fresh.restore('alice', 1)[1] == files
+    assert fresh.restore('alice', 4) == (None, None)
+
+
+def test_restore_with_a_missing_blob(history):
+    history.record('alice', {'snake.py': 'v = 1\n'})
+    blobs_dir = _user_file(history, BLOBS_DIR)
+    for name in os.listdir(blobs_dir):
+        os.remove(os.path.join(blobs_dir, name))
+    fresh = SubmissionHistory(SnakeCodeStore(history.store.root))
+    assert fresh.restore('alice', 1) == (None, None)
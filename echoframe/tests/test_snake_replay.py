@@ -0,0 +1,91 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import student_driven_snake as sds
+from snake_replay import _HEADER, _RECORD, DIRECTIONS, REPLAY_EXTENSION, read_replay
+
+ECHOFRAME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Food placement and turns depend on the seeded `random` and on the directions the preview returns
+PROGRAM = """
+import random
+snake = [[5, 5]]
+food = [random.randint(0, 29), random.randint(0, 19)]
+score = 0
+for _ in range(40):
+    direction = get_user_direction()
+    x, y = snake[0]
+    dx, dy = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}[direction]
+    snake = [[(x + dx) % 30, (y + dy) % 20]]
+    if random.random() < 0.2:
+        food = [random.randint(0, 29), random.randint(0, 19)]
+        score += 1
+"""
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.errors = []
+
+    def emit(self, event, data, room=None):
+        if event == 'preview_error':
+            self.errors.append(data['error'])
+
+
+def _replay(path):
+    """Run the replayer the way an operator would (its own process, so the headless runtime stays out of pytest)"""
+    return subprocess.run([sys.executable, 'snake_replay.py', path], cwd=ECHOFRAME_DIR,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.fixture(scope='module')
+def recording(tmp_path_factory):
+    """One preview run through the real worker pool and scheduler, with arrow keys pressed along the way"""
+    replay_dir = str(tmp_path_factory.mktemp('replays'))
+    socketio = FakeSocketIO()
+    sid = 'replay-test-sid'
+    keys = threading.Thread(target=lambda: [
+        (threading.Event().wait(0.15), sds.handle_direction_input(sid, direction))
+        for direction in ('DOWN', 'LEFT', 'UP', 'RIGHT', 'DOWN')])
+    keys.start()
+    try:
+        sds.run_student_snake(socketio, sid, {'main.py': PROGRAM}, 1, replay_dir=replay_dir)
+    finally:
+        keys.join()
+        sds.drop_session(sid)
+        sds.get_preview_pool().shutdown()
+    assert socketio.errors == []
+    (name,) = [n for n in os.listdir(replay_dir) if n.endswith(REPLAY_EXTENSION)]
+    return os.path.join(replay_dir, name)
+
+
+def test_recorded_session_replays_identically(recording):
+    replay = read_replay(recording)
+    assert replay['end_reason'] == 'finished'
+    assert len(replay['frames']) >= 39 # Every get_user_direction() call but the last
+    assert len({direction for direction, _crc in replay['frames']}) > 1 # The key presses got through
+    result = _replay(recording)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert f"Identical: {len(replay['frames'])} frames" in result.stdout
+
+
+def test_changed_input_log_is_detected(recording, tmp_path):
+    replay_dir = str(tmp_path / 'replays')
+    shutil.copytree(os.path.dirname(recording), replay_dir) # With the files snapshot
+    path = os.path.join(replay_dir, os.path.basename(recording))
+    tick = 10
+    direction = read_replay(path)['frames'][tick][0]
+    changed = 'UP' if direction != 'UP' else 'DOWN'
+    with open(path, 'r+b') as f:
+        f.seek(_HEADER.size + tick * _RECORD.size + 1) # The direction code of frame `tick`
+        f.write(bytes([DIRECTIONS.index(changed)]))
+    assert read_replay(path)['frames'][tick][0] == changed
+
+    result = _replay(path)
+    assert result.returncode == 1
+    assert f"Diverged at frame {tick + 1} of" in result.stdout # The state after the changed direction
@@ -0,0 +1,119 @@
+"""
+user_paths.py - Where each user's files live under user_data/.
+
+Flat directories with tens of thousands of entries make listing, backups and even stat slow,
+so per-user files go into a two-level hashed shard layout:
+
+    user_data/<aa>/<bb>/<user>.json                    (JSON storage backend)
+    user_data/intro_markers/<aa>/<bb>/<user>.seen       (old intro flags, imported at startup)
+    user_data/snake_code/<aa>/<bb>/<user>/snake_echo_N/
+    user_data/replays/<aa>/<bb>/<user>/                 (recorded previews, see snake_replay.py)
+
+aa and bb are the first four hex digits of sha1(<entry name>), so a shard directory holds
+about 1/65536 of the users. Data written before the switch is still in the flat place
+(user_data/<user>.json, ...). Every lookup goes through locate(): the sharded path if it
+exists, otherwise the flat one if that exists, otherwise the sharded one (new data). A user
+that hasn't been migrated keeps reading and writing the flat path, so one user's data is never
+split across both layouts. `python migrate_storage.py --shard` moves entries with renames
+while the server runs.
+"""
+import hashlib
+import os
+import re
+
+USER_DATA_DIR = 'user_data'
+SHARDED_LAYOUT = True # False puts new data in the flat layout again
+INTRO_MARKERS = 'intro_markers'
+SNAKE_CODE = 'snake_code'
+REPLAYS = 'replays'
+
+_SHARD_RE = re.compile(r'^[0-9a-f]{2}$')
+
+
+def safe_username(username):
+    """The storage key for a username: characters that might cause issues in filenames removed"""
+    return "".join(c for c in username if c.isalnum() or c in "._- ")
+
+
+def is_shard_name(name):
+    return bool(_SHARD_RE.match(name))
+
+
+def shard_parts(name):
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return digest[0:2], digest[2:4]
+
+
+def sharded_path(root, name):
+    return os.path.join(root, *shard_parts(name), name)
+
+
+def locate(root, name):
+    """Path of entry `name` under root (see module docstring for the lookup order)"""
+    flat = os.path.join(root, name)
+    if not SHARDED_LAYOUT:
+        return flat
+    sharded = sharded_path(root, name)
+    if os.path.exists(sharded):
+        return sharded
+    # A flat directory named like a shard ("ab") is a shard; such users are found once migrated
+    if os.path.exists(flat) and not (is_shard_name(name) and os.path.isdir(flat)):
+        return flat
+    return sharded
+
+
+def user_json_path(username, root=USER_DATA_DIR):
+    return locate(root, f"{safe_username(username)}.json")
+
+
+def intro_marker_path(username, root=USER_DATA_DIR):
+    return locate(os.path.join(root, INTRO_MARKERS), f"{safe_username(username)}.seen")
+
+
+def snake_code_dir(username, root=USER_DATA_DIR):
+    """The user's snake code directory (holding snake_echo_N/), not created here"""
+    return locate(os.path.join(root, SNAKE_CODE), username)
+
+
+def snake_echo_dir(username, echo_level, root=USER_DATA_DIR):
+    """Directory of one echo level (0-based echo_level -> snake_echo_<echo_level + 1>)"""
+    return os.path.join(snake_code_dir(username, root), f'snake_echo_{echo_level + 1}')
+
+
+def replay_dir(username, root=USER_DATA_DIR):
+    """Directory the user's preview replays are recorded in, not created here"""
+    return locate(os.path.join(root, REPLAYS), safe_username(username))
+
+
+def iter_entries(root, want_dirs=False, suffix=None):
+    """
+    Yield (name, path) for every entry under root in either layout, sorted by name.
+
+    Args:
+        root: Tree root (user_data, user_data/intro_markers, user_data/snake_code, user_data/replays)
+        want_dirs: Yield directories (snake code) instead of files
+        suffix: Only entries ending in suffix (e.g. '.json')
+    """
+    if not os.path.isdir(root):
+        return
+    found = {}
+
+    def consider(directory, name):
+        path = os.path.join(directory, name)
+        if (os.path.isdir(path) if want_dirs else os.path.isfile(path)) and (suffix is None or name.endswith(suffix)):
+            found.setdefault(name, path) # The sharded copy (seen first) wins, as in locate()
+
+    for first in sorted(os.listdir(root)):
+        first_path = os.path.join(root, first)
+        if not (is_shard_name(first) and os.path.isdir(first_path)):
+            continue
+        for second in sorted(os.listdir(first_path)):
+            second_path = os.path.join(first_path, second)
+            if is_shard_name(second) and os.path.isdir(second_path):
+                for name in os.listdir(second_path):
+                    consider(second_path, name)
+    for name in os.listdir(root):
+        if not (is_shard_name(name) and os.path.isdir(os.path.join(root, name))):
+            consider(root, name)
+    for name in sorted(found):
+        yield name, found[name]